@@ -1,4 +1,5 @@
 import girderRest from 'platform/web-girder/plugins/girder';
+import type { GirderJob } from '@girder/components/src';
 
 const rootAPI = 'UMD_dataset';
 function ingestVideo(folderId: string) {
@@ -17,6 +18,58 @@ async function createFilterFolder(folderId: string) {
   return false;
 }
 
+export type UMDExportJob = GirderJob & {
+  _id: string;
+  status: number;
+  progress?: { current: number; total: number; message?: string };
+  meta: { umdExportKey?: string; umdExportItemId?: string };
+};
+// girder_jobs JobStatus values of jobs that have finished
+const JobSuccess = 3;
+const JobFinishedStatuses = [JobSuccess, 4, 5];
+
+async function startExportJob(folderIds: string[], ta2Only = false) {
+  const result = await girderRest.post<UMDExportJob>(`${rootAPI}/export_job`, null, {
+    params: { folderIds: JSON.stringify(folderIds), ta2Only },
+  });
+  return result.data;
+}
+
+async function startRecursiveExportJob(folderId: string, applyFilter = false, ta2Only = false) {
+  const result = await girderRest.post<UMDExportJob>(
+    `${rootAPI}/recursive_export_job/${folderId}`,
+    null,
+    { params: { applyFilter, ta2Only } },
+  );
+  return result.data;
+}
+
+/**
+ * Poll the export job until it finishes, returning the id of the exported zip
+ * item or null if the job failed.
+ */
+async function waitForExportJob(
+  job: UMDExportJob,
+  onProgress?: (job: UMDExportJob) => void,
+  interval = 2000,
+) {
+  let current = job;
+  while (!JobFinishedStatuses.includes(current.status)) {
+    // eslint-disable-next-line no-await-in-loop
+    await new Promise((resolve) => setTimeout(resolve, interval));
+    // eslint-disable-next-line no-await-in-loop
+    current = (await girderRest.get<UMDExportJob>(`job/${current._id}`)).data;
+    if (onProgress) {
+      onProgress(current);
+    }
+  }
+  const itemId = current.meta?.umdExportItemId;
+  if (current.status === JobSuccess && itemId) {
+    return itemId;
+  }
+  return null;
+}
+
 type TA2NormMap = { named: string; id: number; groups: string[] };
 export interface TA2Config {
   normMap: TA2NormMap[];
@@ -38,4 +91,7 @@ export {
   createFilterFolder,
   getUMDTA2Config,
   putUMDTA2Config,
+  startExportJob,
+  startRecursiveExportJob,
+  waitForExportJob,
 };
@@ -11,10 +11,10 @@ from girder.models.setting import Setting
 from girder.models.user import User
 from girder.settings import SettingKey
 from girder.utility.mail_utils import renderTemplate, sendMail
-from girder.models.token import Token
-from UMD_tasks import constants, tasks
-from girder_jobs.models.job import Job
-from dive_server import crud_annotation
+from UMD_tasks import constants
+from UMD_tasks.utils import parse_session_name
+from UMD_utils.UMD_ingest import generate_segment_task
+from UMD_utils.UMD_summary import update_summary
 
 from dive_utils import asbool, fromMeta
 from dive_utils.constants import (
@@ -30,40 +30,6 @@ from dive_utils.constants import (
     videoRegex,
 )
 
-def generate_segment_task(folder, user):
-        token = Token().createToken(user=user, days=2)
-        videoItems = Folder().childItems(
-            folder, user=user, filters={"lowerName": {"$regex": constants.videoRegex}}
-        )
-        folder['meta']['type'] = 'video'
-        Folder().save(folder)
-        tracks = crud_annotation.TrackItem().list(folder)
-
-        if len(list(tracks)) == 0:
-            for item in videoItems:
-                newjob = tasks.generate_splits.delay(
-                    folderId=str(item["folderId"]),
-                    itemId=str(item["_id"]),
-                    user_id=str(user["_id"]),
-                    user_login=str(user["login"]),
-                    girder_job_title="Generating Tracks for UMD video",
-                    girder_client_token=str(token["_id"]),
-                )
-                Job().save(newjob.job)
-        else: 
-            originalFPS = folder['meta'][constants.OriginalFPSMarker]
-            originalFPSString = folder['meta'][constants.OriginalFPSStringMarker]
-            for item in videoItems:
-                if item['meta'].get('source_video', None) is None:
-                    data = {
-                        'source_video': False,
-                        'transcoder': 'ffmpeg',
-                        'originalFps': originalFPS,
-                        'originalFpsString': originalFPSString,
-                        'codec': 'h264'
-                    }
-                    item['meta'].update(data)
-                    Item().save(item)
 
 def process_assetstore_import(event, meta: dict):
     """
@@ -126,6 +92,7 @@ def process_assetstore_import(event, meta: dict):
                     FPSMarker: DefaultVideoFPS,
                     DatasetMarker: True,
                     AssetstoreSourcePathMarker: root,
+                    constants.SessionMarker: parse_session_name(folder['name']),
                     **meta,
                 }
             )
@@ -135,4 +102,18 @@ def process_assetstore_import(event, meta: dict):
 
 
 def process_s3_import(event):
-    return process_assetstore_import(event, {AssetstoreSourceMarker: 's3'})
\ No newline at end of file
+    return process_assetstore_import(event, {AssetstoreSourceMarker: 's3'})
+
+def process_annotation_save(event):
+    """Refresh the annotation summary of a dataset after its annotations are saved"""
+    folderId = event.info.get('id', None) or event.info['params'].get('folderId', None)
+    if folderId is None:
+        return
+    folder = Folder().load(folderId, force=True)
+    if folder is None:
+        return
+    try:
+        update_summary(folder)
+    except Exception:
+        # the summary is rebuilt on its next read if the annotation revision changed
+        logger.exception(f'Failed to update the annotation summary of {folderId}')
@@ -1,6 +1,5 @@
 import os
 
-from dive_server import crud_annotation
 from dive_utils import setContentDisposition
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute
@@ -8,39 +7,23 @@ from girder.exceptions import RestException
 from girder.api.rest import Resource, getApiUrl
 from girder.constants import AccessType, TokenScope
 from girder.models.folder import Folder
-from girder.models.item import Item
-from girder.models.file import File
 from girder.models.token import Token
-from girder.models.user import User
 from girder_jobs.models.job import Job
 import requests
 
-from UMD_tasks import constants, tasks
+from UMD_tasks import tasks
 from UMD_utils import UMD_export
+from UMD_utils.UMD_cache import export_fragment_cache
+from UMD_utils.UMD_changepoint import mark_changepoints_complete
+from UMD_utils.UMD_export_job import create_export_job
+from UMD_utils.UMD_filter import filter_file_versions, filter_files, load_filter_map
+from UMD_utils.UMD_folders import dataset_folders
+from UMD_utils.UMD_ingest import generate_segment_task, probe_token, segment_videos
+from UMD_utils.UMD_parquet import EXPORT_FORMATS
+from UMD_utils.UMD_session import create_backfill_job
+from UMD_utils.UMD_summary import SUMMARY_BATCH_SIZE, update_summaries
+from UMD_utils.UMD_users import UserMap
 from UMD_utils.constants import AnnotationFilterMarker
-from UMD_utils import TRUTHY_META_VALUES
-
-
-def mapUserIds(users):
-    userMap = {}
-    conflictMap = {}
-    for item in users:
-        base_uid = int(str(item["_id"]), 16)
-        # lets grab the last 5 digits
-        uid = int(str(base_uid)[-5:])
-        while uid in conflictMap.keys():  # ensure a unique ID
-            uid = uid + 1
-        conflictMap[uid] = True
-        userMap[item["login"]] = {
-            'id': str(item["_id"]),
-            'login': item['login'],
-            'email': item['email'],
-            'first': item['firstName'],
-            'last': item['lastName'],
-            'uid': uid,
-            'girderId': str(item["_id"])
-        }
-    return userMap
 
 
 class UMD_Dataset(Resource):
@@ -52,22 +35,23 @@ class UMD_Dataset(Resource):
         self.route("POST", ("recursive_ingest_video", ":folder"), self.recursive_ingest_video)
         self.route("GET", ("export",), self.export_tabular)
         self.route("GET", ("recursive_export", ":folder"), self.export_resursive_tabular)
+        self.route("POST", ("recursive_export", ":folder"), self.export_recursive_delta)
+        self.route("POST", ("export_job",), self.export_tabular_job)
+        self.route("POST", ("recursive_export_job", ":folder"), self.export_recursive_tabular_job)
         self.route("GET", ("links", ":folder"), self.export_links)
         self.route("POST", ("update_containers",), self.update_containers)
         self.route("POST", ("mark_changepoint_complete",), self.mark_changepoint_complete)
+        self.route("POST", ("changepoint_complete",), self.bulk_changepoint_complete)
         self.route("POST", ("filter", ":folder"), self.create_filter_folder)
+        self.route("DELETE", ("export_cache",), self.purge_export_cache)
+        self.route("POST", ("annotation_summary", ":folder"), self.rebuild_annotation_summary)
+        self.route("POST", ("session_metadata",), self.backfill_session_metadata)
 
-    def recursive_folder_list(self, folder, totalFolders, ta2Folders):
-        subFolders = Folder().childFolders(folder, 'folder', user=self.getCurrentUser())
-        subFolders = sorted(subFolders, key=lambda d: d['created'])
-        for data in subFolders:
-            if data['meta'].get('UMDAnnotation', False) == 'TA2':
-                ta2Folders.append(data)
-            elif data['meta'].get('annotate', False) == True:
-                totalFolders.append(data)
-            else:
-                self.recursive_folder_list(data, totalFolders, ta2Folders)
-        return totalFolders, ta2Folders
+    def recursive_export_folder_ids(self, folder):
+        totalFolders, ta2Folders = dataset_folders(folder, self.getCurrentUser())
+        totalFolderIds = [str(item['_id']) for item in totalFolders]
+        totalTA2FolderIds = [str(item['_id']) for item in ta2Folders]
+        return totalFolderIds, totalTA2FolderIds
 
     @access.public(scope=TokenScope.DATA_READ, cookie=True)
     @autoDescribeRoute(
@@ -83,10 +67,7 @@ class UMD_Dataset(Resource):
         self,
         folder,
     ):
-        totalFolders = []
-        ta2Folders = []
-        totalFolders, ta2Folders = self.recursive_folder_list(folder, totalFolders, ta2Folders)
-        totalFolders = sorted(totalFolders, key=lambda d: d['created'])
+        totalFolders, _ = dataset_folders(folder, self.getCurrentUser())
         replacedHostname = getApiUrl().replace('/api/v1', '/#').replace('http', 'https')
         gen = UMD_export.generate_links_tab(replacedHostname, totalFolders)
         setContentDisposition('FolderLinks.csv', mime='text/csv')
@@ -109,22 +90,52 @@ class UMD_Dataset(Resource):
             dataType="boolean",
             default=False,
         )
+        .param(
+            "allUsers",
+            "Include every user in userMap.tab instead of only the annotators found",
+            paramType="query",
+            dataType="boolean",
+            default=False,
+        )
+        .param(
+            "format",
+            "Format of the data tabs, 'parquet' writes them as typed parquet files",
+            paramType="query",
+            required=False,
+            enum=EXPORT_FORMATS,
+            default='tab',
+        )
+        .param(
+            "profile",
+            "Add a sampling profile of the export to manifest.json, admins only",
+            paramType="query",
+            dataType="boolean",
+            default=False,
+        )
 
     )
     def export_tabular(
         self,
         folderIds,
-        ta2Only
+        ta2Only,
+        allUsers,
+        format,
+        profile,
     ):
         user = self.getCurrentUser()
-        users = list(User().find())
-        userMap = mapUserIds(users)
+        if profile:
+            self.requireAdmin(user)
+        userMap = UserMap()
         try:
             if not ta2Only:
-                gen = UMD_export.convert_to_zips(folderIds, userMap, user, None)
+                gen = UMD_export.convert_to_zips(
+                    folderIds, userMap, user, None, allUsers, format=format, profile=profile
+                )
                 zip_name = "batch_export.zip"
             elif ta2Only:
-                gen = UMD_export.convert_to_zips_TA2(folderIds, userMap, user)
+                gen = UMD_export.convert_to_zips_TA2(
+                    folderIds, userMap, user, allUsers, format=format, profile=profile
+                )
                 zip_name = "batch_export.zip"
             if len(folderIds) > 1:
                 zip_name = "batch_export.zip"
@@ -161,51 +172,155 @@ class UMD_Dataset(Resource):
                 dataType="boolean",
                 default=False,
             )
+            .param(
+                "allUsers",
+                "Include every user in userMap.tab instead of only the annotators found",
+                paramType="query",
+                dataType="boolean",
+                default=False,
+            )
+            .param(
+                "format",
+                "Format of the data tabs, 'parquet' writes them as typed parquet files",
+                paramType="query",
+                required=False,
+                enum=EXPORT_FORMATS,
+                default='tab',
+            )
+            .param(
+                "profile",
+                "Add a sampling profile of the export to manifest.json, admins only",
+                paramType="query",
+                dataType="boolean",
+                default=False,
+            )
 
     )
     def export_resursive_tabular(
         self,
         folder,
         applyFilter,
-        ta2Only
+        ta2Only,
+        allUsers,
+        format,
+        profile,
+    ):
+        return self.recursive_tabular(
+            folder, applyFilter, ta2Only, allUsers, format=format, profile=profile
+        )
+
+    @access.public(scope=TokenScope.DATA_READ, cookie=True)
+    @autoDescribeRoute(
+        Description("Export the annotations changed since an earlier export manifest")
+        .modelParam(
+            "folder",
+            description="FolderId to get state from",
+            model=Folder,
+            level=AccessType.READ,
+            destName="folder",
+        )
+        .jsonParam(
+            "baseManifest",
+            "manifest.json of an earlier export",
+            paramType="body",
+            requireObject=True,
+        )
+        .param(
+            "applyFilter",
+            "Apply Filter file if it exists.",
+            paramType="query",
+            dataType="boolean",
+            default=False,
+        )
+        .param(
+            "ta2Only",
+            "Export TA2 Only",
+            paramType="query",
+            dataType="boolean",
+            default=False,
+        )
+        .param(
+            "allUsers",
+            "Include every user in userMap.tab instead of only the annotators found",
+            paramType="query",
+            dataType="boolean",
+            default=False,
+        )
+        .param(
+            "format",
+            "Format of the data tabs, 'parquet' writes them as typed parquet files",
+            paramType="query",
+            required=False,
+            enum=EXPORT_FORMATS,
+            default='tab',
+        )
+        .param(
+            "profile",
+            "Add a sampling profile of the export to manifest.json, admins only",
+            paramType="query",
+            dataType="boolean",
+            default=False,
+        )
+    )
+    def export_recursive_delta(
+        self, folder, baseManifest, applyFilter, ta2Only, allUsers, format, profile
+    ):
+        return self.recursive_tabular(
+            folder, applyFilter, ta2Only, allUsers, baseManifest, format, profile
+        )
+
+    def recursive_tabular(
+        self,
+        folder,
+        applyFilter,
+        ta2Only,
+        allUsers,
+        baseManifest=None,
+        format='tab',
+        profile=False,
     ):
-        totalFolders = []
-        ta2Folders = []
-        totalFolders, ta2Folders = self.recursive_folder_list(folder, totalFolders, ta2Folders)
-        totalFolders = sorted(totalFolders, key=lambda d: d['created'])
-        ta2Folders = sorted(ta2Folders, key=lambda d: d['created'])
-        totalFolderIds = []
-        totalTA2FolderIds = []
-        for item in totalFolders:
-            totalFolderIds.append(str(item['_id']))
-        for item in ta2Folders:
-            totalTA2FolderIds.append(str(item['_id']))
         user = self.getCurrentUser()
-        users = list(User().find())
-        userMap = mapUserIds(users)
+        if profile:
+            self.requireAdmin(user)
+        totalFolderIds, totalTA2FolderIds = self.recursive_export_folder_ids(folder)
+        userMap = UserMap()
         filterMap = None
-        if applyFilter:
+        filterFiles = []
+        if applyFilter and not ta2Only:
             # get the filter file and create a mapping that can be used
-            filterFolder = Folder().findOne(
-                {
-                    'parentId': folder["_id"],
-                    f'meta.{AnnotationFilterMarker}': {'$in': TRUTHY_META_VALUES},
-                }
-            )
-            if filterFolder:
-                for item in Folder().childItems(filterFolder):
-                    print(item)
-                    for file in Item().childFiles(item):
-                        # we now read in the excel file to create a mapping that can be used for exporting
-                        file_generator = File().download(file, headers=False)()
-                        file_string = b"".join(list(file_generator))
-                        filterMap = UMD_export.create_filter_mapping(file_string)
+            filterFiles = filter_files(folder)
+            filterMap = load_filter_map(filterFiles)
+        filterVersions = filter_file_versions(filterFiles)
+        manifestInfo = {'root': str(folder['_id']), 'filter': filterVersions}
         try:
+            folderIds = totalTA2FolderIds if ta2Only else totalFolderIds
+            delta = None
+            if baseManifest is not None:
+                delta = UMD_export.delta_folders(folderIds, user, baseManifest, filterVersions)
             if not ta2Only:
-                gen = UMD_export.convert_to_zips(totalFolderIds, userMap, user, filterMap)
+                gen = UMD_export.convert_to_zips(
+                    folderIds,
+                    userMap,
+                    user,
+                    filterMap,
+                    allUsers,
+                    manifestInfo=manifestInfo,
+                    delta=delta,
+                    format=format,
+                    profile=profile,
+                )
                 zip_name = "batch_export.zip"
             elif ta2Only:
-                gen = UMD_export.convert_to_zips_TA2(totalTA2FolderIds, userMap, user)
+                gen = UMD_export.convert_to_zips_TA2(
+                    folderIds,
+                    userMap,
+                    user,
+                    allUsers,
+                    manifestInfo=manifestInfo,
+                    delta=delta,
+                    format=format,
+                    profile=profile,
+                )
                 zip_name = "batch_export.zip"
             setContentDisposition(zip_name, mime='application/zip')
             return gen
@@ -214,40 +329,100 @@ class UMD_Dataset(Resource):
 
     
 
-    def generate_segment_task(self, folder, user):
-        token = Token().createToken(user=user, days=2)
-        videoItems = Folder().childItems(
-            folder, user=user, filters={"lowerName": {"$regex": constants.videoRegex}}
+    @access.user
+    @autoDescribeRoute(
+        Description("Export information in tablular form to an item with a job")
+        .jsonParam(
+            "folderIds",
+            "List of folders to filter by",
+            paramType="query",
+            required=True,
+            default=[],
+            requireArray=True,
+        )
+        .param(
+            "ta2Only",
+            "Export TA2 Only",
+            paramType="query",
+            dataType="boolean",
+            default=False,
+        )
+        .param(
+            "allUsers",
+            "Include every user in userMap.tab instead of only the annotators found",
+            paramType="query",
+            dataType="boolean",
+            default=False,
+        )
+        .param(
+            "format",
+            "Format of the data tabs, 'parquet' writes them as typed parquet files",
+            paramType="query",
+            required=False,
+            enum=EXPORT_FORMATS,
+            default='tab',
+        )
+    )
+    def export_tabular_job(self, folderIds, ta2Only, allUsers, format):
+        user = self.getCurrentUser()
+        zip_name = "batch_export.zip"
+        if len(folderIds) == 1:
+            folder = Folder().load(folderIds[0], level=AccessType.READ, user=user)
+            zip_name = f'{folder["name"].replace(".mp4","")}.zip'
+        return Job().filter(
+            create_export_job(user, folderIds, zip_name, ta2Only, allUsers, format=format),
+            user=user,
         )
-        folder['meta']['type'] = 'video'
-        Folder().save(folder)
-        tracks = crud_annotation.TrackItem().list(folder)
 
-        if len(list(tracks)) == 0:
-            for item in videoItems:
-                newjob = tasks.generate_splits.delay(
-                    folderId=str(item["folderId"]),
-                    itemId=str(item["_id"]),
-                    user_id=str(user["_id"]),
-                    user_login=str(user["login"]),
-                    girder_job_title="Generating Tracks for UMD video",
-                    girder_client_token=str(token["_id"]),
-                )
-                Job().save(newjob.job)
-        else: 
-            originalFPS = folder['meta'][constants.OriginalFPSMarker]
-            originalFPSString = folder['meta'][constants.OriginalFPSStringMarker]
-            for item in videoItems:
-                if item['meta'].get('source_video', None) is None:
-                    data = {
-                        'source_video': False,
-                        'transcoder': 'ffmpeg',
-                        'originalFps': originalFPS,
-                        'originalFpsString': originalFPSString,
-                        'codec': 'h264'
-                    }
-                    item['meta'].update(data)
-                    Item().save(item)
+    @access.user
+    @autoDescribeRoute(
+        Description("Export annotations for all the folders to an item with a job")
+        .modelParam(
+            "folder",
+            description="FolderId to get state from",
+            model=Folder,
+            level=AccessType.READ,
+            destName="folder",
+        )
+        .param(
+            "applyFilter",
+            "Apply Filter file if it exists.",
+            paramType="query",
+            dataType="boolean",
+            default=False,
+        )
+        .param(
+            "ta2Only",
+            "Export TA2 Only",
+            paramType="query",
+            dataType="boolean",
+            default=False,
+        )
+        .param(
+            "allUsers",
+            "Include every user in userMap.tab instead of only the annotators found",
+            paramType="query",
+            dataType="boolean",
+            default=False,
+        )
+        .param(
+            "format",
+            "Format of the data tabs, 'parquet' writes them as typed parquet files",
+            paramType="query",
+            required=False,
+            enum=EXPORT_FORMATS,
+            default='tab',
+        )
+    )
+    def export_recursive_tabular_job(self, folder, applyFilter, ta2Only, allUsers, format):
+        user = self.getCurrentUser()
+        totalFolderIds, totalTA2FolderIds = self.recursive_export_folder_ids(folder)
+        folderIds = totalTA2FolderIds if ta2Only else totalFolderIds
+        filterFiles = filter_files(folder) if applyFilter and not ta2Only else []
+        job = create_export_job(
+            user, folderIds, "batch_export.zip", ta2Only, allUsers, filterFiles, format
+        )
+        return Job().filter(job, user=user)
 
     @access.user
     @autoDescribeRoute(
@@ -264,13 +439,15 @@ class UMD_Dataset(Resource):
         folder,
     ):
         user = self.getCurrentUser()
-        self.generate_segment_task(folder, user)
+        generate_segment_task(folder, user)
 
-    def generate_segments_of_children(self, folder, user):
+    def segment_videos_of_children(self, folder, user):
+        videos = []
         subFolders = list(Folder().childFolders(folder, 'folder', user))
         for child in subFolders:
-            self.generate_segment_task(child, user)
-            self.generate_segments_of_children(child, user)
+            videos += segment_videos(child, user)
+            videos += self.segment_videos_of_children(child, user)
+        return videos
 
     @access.user
     @autoDescribeRoute(
@@ -289,7 +466,21 @@ class UMD_Dataset(Resource):
         folder,
     ):
         user = self.getCurrentUser()
-        self.generate_segments_of_children(folder, user)
+        videos = self.segment_videos_of_children(folder, user)
+        if not videos:
+            return None
+        # a single job segments every video instead of a job per video
+        token = Token().createToken(user=user, days=2)
+        newjob = tasks.generate_splits_batch.delay(
+            videos=videos,
+            user_id=str(user["_id"]),
+            user_login=str(user["login"]),
+            probe_token=probe_token(user),
+            girder_job_title=f"Generating Tracks for {len(videos)} UMD videos",
+            girder_client_token=str(token["_id"]),
+        )
+        Job().save(newjob.job)
+        return Job().filter(newjob.job, user=user)
 
     @access.admin
     @autoDescribeRoute(
@@ -329,38 +520,27 @@ class UMD_Dataset(Resource):
 
     )
     def mark_changepoint_complete(self, data):
-        # go through the list of data and fine the appropriate folder and user
-        user = self.getCurrentUser()
-        users = list(User().find())
-        userMap = {}
-        for item in users:
-            userMap[item["login"]] = item["_id"]
-        pairs = data['pairs']
-        updated = []
-        for pair in pairs:
-            folderId = pair[1]
-            userLogin = pair[0]
-            print(f'UserLogin: {userLogin}')
-            print(f'FolderId: {folderId}')
-            if userLogin in userMap.keys():
-                # now lets find the folder
-                folder = Folder().load(folderId, level=AccessType.READ, user=user)
-                tracks = crud_annotation.TrackItem().list(folder)
-                last_track = tracks.limit(1).sort([('$natural', -1)])[0]
-                attributes = last_track['attributes']
-                attributes[f'{userLogin}_ChangePointComplete'] = True
-                last_track['attributes'] = attributes
-                upsert_tracks = [last_track]
-                delete_tracks = [last_track['id']]
-                crud_annotation.save_annotations(folder,
-                                                 user,
-                                                 upsert_tracks=upsert_tracks,
-                                                 delete_tracks=delete_tracks,
-                                                 upsert_groups=[],
-                                                 delete_groups=[],
-                                                 )
-                updated.append(f'userId: {userLogin} and FolderId: {folderId} updated')
-        return updated
+        results = mark_changepoints_complete(data['pairs'], self.getCurrentUser())
+        return [
+            f'userId: {result["login"]} and FolderId: {result["folderId"]} updated'
+            for result in results
+            if result['status'] == 'updated'
+        ]
+
+    @access.admin
+    @autoDescribeRoute(
+        Description(
+            "Mark the change point annotation of users complete on folders in bulk, "
+            "returning the status of every pair"
+        ).jsonParam(
+            "data",
+            description="Array of pairs of UserLogins and FolderIds",
+            requireObject=True,
+            paramType="body",
+        )
+    )
+    def bulk_changepoint_complete(self, data):
+        return mark_changepoints_complete(data['pairs'], self.getCurrentUser())
 
     @access.user
     @autoDescribeRoute(
@@ -403,3 +583,35 @@ class UMD_Dataset(Resource):
         )
         return filterFolder
 
+    @access.admin
+    @autoDescribeRoute(
+        Description("Purge the cache of per-folder export rows")
+    )
+    def purge_export_cache(self):
+        return export_fragment_cache.clear()
+
+    @access.admin
+    @autoDescribeRoute(
+        Description("Rebuild the annotation summary of every dataset under the folder")
+        .modelParam(
+            "folder",
+            description="Root folder of the datasets",
+            model=Folder,
+            level=AccessType.READ,
+            destName="folder",
+        )
+    )
+    def rebuild_annotation_summary(self, folder):
+        totalFolders, ta2Folders = dataset_folders(folder, self.getCurrentUser())
+        folders = totalFolders + ta2Folders
+        for start in range(0, len(folders), SUMMARY_BATCH_SIZE):
+            update_summaries(folders[start : start + SUMMARY_BATCH_SIZE])
+        return {'folders': len(folders)}
+
+    @access.admin
+    @autoDescribeRoute(
+        Description("Store the session fields parsed from the name of every dataset folder")
+    )
+    def backfill_session_metadata(self):
+        user = self.getCurrentUser()
+        return Job().filter(create_backfill_job(user), user=user)
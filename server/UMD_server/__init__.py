@@ -2,15 +2,33 @@ from girder import plugin, events
 
 from .UMD_dataset.views import UMD_Dataset
 from .client_webroot import ClientWebroot
-from .UMD_dataset.event import process_s3_import
+from .UMD_dataset.event import process_annotation_save, process_s3_import
 from .UMD_configuration.views import ConfigurationResource
+from UMD_utils.UMD_export_job import fail_orphaned_export_jobs
+from UMD_utils.UMD_folders import invalidate_dataset_folders
+from UMD_utils.UMD_users import invalidate_user_index
 class UMDPlugin(plugin.GirderPlugin):
     def load(self, info):
         info["apiRoot"].UMD_dataset = UMD_Dataset()
         info["apiRoot"].UMD_configuration = ConfigurationResource("UMD_configuration")
+        # export jobs run on threads of the server, so pending ones don't survive a restart
+        fail_orphaned_export_jobs()
 
         events.bind(
             "s3_assetstore_imported",
             "process_s3_import",
             process_s3_import,
         )
+        # keep the per folder annotation summaries in sync with annotation saves
+        for eventName in [
+            "rest.patch.dive_annotation.after",
+            "rest.post.dive_annotation/rollback.after",
+            "rest.post.dive_rpc/postprocess/:id.after",
+        ]:
+            events.bind(eventName, "update_annotation_summary", process_annotation_save)
+        # user creation, updates and removal change the export uid index
+        for eventName in ["model.user.save.after", "model.user.remove"]:
+            events.bind(eventName, "invalidate_user_index", invalidate_user_index)
+        # folders created, moved, changed or removed change the datasets found under a root
+        for eventName in ["model.folder.save.after", "model.folder.remove"]:
+            events.bind(eventName, "invalidate_dataset_folders", invalidate_dataset_folders)
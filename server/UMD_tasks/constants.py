@@ -1,3 +1,4 @@
+import os
 import re
 
 DatasetMarker = "annotate"
@@ -5,6 +6,14 @@ FPSMarker = "fps"
 OriginalFPSMarker = "originalFps"
 OriginalFPSStringMarker = "originalFpsString"
 ConfidenceFiltersMarker = "confidenceFilters"
+# Session fields parsed from the dataset folder name
+SessionMarker = "UMDSession"
+# Videos probed at the same time by a batched ingest job
+PROBE_WORKERS = int(os.environ.get('UMD_PROBE_WORKERS', 4))
+# Videos whose segments a batched ingest job uploads at the same time
+UPLOAD_WORKERS = int(os.environ.get('UMD_UPLOAD_WORKERS', 4))
+# Minutes the read only token ingest jobs probe the download URLs with is valid
+PROBE_TOKEN_MINUTES = 120
 validVideoFormats = {
     "mp4",
     "webm",
@@ -1,5 +1,7 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import suppress
 import json
+import logging
 import os
 from pathlib import Path
 import shutil
@@ -7,7 +9,8 @@ import subprocess
 from subprocess import Popen
 from sys import meta_path
 import tempfile
-from typing import Dict, List, Optional, Tuple
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
 from urllib import request
 from urllib.parse import urlparse
 from zipfile import ZIP_DEFLATED, ZipFile
@@ -21,6 +24,8 @@ from girder_worker.utils import JobManager, JobStatus
 
 from UMD_tasks import constants, utils
 
+logger = logging.getLogger(__name__)
+
 
 def get_gpu_environment() -> Dict[str, str]:
     """Get environment variables for using CUDA enabled GPUs."""
@@ -42,6 +47,122 @@ class Config:
         self.gpu_process_env = get_gpu_environment()
 
 
+def probe_sources(
+    gc: GirderClient,
+    item: dict,
+    local_path: Optional[str] = None,
+    probe_token: Optional[str] = None,
+) -> List[Tuple]:
+    """
+    The (source, ffprobe command) pairs that read the item's video without
+    downloading it, the assetstore file when the worker shares the server's
+    storage and range requests to its Girder download URL.  The URL is only
+    probed with `probe_token`, a short lived read only token, since the ffprobe
+    arguments can be listed by anyone on the worker; the job's own token never
+    appears in them.
+    """
+    sources = []
+    if local_path and os.path.isfile(local_path):
+        sources.append(('assetstore file', utils.ffprobe_command(local_path)))
+    files = list(gc.listFile(item['_id'], limit=1)) if probe_token else []
+    if files:
+        url = f"{gc.urlBase}file/{files[0]['_id']}/download?token={probe_token}"
+        sources.append(('download url', utils.ffprobe_command(url)))
+    return sources
+
+
+def first_probe(sources: List[Tuple]) -> Tuple[Optional[str], Optional[Dict]]:
+    """The first source that could be probed and its probe, (None, None) if none could"""
+    for source, command in sources:
+        probe = utils.run_probe(command)
+        if probe is not None:
+            return source, probe
+    return None, None
+
+
+def download_probe(
+    task: Task,
+    context: dict,
+    manager: JobManager,
+    gc: GirderClient,
+    item: dict,
+    working_directory: Path,
+) -> Dict:
+    file_name = str(working_directory / item['name'])
+    manager.write(f'Fetching input from {item["_id"]} to {file_name}...\n')
+    gc.downloadItem(item['_id'], working_directory, name=item.get('name'))
+    stdout = utils.stream_subprocess(
+        task, context, manager, {'args': utils.ffprobe_command(file_name)}, keep_stdout=True
+    )
+    return utils.parse_probe(stdout)
+
+
+def probe_video(
+    task: Task,
+    context: dict,
+    manager: JobManager,
+    gc: GirderClient,
+    item: dict,
+    working_directory: Path,
+    local_path: Optional[str] = None,
+    probe_token: Optional[str] = None,
+) -> Dict:
+    """
+    Probe the item's video from the assetstore file or its download URL, and only
+    download the whole video when neither can be probed.
+    """
+    source, probe = first_probe(probe_sources(gc, item, local_path, probe_token))
+    if probe is not None:
+        manager.write(f'Probed {item["name"]} from the {source}\n')
+        return probe
+    manager.write(f'Could not probe {item["name"]} without downloading it\n')
+    return download_probe(task, context, manager, gc, item, working_directory)
+
+
+def upload_segments(
+    gc: GirderClient, folderId: str, item: dict, probe: Dict, working_directory: Path
+):
+    """
+    Upload the segment tracks of the probed video to its folder, store the video
+    information on the item and folder and postprocess the folder.
+    """
+    folderData = gc.getFolder(folderId)
+    videostream = probe['videostream']
+    avgFpsString: str = probe['avgFpsString']
+    originalFps = probe['originalFps']
+    if originalFps != 30:
+        logger.warning(f'The video file {item["name"]} does not have a FPS of 30')
+    tracks = utils.segment_tracks(originalFps, probe['framecount'], probe['width'], probe['height'])
+    desfile = str(working_directory / 'generatedAnnotations.json')
+    with open(desfile, "w") as outfile:
+        outfile.write(json.dumps({"tracks": tracks, "groups": {}, "version": 2}))
+    # Now upload the new file to the folder and kick off a post process no job import.
+    gc.uploadFileToFolder(folderId, desfile)
+    # post process
+    gc.addMetadataToItem(
+        item['_id'],
+        {
+            "source_video": False,  # even though it is, this for requesting
+            "transcoder": "ffmpeg",
+            constants.OriginalFPSMarker: originalFps,
+            constants.OriginalFPSStringMarker: avgFpsString,
+            "codec": "h264",
+        },
+    )
+    gc.addMetadataToFolder(
+        folderId,
+        {
+            constants.DatasetMarker: True,  # mark the parent folder as able to annotate.
+            constants.OriginalFPSMarker: originalFps,
+            constants.OriginalFPSStringMarker: avgFpsString,
+            constants.FPSMarker: originalFps,
+            "ffprobe_info": videostream,
+            constants.SessionMarker: utils.parse_session_name(folderData['name']),
+        },
+    )
+    gc.post(f'dive_rpc/postprocess/{folderId}', data={"skipJobs": True})
+
+
 @app.task(bind=True, acks_late=True)
 def generate_splits(
     self: Task,
@@ -49,6 +170,8 @@ def generate_splits(
     itemId: str,
     user_id: str,
     user_login: str,
+    local_path: Optional[str] = None,
+    probe_token: Optional[str] = None,
 ):
     context: dict = {}
     gc: GirderClient = self.girder_client
@@ -57,102 +180,118 @@ def generate_splits(
         manager.updateStatus(JobStatus.CANCELED)
         return
 
-    folderData = gc.getFolder(folderId)
-
     with tempfile.TemporaryDirectory() as _working_directory, suppress(utils.CanceledError):
         _working_directory_path = Path(_working_directory)
         item = gc.getItem(itemId)
-        file_name = str(_working_directory_path / item['name'])
-        manager.write(f'Fetching input from {itemId} to {file_name}...\n')
-        gc.downloadItem(itemId, _working_directory_path, name=item.get('name'))
-
-        command = [
-            "ffprobe",
-            "-print_format",
-            "json",
-            "-v",
-            "quiet",
-            "-show_format",
-            "-show_streams",
-            file_name,
-        ]
-        stdout = utils.stream_subprocess(
-            self, context, manager, {'args': command}, keep_stdout=True
+        probe = probe_video(
+            self, context, manager, gc, item, _working_directory_path, local_path, probe_token
         )
-        jsoninfo = json.loads(stdout)
-        videostream = list(filter(lambda x: x["codec_type"] == "video", jsoninfo["streams"]))
-        avgFpsString: str = videostream[0]["avg_frame_rate"]
-        originalFps = None
-        if avgFpsString:
-            dividend, divisor = [int(v) for v in avgFpsString.split('/')]
-            originalFps = dividend / divisor
-        if originalFps != 30:
-            print(f'Warning the video file: {file_name} does not have a FPS of 30')
-        width = int(videostream[0]['width'])
-        height = int(videostream[0]['height'])
-        framecount = int(videostream[0]['nb_frames'])
-        start_buffer = 5.0
-        segment_length = 15.0
-        start = originalFps * start_buffer
-
-        current_frame = start
-        tracks = {}
-        track_count = 0
-        while current_frame < framecount:
-            endframe = current_frame + (segment_length * originalFps)
-            if framecount - (current_frame + (segment_length * originalFps)) < originalFps * segment_length:
-                # Now we need to extend the last frame to fill the remaining time
-                endframe = framecount
-            end = min(framecount, endframe)
-            tracks[track_count] = {
-                "begin": current_frame,
-                "end": end,
-                "confidencePairs": [["segment", 1.0]],
-                "attributes": {},
-                "id": track_count,
-                "features": [
-                    {
-                        "bounds": [0, 0, width, height],
-                        "frame": current_frame,
-                        "interpolate": True,
-                        "keyframe": True,
-                    },
-                    {
-                        "bounds": [0, 0, width, height],
-                        "frame": end,
-                        "interpolate": True,
-                        "keyframe": True,
-                    },
-                ],
-                "meta": {},
-            }
-            track_count += 1
-            current_frame = endframe
-        desfile = str(_working_directory_path / 'generatedAnnotations.json')
-        with open(desfile, "w") as outfile:
-            outfile.write(json.dumps({"tracks": tracks, "groups": {}, "version": 2}))
-        # Now upload the new file to the folder and kick off a post process no job import.
-        new_file = gc.uploadFileToFolder(folderId, desfile)
-        # post process
         manager.updateStatus(JobStatus.PUSHING_OUTPUT)
-        gc.addMetadataToItem(
-            itemId,
-            {
-                "source_video": False,  # even though it is, this for requesting
-                "transcoder": "ffmpeg",
-                constants.OriginalFPSMarker: originalFps,
-                constants.OriginalFPSStringMarker: avgFpsString,
-                "codec": "h264",
-            },
-        )
-        gc.addMetadataToFolder(
-            folderId,
-            {
-                constants.DatasetMarker: True,  # mark the parent folder as able to annotate.
-                constants.OriginalFPSMarker: originalFps,
-                constants.OriginalFPSStringMarker: avgFpsString,
-                constants.FPSMarker: originalFps,
-                "ffprobe_info": videostream[0],
-            },
-        )
-        gc.post(f'dive_rpc/postprocess/{folderId}', data={"skipJobs": True})
+        upload_segments(gc, folderId, item, probe, _working_directory_path)
+
+
+def thread_clients(gc: GirderClient) -> Callable[[], GirderClient]:
+    """Function returning a GirderClient of the calling thread with the token of `gc`"""
+    local = threading.local()
+
+    def client() -> GirderClient:
+        if not hasattr(local, 'gc'):
+            local.gc = GirderClient(apiUrl=gc.urlBase)
+            local.gc.setToken(gc.token)
+        return local.gc
+
+    return client
+
+
+def upload_video(
+    clients: Callable[[], GirderClient], folderId: str, item: dict, probe: Dict, source: str
+) -> str:
+    """Upload the segments of a probed video on an upload thread, returning its status"""
+    try:
+        with tempfile.TemporaryDirectory() as _working_directory:
+            upload_segments(clients(), folderId, item, probe, Path(_working_directory))
+    except Exception as err:
+        return f'error: {err}'
+    return f'segmented from the {source}'
+
+
+@app.task(bind=True, acks_late=True)
+def generate_splits_batch(
+    self: Task,
+    videos: List[Dict[str, str]],
+    user_id: str,
+    user_login: str,
+    probe_token: Optional[str] = None,
+):
+    """
+    Generate the segment tracks of many videos, each a dict of its 'folderId',
+    'itemId' and optional 'local_path', in a single job.  The videos are probed
+    PROBE_WORKERS at a time, those that can't be probed without a download are
+    downloaded one at a time, the segments are uploaded UPLOAD_WORKERS videos at a
+    time and the status of every video is logged.
+    """
+    context: dict = {}
+    gc: GirderClient = self.girder_client
+    manager: JobManager = self.job_manager
+    if utils.check_canceled(self, context):
+        manager.updateStatus(JobStatus.CANCELED)
+        return
+
+    statuses: List[Optional[str]] = [None] * len(videos)
+    items: List[Optional[dict]] = [None] * len(videos)
+    sources: List[List[Tuple]] = [[] for _ in videos]
+    for index, video in enumerate(videos):
+        try:
+            items[index] = gc.getItem(video['itemId'])
+            sources[index] = probe_sources(gc, items[index], video.get('local_path'), probe_token)
+        except Exception as err:
+            statuses[index] = f'error: {err}'
+
+    with ThreadPoolExecutor(max_workers=constants.PROBE_WORKERS) as pool:
+        probes = list(pool.map(first_probe, sources))
+
+    clients = thread_clients(gc)
+    uploads: Dict[int, Future] = {}
+    with ThreadPoolExecutor(max_workers=constants.UPLOAD_WORKERS) as pool, suppress(
+        utils.CanceledError
+    ):
+        for index, video in enumerate(videos):
+            if utils.check_canceled(self, context, force=False):
+                for upload in uploads.values():
+                    upload.cancel()
+                manager.updateStatus(JobStatus.CANCELED)
+                return
+            manager.updateProgress(total=len(videos), current=index)
+            if statuses[index] is not None:
+                manager.write(f'{video["folderId"]} {video["itemId"]}: {statuses[index]}\n')
+                continue
+            item = items[index]
+            source, probe = probes[index]
+            if probe is None:
+                source = 'download'
+                with tempfile.TemporaryDirectory() as _working_directory:
+                    try:
+                        probe = download_probe(
+                            self, context, manager, gc, item, Path(_working_directory)
+                        )
+                    except utils.CanceledError:
+                        raise
+                    except Exception as err:
+                        statuses[index] = f'error: {err}'
+                        manager.write(f'{video["folderId"]} {item["name"]}: {statuses[index]}\n')
+                        continue
+            uploads[index] = pool.submit(
+                upload_video, clients, video['folderId'], item, probe, source
+            )
+
+        for index, upload in uploads.items():
+            statuses[index] = upload.result()
+            manager.write(
+                f'{videos[index]["folderId"]} {items[index]["name"]}: {statuses[index]}\n'
+            )
+        manager.updateProgress(total=len(videos), current=len(videos))
+
+        failed = [status for status in statuses if (status or '').startswith('error')]
+        manager.write(f'Segmented {len(videos) - len(failed)} of {len(videos)} videos\n')
+        if failed:
+            raise RuntimeError(f'{len(failed)} of {len(videos)} videos could not be segmented')
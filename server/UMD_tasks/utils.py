@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+import json
 from pathlib import Path
 import re
 import shutil
@@ -16,6 +17,15 @@ from girder_worker.utils import JobManager, JobStatus
 TIMEOUT_COUNT = 'timeout_count'
 TIMEOUT_LAST_CHECKED = 'last_checked'
 TIMEOUT_CHECK_INTERVAL = 30
+# Bumped whenever the fields of the parsed session name change
+SESSION_VERSION = 1
+# Seconds a probe of a streamed video may take before the video is downloaded instead
+PROBE_TIMEOUT = 120
+# Seconds skipped at the start of a video and length of the generated segments
+SEGMENT_START_BUFFER = 5.0
+SEGMENT_LENGTH = 15.0
+# Removed from the folder names to get the file id used by the exports
+removed_elements = ['Video ', '.mp4', '-TIGHT', '-MID', '-WIDE']
 
 
 class CanceledError(RuntimeError):
@@ -141,6 +151,133 @@ def fromMeta(obj, key: str, default=None, required=False) -> Any:
         return obj["meta"][key]
 
 
+def process_video_name(name: str) -> str:
+    for remove in removed_elements:
+        name = name.replace(remove, '')
+    return name
+
+
+def parse_session_name(name: str) -> Dict[str, Any]:
+    """
+    Parse the session fields out of a dataset folder name such as
+    'Video LC1_CLNG_S1_FLE1_SME1_20230101_FLE-TIGHT.mp4'.  Fields the name does
+    not have are '', and person and perspective are None without a 7th field.
+    """
+    file_id = process_video_name(name)
+    session = {
+        'version': SESSION_VERSION,
+        'folder_name': name,
+        'name': name.replace('.mp4', '').replace('Video ', ''),
+        'file_id': file_id,
+        'session_id': file_id,
+        'language': '',
+        'condition': '',
+        'scenario': '',
+        'fle': '',
+        'sme': '',
+        'date': '',
+        'typebase': '',
+        'person': None,
+        'perspective': None,
+    }
+    splits = file_id.split('_')
+    if len(splits) > 5:
+        session.update(zip(['language', 'condition', 'scenario', 'fle', 'sme', 'date'], splits))
+        session['session_id'] = '_'.join(splits[:6])
+        if len(splits) > 6:
+            session['typebase'] = splits[6]
+    nameSplits = session['name'].split('_')
+    if len(nameSplits) > 6:
+        person = nameSplits[6]
+        session['person'] = person
+        session['perspective'] = ''
+        if '-' in person:
+            session['person'], session['perspective'] = person.split('-')[:2]
+    return session
+
+
+def ffprobe_command(source: str) -> List[str]:
+    """Arguments of ffprobe printing the format and streams of a file path or URL as json"""
+    command = ["ffprobe", "-print_format", "json", "-v", "quiet", "-show_format", "-show_streams"]
+    return command + [source]
+
+
+def parse_probe(stdout: Union[str, bytes]) -> Dict[str, Any]:
+    """
+    The video stream of the ffprobe output with its fps, size and frame count.
+    Raises when the output lacks any of them.
+    """
+    jsoninfo = json.loads(stdout)
+    videostream = list(filter(lambda x: x["codec_type"] == "video", jsoninfo["streams"]))
+    avgFpsString: str = videostream[0]["avg_frame_rate"]
+    originalFps = None
+    if avgFpsString:
+        dividend, divisor = [int(v) for v in avgFpsString.split('/')]
+        originalFps = dividend / divisor
+    return {
+        'videostream': videostream[0],
+        'avgFpsString': avgFpsString,
+        'originalFps': originalFps,
+        'width': int(videostream[0]['width']),
+        'height': int(videostream[0]['height']),
+        'framecount': int(videostream[0]['nb_frames']),
+    }
+
+
+def run_probe(command: List[str], timeout: float = PROBE_TIMEOUT) -> Optional[Dict[str, Any]]:
+    """
+    The parsed ffprobe output of the command, None when the source couldn't be
+    probed.  The output isn't streamed to the job log since the command may hold
+    a token.
+    """
+    try:
+        result = subprocess.run(command, capture_output=True, timeout=timeout, check=True)
+        return parse_probe(result.stdout)
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def segment_tracks(originalFps: float, framecount: int, width: int, height: int) -> Dict[int, Any]:
+    """The SEGMENT_LENGTH second segment tracks of a video, the last one extended to its end"""
+    start = originalFps * SEGMENT_START_BUFFER
+
+    current_frame = start
+    tracks = {}
+    track_count = 0
+    while current_frame < framecount:
+        endframe = current_frame + (SEGMENT_LENGTH * originalFps)
+        remaining = framecount - (current_frame + (SEGMENT_LENGTH * originalFps))
+        if remaining < originalFps * SEGMENT_LENGTH:
+            # Now we need to extend the last frame to fill the remaining time
+            endframe = framecount
+        end = min(framecount, endframe)
+        tracks[track_count] = {
+            "begin": current_frame,
+            "end": end,
+            "confidencePairs": [["segment", 1.0]],
+            "attributes": {},
+            "id": track_count,
+            "features": [
+                {
+                    "bounds": [0, 0, width, height],
+                    "frame": current_frame,
+                    "interpolate": True,
+                    "keyframe": True,
+                },
+                {
+                    "bounds": [0, 0, width, height],
+                    "frame": end,
+                    "interpolate": True,
+                    "keyframe": True,
+                },
+            ],
+            "meta": {},
+        }
+        track_count += 1
+        current_frame = endframe
+    return tracks
+
+
 def download_source_media(girder_client: GirderClient, folder, dest: Path) -> List[str]:
     """
     Download source media for folder from girder
@@ -0,0 +1,75 @@
+import functools
+import re
+
+# Kinds of the per annotator `login_Kind` attributes stored on tracks and features
+ATTRIBUTE_KINDS = [
+    'Valence',
+    'Arousal',
+    'Emotions',
+    'MultiSpeaker',
+    'Norms',
+    'Impact',
+    'Comment',
+    'RemediationComment',
+    'ChangePointComplete',
+    'ASRQuality',
+    'MTQuality',
+    'AlertsQuality',
+    'DelayedRemediation',
+    'RephrasingQuality',
+    'TA2Norms',
+]
+
+# Kinds that mark a track (or a feature of it) as annotated for each annotation type
+ANNOTATION_EXISTS_KINDS = {
+    'UMD': {
+        'tracks': frozenset(['Arousal', 'Valence', 'Norms', 'Emotions']),
+        'features': frozenset(['Impact', 'RemediationComment']),
+    },
+    'UMDTA2': {
+        'tracks': frozenset(
+            [
+                'ASRQuality',
+                'MTQuality',
+                'AlertsQuality',
+                'RephrasingQuality',
+                'DelayedRemediation',
+                'TA2Norms',
+            ]
+        ),
+        'features': frozenset(),
+    },
+}
+
+attributeKeyRegex = re.compile(
+    r'^(?P<login>.+)_(?P<kind>' + '|'.join(ATTRIBUTE_KINDS) + r')(?:V(?P<version>[\d.]+))?$'
+)
+
+
+@functools.lru_cache(maxsize=8192)
+def parse_attribute_key(key):
+    """
+    Split an attribute key like `login_ImpactV2.0` into (login, kind, version).
+    Returns None for keys that are not per annotator attributes.
+    """
+    match = attributeKeyRegex.match(key)
+    if match is None:
+        return None
+    return match.group('login'), match.group('kind'), match.group('version')
+
+
+def group_user_attributes(attributes, handlers):
+    """
+    Group per annotator attributes by login.  `handlers` maps an attribute kind to
+    a function(data, value, version) that records the value into the login's data.
+    """
+    userDataFound = {}
+    for key, value in attributes.items():
+        parsed = parse_attribute_key(key)
+        if parsed is None:
+            continue
+        login, kind, version = parsed
+        handler = handlers.get(kind, None)
+        if handler is not None:
+            handler(userDataFound.setdefault(login, {}), value, version)
+    return userDataFound
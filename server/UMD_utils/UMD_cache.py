@@ -0,0 +1,73 @@
+from collections import OrderedDict
+import threading
+
+from UMD_utils.constants import EXPORT_CACHE_MB
+
+# Approximate bookkeeping cost of an entry so empty values still count
+ENTRY_OVERHEAD = 128
+
+
+def text_size(value):
+    return len(value) + ENTRY_OVERHEAD
+
+
+class LRUCache:
+    """
+    Thread safe least recently used cache of string values.  Entries are evicted
+    once the total length of the cached values exceeds maxSize characters, or the
+    total `sizeOf` the values for other kinds of values.
+    """
+
+    def __init__(self, maxSize, sizeOf=text_size):
+        self.maxSize = maxSize
+        self.sizeOf = sizeOf
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key, None)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.sizeOf(value) > self.maxSize:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self.sizeOf(self._entries.pop(key))
+            self._entries[key] = value
+            self.size += self.sizeOf(value)
+            while self.size > self.maxSize:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= self.sizeOf(evicted)
+
+    def clear(self):
+        with self._lock:
+            purged = {'entries': len(self._entries), 'size': self.size}
+            self._entries.clear()
+            self.size = 0
+            return purged
+
+
+class CollectingCache:
+    """
+    Cache of the exports built by the worker processes: nothing is looked up or
+    kept in the worker, the entries put are collected so the server process they
+    are returned to caches them.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def get(self, key):
+        return None
+
+    def put(self, key, value):
+        self.entries.append((key, value))
+
+
+# Serialized tab rows for a single folder, shared by every export request
+export_fragment_cache = LRUCache(EXPORT_CACHE_MB * 1024 * 1024)
@@ -0,0 +1,168 @@
+import datetime
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from dive_server import crud_annotation
+from girder.constants import AccessType
+from girder.models.folder import Folder
+from pymongo import UpdateOne
+
+from UMD_utils.UMD_summary import folder_revisions, update_summaries
+from UMD_utils.UMD_users import user_index
+
+# Number of folders marked by a single bulk write
+CHANGEPOINT_BATCH_SIZE = 500
+
+
+def changepoint_key(login):
+    return f'{login}_ChangePointComplete'
+
+
+def last_tracks(folders):
+    """
+    The last current track of every folder by folder id, with a single aggregation.
+    Tracks are ordered by their ids, which follow the order they were saved in.
+    """
+    collection = crud_annotation.TrackItem().collection
+    pipeline = [
+        {
+            '$match': {
+                crud_annotation.DATASET: {'$in': [folder['_id'] for folder in folders]},
+                crud_annotation.REVISION_DELETED: {'$exists': False},
+            }
+        },
+        {'$sort': {'_id': -1}},
+        {'$group': {'_id': f'${crud_annotation.DATASET}', 'track': {'$first': '$$ROOT'}}},
+    ]
+    return {result['_id']: result['track'] for result in collection.aggregate(pipeline)}
+
+
+def marked_track(track, logins, revision):
+    """Copy of the track with the completion attribute of every login, created at revision"""
+    marked = {
+        key: value
+        for key, value in track.items()
+        if key not in ['_id', crud_annotation.REVISION_DELETED]
+    }
+    marked['attributes'] = dict(track.get('attributes', None) or {})
+    marked['attributes'].update({changepoint_key(login): True for login in logins})
+    marked[crud_annotation.REVISION_CREATED] = revision
+    return marked
+
+
+def revision_log(folder, user, revision):
+    return {
+        crud_annotation.DATASET: folder['_id'],
+        crud_annotation.REVISION: revision,
+        'author_name': user['login'],
+        'author_id': user['_id'],
+        'created': datetime.datetime.utcnow(),
+        'additions': 1,
+        'deletions': 1,
+        'description': 'mark change point complete',
+    }
+
+
+def superseded_tracks(tracks, revisions):
+    """Ids of the tracks that were replaced by another save before they were marked"""
+    cursor = crud_annotation.TrackItem().collection.find(
+        {'_id': {'$in': [track['_id'] for track in tracks]}},
+        {crud_annotation.DATASET: 1, crud_annotation.REVISION_DELETED: 1},
+    )
+    return set(
+        track['_id']
+        for track in cursor
+        if track.get(crud_annotation.REVISION_DELETED, None)
+        != revisions[str(track[crud_annotation.DATASET])]
+    )
+
+
+def mark_folders(folderIds, pairResults, user):
+    """
+    Mark the pairs of a batch of folders the way annotation saves are versioned:
+    the last track of every folder is deleted at the folder's next revision and a
+    marked copy is created at it, with bulk writes for the whole batch, and the
+    revision is logged so the summaries, export caches and delta manifests keyed
+    by revision see the change.  Tracks another save replaced in the meantime are
+    left alone and their pairs get the 'conflict' status.
+    """
+    cursor = Folder().find({'_id': {'$in': folderIds}})
+    folders = list(Folder().filterResultsByPermission(cursor, user, AccessType.WRITE))
+    found = set(folder['_id'] for folder in folders)
+    for folderId in folderIds:
+        if folderId not in found:
+            for result in pairResults[folderId]:
+                result['status'] = 'folderNotFound'
+    tracks = last_tracks(folders)
+    revisions = folder_revisions(folders)
+    deletes = []
+    marking = []
+    for folder in folders:
+        track = tracks.get(folder['_id'], None)
+        if track is None:
+            for result in pairResults[folder['_id']]:
+                result['status'] = 'noTracks'
+            continue
+        revisions[str(folder['_id'])] += 1
+        deletes.append(
+            UpdateOne(
+                {'_id': track['_id'], crud_annotation.REVISION_DELETED: {'$exists': False}},
+                {'$set': {crud_annotation.REVISION_DELETED: revisions[str(folder['_id'])]}},
+            )
+        )
+        marking.append((folder, track))
+    if not marking:
+        return
+    collection = crud_annotation.TrackItem().collection
+    deleted = collection.bulk_write(deletes, ordered=False).modified_count
+    superseded = set()
+    if deleted < len(marking):
+        superseded = superseded_tracks([track for _, track in marking], revisions)
+    inserts = []
+    logs = []
+    marked = []
+    for folder, track in marking:
+        results = pairResults[folder['_id']]
+        if track['_id'] in superseded:
+            for result in results:
+                result['status'] = 'conflict'
+            continue
+        revision = revisions[str(folder['_id'])]
+        logins = sorted(set(result['login'] for result in results))
+        inserts.append(marked_track(track, logins, revision))
+        logs.append(revision_log(folder, user, revision))
+        marked.append(folder)
+        for result in results:
+            result['status'] = 'updated'
+    if inserts:
+        collection.insert_many(inserts, ordered=False)
+        crud_annotation.RevisionLogItem().collection.insert_many(logs, ordered=False)
+        update_summaries(marked, revisions)
+
+
+def mark_changepoints_complete(pairs, user):
+    """
+    Set the change point completion attribute of every [login, folderId] pair on
+    the last track of the folder.  Returns a result per pair in the given order,
+    with the status 'updated', 'unknownUser', 'invalidFolder', 'folderNotFound',
+    'noTracks' or 'conflict'.
+    """
+    userIndex = user_index()
+    results = []
+    pairResults = {}
+    for login, folderId in pairs:
+        result = {'login': login, 'folderId': str(folderId), 'status': None}
+        results.append(result)
+        if login not in userIndex:
+            result['status'] = 'unknownUser'
+            continue
+        try:
+            folderId = ObjectId(str(folderId))
+        except InvalidId:
+            result['status'] = 'invalidFolder'
+            continue
+        pairResults.setdefault(folderId, []).append(result)
+    folderIds = list(pairResults.keys())
+    for start in range(0, len(folderIds), CHANGEPOINT_BATCH_SIZE):
+        mark_folders(folderIds[start : start + CHANGEPOINT_BATCH_SIZE], pairResults, user)
+    return results
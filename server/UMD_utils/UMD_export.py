@@ -1,21 +1,50 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import csv
+import datetime
+import hashlib
 import io
+import itertools
 import json
 import math
 from pathlib import Path
-import pandas as pd
-import re
+import tempfile
+import time
+from types import MappingProxyType
 
 from dive_server import crud_annotation
-from girder.constants import AccessType
-from girder.models.folder import Folder
 from girder.models.user import User
 from girder.utility import ziputil
 from girder.models.setting import Setting
-from UMD_utils.constants import TA2_CONFIG, BASENORMMAP
-
-
-
+from UMD_utils.UMD_attributes import ANNOTATION_EXISTS_KINDS, group_user_attributes
+from UMD_utils.UMD_cache import CollectingCache, export_fragment_cache
+from UMD_utils.UMD_folders import load_folders
+from UMD_utils.UMD_metrics import ExportMetrics, export_report, export_thread_prefix, profiled
+from UMD_utils.UMD_parquet import ParquetTab
+from UMD_utils.UMD_session import folder_session
+from UMD_utils.UMD_shard import map_shards, use_shards
+from UMD_utils.UMD_summary import (
+    folder_revisions,
+    folder_summaries,
+    folder_summary,
+    summary_annotations_exists,
+    summary_has_kinds,
+    summary_logins,
+)
+from UMD_utils.constants import (
+    AnnotationSummaryMarker,
+    BASENORMMAP,
+    EXPORT_CHUNK_KB,
+    EXPORT_CHUNK_ROWS,
+    EXPORT_PREFETCH,
+    EXPORT_SHARD_FOLDERS,
+    EXPORT_SPOOL_MB,
+    TA2_CONFIG,
+)
+
+
+
+# Norm ids of the UMD exports, the TA2 export uses the configured ids over them
 normMap = {
     "Apology": 101,
     "Criticism": 102,
@@ -40,9 +69,7 @@ normMap = {
     "None": 'none',
     "No Norm": 'none',
 }
-
-
-normMap['No Norm'] = 'none'
+normMap = MappingProxyType(normMap)
 
 normValuesViolate = ['violate', 'violated']
 normValuesAdhere = ['adhere', 'adhered']
@@ -53,34 +80,15 @@ normAdhere = 'adhere'
 NormAdhereViolate = 'adhere_violate'
 normNone = 'EMPTY_NA'
 
-TrackAttributeExists = ['_Arousal', '_Valence', '_Norms', '_Emotions']
-TA2AttributeExists = ['_ASRQuality', '_MTQuality', '_AlertsQuality', '_RephrasingQuality', '_DelayedRemedation', 'TA2Norms']
-FrameAttributeExists = ['_Impact', '_RemediationComment']
-
-removed_elements = ['Video ', '.mp4', '-TIGHT', '-MID', '-WIDE']
-
-def get_system_norm(key, norms):
-    for item in norms:
-        if item.get('norm', False) == key:
-            return item
-    return None
-
-def process_video_name(name):
-    for remove in removed_elements:
-        name = name.replace(remove, '')
-    return name
-
+def system_norm_names(norms):
+    """Names of the norms the system found on a turn"""
+    return frozenset(item.get('norm', False) for item in norms if item)
 
 def record_user_annotations(filterMap, folderId, userId):
-    record_user = True
-    if filterMap is not None:
-        if folderId in filterMap.keys():
-            if userId not in filterMap[folderId]['UserGirderIds']:
-                record_user = False
-        else:
-            record_user = False
-
-    return record_user
+    if filterMap is None:
+        return True
+    userIds = filterMap.get(folderId, None)
+    return userIds is not None and userId in userIds
 
 def bin_value(value):
     return math.floor((value - 1) / 200) + 1
@@ -88,221 +96,224 @@ def bin_value(value):
 def bin_changepoint(value):
     return math.floor((value - 1) / 1000) + 1
 
-def annotations_exists(tracks, annotationType='UMD'):
-    if annotationType == 'UMD':
-        for t in tracks:
-            if 'features' in t.keys():
-                features = t['features']
-                attributes = t['attributes']
-                for key in attributes.keys():
-                    if any(check in key for check in TrackAttributeExists):
-                        return True
-                for feature in features:
-                    if 'attributes' in feature.keys():
-                        frameAttributes = feature['attributes']
-                        for frameAttribute in frameAttributes.keys():
-                            if any(check in frameAttribute for check in FrameAttributeExists):
-                                return True
-        return False
-    elif annotationType == 'UMDTA2':
-        for t in tracks:
-            if 'features' in t.keys():
-                features = t['features']
-                attributes = t['attributes']
-                for key in attributes.keys():
-                    if any(check in key for check in TA2AttributeExists):
-                        return True
-        return False
 
+def track_query(folder):
+    return {
+        crud_annotation.DATASET: folder['_id'],
+        crud_annotation.REVISION_DELETED: {'$exists': False},
+    }
 
 
-def export_changepoint_tab(folders, userMap, user, filterMap):
-    changepoint_filterMap = None
-    if filterMap is not None:
-        changepoint_filterMap = filterMap['videos']['Changepoint']
+def load_tracks(folder, fields=None):
+    """
+    Load the current tracks of the folder.  `fields` limits the returned track
+    fields to the ones the caller reads, e.g. ['id', 'features.frame'].
+    """
+    if fields is None:
+        return list(crud_annotation.TrackItem().list(folder))
+    return list(crud_annotation.TrackItem().find(track_query(folder), fields=fields))
+
+
+def prefetch(items, load, prefetch=None):
+    """
+    Yield load(item) for every item in the original order while the next
+    `prefetch` items are loaded on a thread pool.
+    """
+    prefetch = EXPORT_PREFETCH if prefetch is None else prefetch
+    if prefetch < 1:
+        for item in items:
+            yield load(item)
+        return
+    itemIter = iter(items)
+    pending = deque()
+    threadPrefix = export_thread_prefix()
+    with ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix=threadPrefix) as pool:
+        try:
+            for item in itertools.islice(itemIter, prefetch):
+                pending.append(pool.submit(load, item))
+            while pending:
+                result = pending.popleft().result()
+                for item in itertools.islice(itemIter, 1):
+                    pending.append(pool.submit(load, item))
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def folders_with_revisions(folderIds, user, metrics=None):
+    """
+    Yield (folder, revision) with the latest annotation revision of every folder id,
+    loading FOLDER_BATCH_SIZE folders and their revisions with a query each.
+    """
+    for start in range(0, len(folderIds), FOLDER_BATCH_SIZE):
+        batch = load_folders(folderIds[start : start + FOLDER_BATCH_SIZE], user)
+        revisions = folder_revisions(batch)
+        if metrics is not None:
+            metrics.count_query('folder')
+            metrics.count_query('revision')
+        for folder in batch:
+            yield folder, revisions[str(folder['_id'])]
+
+
+def digest_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if isinstance(value, MappingProxyType):
+        return dict(value)
+    return str(value)
+
+
+def export_digest(*values):
+    return hashlib.sha1(
+        json.dumps(values, sort_keys=True, default=digest_default).encode()
+    ).hexdigest()
+
+
+def write_chunks(header, rows, chunkRows=None, chunkKB=None):
+    """
+    Write the header and rows as tab separated text, yielding the text
+    every chunkRows rows or chunkKB kilobytes so large tabs are never held in memory.
+    """
+    chunkRows = chunkRows or EXPORT_CHUNK_ROWS
+    chunkSize = (chunkKB or EXPORT_CHUNK_KB) * 1024
     csvFile = io.StringIO()
     writer = csv.writer(csvFile, delimiter='\t', quotechar='"')
-    writer.writerow(["user_id", "file_id", "timestamp", "impact_scalar", "comment"])
-    for folderId in folders:
-        folder = Folder().load(folderId, level=AccessType.READ, user=user)
-        videoname = process_video_name(folder['name'])
-        fps = folder['meta']['fps']
-        tracks = crud_annotation.TrackItem().list(folder)
-        minus_frames = 0
-        for t in tracks:
-            if t['id'] == 0 and t['begin'] > 0:
-                minus_frames = t['begin']
-            if 'features' in t.keys():
-                features = t['features']
-                userDataFound = {}
-                for feature in features:
-                    if 'attributes' in feature.keys():
-                        attributes = feature['attributes']
-                        for key in attributes.keys():
-                            if '_ImpactV2.0' in key:
-                                login = key.replace('_ImpactV2.0', '')
-                                mapped = login
-                                if mapped not in userDataFound.keys():
-                                    userDataFound[mapped] = {}
-                                userDataFound[mapped]['Impact'] = bin_changepoint(attributes[key])
-                                userDataFound[mapped]['Timestamp'] = (1 / fps) * (feature['frame'] - minus_frames)
-                            elif '_Impact' in key:
-                                login = key.replace('_Impact', '')
-                                mapped = login
-                                if mapped not in userDataFound.keys():
-                                    userDataFound[mapped] = {}
-                                userDataFound[mapped]['Impact'] = bin_changepoint(attributes[key] * 1000)
-                                userDataFound[mapped]['Timestamp'] = (1 / fps) * (feature['frame'] - minus_frames)
-                            if '_Comment' in key:
-                                login = key.replace('_Comment', '')
-                                mapped = login
-                                if mapped not in userDataFound.keys():
-                                    userDataFound[mapped] = {}
-                                userDataFound[mapped]['Comment'] = str(attributes[key])
-                                userDataFound[mapped]['Timestamp'] = (1 / fps) * (feature['frame'] - minus_frames)
-                for key in userDataFound.keys():
-                    userId = userMap.get(key, {"uid": "unknown"})['uid']
-                    userGirderId = userMap.get(key, {"id": "unknown"})['id']
-                    if not record_user_annotations(changepoint_filterMap, folderId, userGirderId):
-                        continue
-                    columns = [
-                        userId,
-                        videoname,
-                        userDataFound[key]['Timestamp'],
-                        userDataFound[key]['Impact'],
-                        userDataFound[key]['Comment'],
-                    ]
-                    writer.writerow(columns)
-    yield csvFile.getvalue()
-    csvFile.seek(0)
-    csvFile.truncate(0)
+    writer.writerow(header)
+    count = 0
+    for columns in rows:
+        writer.writerow(columns)
+        count += 1
+        if count >= chunkRows or csvFile.tell() >= chunkSize:
+            yield csvFile.getvalue()
+            csvFile.seek(0)
+            csvFile.truncate(0)
+            count = 0
     yield csvFile.getvalue()
 
 
-def export_remediation_tab(folders, userMap, user):
-    csvFile = io.StringIO()
-    writer = csv.writer(csvFile, delimiter='\t', quotechar='"')
-    writer.writerow(["user_id", "file_id", "timestamp", "comment"])
-    for folderId in folders:
-        folder = Folder().load(folderId, level=AccessType.READ, user=user)
-        videoname = process_video_name(folder['name'])
-        fps = folder['meta']['fps']
-        tracks = crud_annotation.TrackItem().list(folder)
-        minus_frames = 0
-        for t in tracks:
-            if t['id'] == 0 and t['begin'] > 0:
-                minus_frames = t['begin']
-            if 'features' in t.keys():
-                features = t['features']
-                userDataFound = {}
-                for feature in features:
-                    if 'attributes' in feature.keys():
-                        attributes = feature['attributes']
-                        for key in attributes.keys():
-                            if '_RemediationComment' in key:
-                                login = key.replace('_RemediationComment', '')
-                                mapped = login
-                                if mapped not in userDataFound.keys():
-                                    userDataFound[mapped] = {}
-                                userDataFound[mapped]['Comment'] = attributes[key]
-                                userDataFound[mapped]['Timestamp'] = (1 / fps) * (feature['frame'] - minus_frames)
-
-                for key in userDataFound.keys():
-                    userId = userMap.get(key, {"uid": "unknown"})['uid']
-                    columns = [
-                        userId,
-                        videoname,
-                        userDataFound[key]['Timestamp'],
-                        userDataFound[key]['Comment'],
-                    ]
-                    writer.writerow(columns)
-    yield csvFile.getvalue()
-    csvFile.seek(0)
-    csvFile.truncate(0)
-    yield csvFile.getvalue()
+def set_impact(data, value, version):
+    if version == '2.0':
+        data['Impact'] = bin_changepoint(value)
+    else:
+        data['Impact'] = bin_changepoint(value * 1000)
 
 
-def export_norms_tab(folders, userMap, user, filterMap):
-    csvFile = io.StringIO()
-    norms_filterMap = None
-    if filterMap is not None and 'Social Norms' in filterMap['videos']:
-        norms_filterMap = filterMap['videos']['Social Norms']
-    writer = csv.writer(csvFile, delimiter='\t')
-    writer.writerow(
-        [
-            "user_id",
-            "file_id",
-            "segment_id",
-            "norm",
-            "status",
-        ]
-    )
-    for folderId in folders:
-        folder = Folder().load(folderId, level=AccessType.READ, user=user)
-        videoname = process_video_name(folder['name'])
-        fps = folder['meta']['fps']
-        tracks = crud_annotation.TrackItem().list(folder)
+def set_comment(data, value, version):
+    data['Comment'] = str(value)
+
+
+CHANGEPOINT_HANDLERS = {
+    'Impact': set_impact,
+    'Comment': set_comment,
+}
+
+
+def changepoint_rows(folder, tracks, userMap, filterMap, state):
+    folderId = str(folder['_id'])
+    videoname = folder_session(folder)['file_id']
+    fps = folder['meta']['fps']
+    minus_frames = 0
+    for t in tracks:
+        if t['id'] == 0 and t['begin'] > 0:
+            minus_frames = t['begin']
+        if 'features' in t.keys():
+            features = t['features']
+            userDataFound = {}
+            for feature in features:
+                if 'attributes' in feature.keys():
+                    featureData = group_user_attributes(feature['attributes'], CHANGEPOINT_HANDLERS)
+                    for login, data in featureData.items():
+                        data['Timestamp'] = (1 / fps) * (feature['frame'] - minus_frames)
+                        userDataFound.setdefault(login, {}).update(data)
+            for key in userDataFound.keys():
+                userId = userMap.get(key, {"uid": "unknown"})['uid']
+                userGirderId = userMap.get(key, {"id": "unknown"})['id']
+                if not record_user_annotations(filterMap, folderId, userGirderId):
+                    continue
+                yield [
+                    userId,
+                    videoname,
+                    userDataFound[key]['Timestamp'],
+                    userDataFound[key]['Impact'],
+                    userDataFound[key]['Comment'],
+                ]
+
+
+def set_remediation_comment(data, value, version):
+    data['Comment'] = value
+
+
+REMEDIATION_HANDLERS = {
+    'RemediationComment': set_remediation_comment,
+}
+
+
+def remediation_rows(folder, tracks, userMap, filterMap, state):
+    videoname = folder_session(folder)['file_id']
+    fps = folder['meta']['fps']
+    minus_frames = 0
+    for t in tracks:
+        if t['id'] == 0 and t['begin'] > 0:
+            minus_frames = t['begin']
+        if 'features' in t.keys():
+            features = t['features']
+            userDataFound = {}
+            for feature in features:
+                if 'attributes' in feature.keys():
+                    featureData = group_user_attributes(feature['attributes'], REMEDIATION_HANDLERS)
+                    for login, data in featureData.items():
+                        data['Timestamp'] = (1 / fps) * (feature['frame'] - minus_frames)
+                        userDataFound.setdefault(login, {}).update(data)
+
+            for key in userDataFound.keys():
+                userId = userMap.get(key, {"uid": "unknown"})['uid']
+                yield [
+                    userId,
+                    videoname,
+                    userDataFound[key]['Timestamp'],
+                    userDataFound[key]['Comment'],
+                ]
+
+
+def set_norms(data, value, version):
+    for normKey in value.keys():
+        if normKey in normMap.keys():
+            # record the norm
+            data[normMap[normKey]] = value[normKey]
+
+
+NORMS_HANDLERS = {
+    'Norms': set_norms,
+}
+
+
+def norms_rows(folder, tracks, userMap, filterMap, state):
+    folderId = str(folder['_id'])
+    videoname = folder_session(folder)['file_id']
+    for t in tracks:
+        if 'attributes' in t.keys():
+            userDataFound = group_user_attributes(t['attributes'], NORMS_HANDLERS)
+            for key in userDataFound.keys():
+                for normKey in userDataFound[key].keys():
+                    value = userDataFound[key][normKey]
+                    userId = userMap.get(key, {"uid": "unknown"})['uid']
+                    userGirderId = userMap.get(key, {"id": "unknown"})['id']
+                    if not record_user_annotations(filterMap, folderId, userGirderId):
+                        continue
+                    segment_id = f'{videoname}_{t["id"]:04}'
+                    if value in normValuesAdhere:
+                        value = normAdhere
+                    if value in normValuesViolate:
+                        value = normViolate
+                    if value in normValuesAdhereViolate:
+                        yield [userId, videoname, segment_id, normKey, normAdhere]
+                        yield [userId, videoname, segment_id, normKey, normViolate]
+                    else:
+                        if value in normValuesNone:
+                            value = normNone
+                        yield [userId, videoname, segment_id, normKey, value]
 
-        for t in tracks:
-            if 'attributes' in t.keys():
-                attributes = t['attributes']
-                userDataFound = {}
-                for key in attributes.keys():
-                    if '_Norms' in key:
-                        login = key.replace('_Norms', '')
-                        mapped = login
-                        if mapped not in userDataFound.keys():
-                            userDataFound[mapped] = {}
-                        norms = attributes[key]
-                        for normKey in norms.keys():
-                            if normKey in normMap.keys():
-                                # record the norm
-                                userDataFound[mapped][normMap[normKey]] = norms[normKey]
-                for key in userDataFound.keys():
-                    for normKey in userDataFound[key].keys():
-                        value = userDataFound[key][normKey]
-                        userId = userMap.get(key, {"uid": "unknown"})['uid']
-                        userGirderId = userMap.get(key, {"id": "unknown"})['id']
-                        if not record_user_annotations(norms_filterMap, folderId, userGirderId):
-                            continue
-                        if value in normValuesAdhere:
-                            value = normAdhere
-                        if value in normValuesViolate:
-                            value = normViolate
-                        if value in normValuesAdhereViolate:
-                            columns = [
-                                userId,
-                                videoname,
-                                f'{videoname}_{t["id"]:04}',
-                                normKey,
-                                normAdhere,
-                            ]
-                            writer.writerow(columns)
-                            columns = [
-                                userId,
-                                videoname,
-                                f'{videoname}_{t["id"]:04}',
-                                normKey,
-                                normViolate,
-                            ]
-                            writer.writerow(columns)
-                        else:
-                            if value in normValuesNone:
-                                value = normNone
-                            columns = [
-                                userId,
-                                videoname,
-                                f'{videoname}_{t["id"]:04}',
-                                normKey,
-                                value,
-                            ]
-                            writer.writerow(columns)
-
-                        
-    yield csvFile.getvalue()
-    csvFile.seek(0)
-    csvFile.truncate(0)
-    yield csvFile.getvalue()
 
 def handle_norms_export(session_id, user_norms, system_norms):
     alertremed_decision = ''
@@ -328,267 +339,329 @@ def handle_norms_export(session_id, user_norms, system_norms):
 
 
 
+TA2_HEADER = [
+    "user_id",
+    "session_id",
+    "turn_id",
+    "turn_speaker",
+    "asr_quality",
+    "mt_quality",
+    "norm",
+    "status",
+    "alertremed_decision",
+    "alertremed_output",
+    "alertremed_evaluation",
+    "alert_quality",
+    "rephrase_quality",
+    "sme_delayed_remediation",
+    "norm/status/alertmed_decision/alertremed_output/alertremed_eval",
+]
+
+
+def ta2_norm_map():
+    """Norm ids of the TA2 configuration, read once for every export"""
+    config = Setting().get(TA2_CONFIG) or {}
+    norms = dict(normMap)
+    for item in config.get('normMap', None) or BASENORMMAP:
+        norms[item['named']] = item['id']
+    return MappingProxyType(norms)
+
+
+def ta2_state():
+    return {'normMap': ta2_norm_map()}
+
+
+def ta2_setter(field):
+    def set_field(data, value, version):
+        data[field] = value
+
+    return set_field
+
+
+def set_delayed_remediation(data, value, version):
+    data['delayed_remediation'] = 'yes' if value else 'no'
+
+
+TA2_HANDLERS = {
+    'ASRQuality': ta2_setter('asr_quality'),
+    'MTQuality': ta2_setter('mt_quality'),
+    'AlertsQuality': ta2_setter('alert_quality'),
+    'DelayedRemediation': set_delayed_remediation,
+    'RephrasingQuality': ta2_setter('rephrase_quality'),
+    'TA2Norms': ta2_setter('norms'),
+}
+
+
+def ta2_alert_output(alerts, rephrase):
+    """alertremed_output of the user norms of a turn the system found as well"""
+    if not alerts and not rephrase:
+        return 0
+    return 2 if any(alert.get('delayed', False) for alert in alerts) else 1
+
+
+def ta2_evaluation(decision, output):
+    if decision == 0 and output >= 1:
+        return -1
+    if decision >= 1 and output == 0:
+        return 0
+    if (decision == 0 and output == 0) or (decision >= 1 and output == 1):
+        return 1
+    return -1
+
+
+def ta2_rows(folder, tracks, userMap, filterMap, state):
+    normIds = state['normMap']
+    speaker = ''
+    session = folder_session(folder)
+    videoname = session['file_id']
+    session_id = session['session_id']
+
+    for t in tracks:
+        if 'attributes' not in t.keys():
+            continue
+        attributes = t['attributes']
+        userDataFound = group_user_attributes(attributes, TA2_HANDLERS)
+        if not userDataFound:
+            continue
+        turn = t['id'] + 1
+        speaker = attributes.get('speaker', speaker)
+        systemNorms = system_norm_names(attributes.get('norms', []))
+        alertOutput = ta2_alert_output(attributes.get('alerts', []), attributes.get('rephrase', []))
+        for key, data in userDataFound.items():
+            userId = userMap.get(key, {"uid": "unknown"})['uid']
+            asrQuality = '' if 'CLNG' in videoname else data.get('asr_quality', '')
+            qualities = [
+                data.get('alert_quality', ''),
+                data.get('rephrase_quality', ''),
+                data.get('delayed_remediation', 'no'),
+            ]
+            norms = data.get('norms', {})
+            if not norms:
+                evaluation = '' if 'FLE' in speaker else None
+                yield [
+                    userId,
+                    session_id,
+                    turn,
+                    speaker,
+                    asrQuality,
+                    data.get('mt_quality', ''),
+                    None,
+                    None,
+                    None,
+                    None,
+                    evaluation,
+                    *qualities,
+                    f"None/None/None/None/{evaluation}",
+                ]
+                continue
+            for normName, norm in norms.items():
+                normId = normIds[normName]
+                if normId == 'none':
+                    normId = ''
+                status = str(norm.get('status', ''))
+                remediation = norm.get('remediation', 0)
+                statusValue = ''
+                if status in normValuesAdhere:
+                    statusValue = 1
+                elif status in normValuesViolate:
+                    statusValue = 0
+                if normName == '' or normName == 'No Norm':
+                    statusValue = ''
+                decision = remediation if status in normValuesViolate else 0
+                output = alertOutput if normName in systemNorms else 0
+                evaluation = '' if 'FLE' in speaker else ta2_evaluation(decision, output)
+                yield [
+                    userId,
+                    session_id,
+                    turn,
+                    speaker,
+                    asrQuality,
+                    data.get('mt_quality', ''),
+                    str(normId),
+                    statusValue,
+                    decision,
+                    output,
+                    evaluation,
+                    *qualities,
+                    f"{normName}/{status}/{decision}/{output}/{evaluation}",
+                ]
+
+
 def export_ta2_annotation(folders, userMap, user):
-    base_norm_map = Setting().get(TA2_CONFIG).get('normMap', None) or BASENORMMAP
-    for item in base_norm_map:
-        normMap[item['named']] = item['id']
+    return export_tab(folders, userMap, user, 'TA2Annotation')
 
-    csvFile = io.StringIO()
-    writer = csv.writer(csvFile, delimiter='\t')
-    writer.writerow(
-        [
-            "user_id",
-            "session_id",
-            "turn_id",
-            "turn_speaker",
-            "asr_quality",
-            "mt_quality",
-            "norm",
-            "status",
-            "alertremed_decision",
-            "alertremed_output",
-            "alertremed_evaluation",
-            "alert_quality",
-            "rephrase_quality",
-            "sme_delayed_remediation",
-            "norm/status/alertmed_decision/alertremed_output/alertremed_eval"
-        ]
-    )
-    for folderId in folders:
-        folder = Folder().load(folderId, level=AccessType.READ, user=user)
-        videoname = process_video_name(folder['name'])
-        name = videoname
-        splits = name.split('_')
-        session_id = name
-        language = ''
-        condition = ''
-        scenario = ''
-        fle_id = ''
-        recording_date = ''
-        if len(splits) > 5:
-            language = splits[0]
-            condition = splits[1]
-            scenario = splits[2]
-            fle_id = splits[3]
-            sme_id = splits[4]
-            recording_date = splits[5]
-            session_id = f'{language}_{condition}_{scenario}_{fle_id}_{sme_id}_{recording_date}'
-
-
-        fps = folder['meta']['fps']
-        tracks = crud_annotation.TrackItem().list(folder)
+
+def set_valence(data, value, version):
+    data['valence_continuous'] = value
+    data['valence_binned'] = bin_value(value)
+
+
+def set_arousal(data, value, version):
+    data['arousal_continuous'] = value
+    data['arousal_binned'] = bin_value(value)
+
+
+VALENCE_HANDLERS = {
+    'Valence': set_valence,
+    'Arousal': set_arousal,
+}
+
+
+def valence_rows(folder, tracks, userMap, filterMap, state):
+    folderId = str(folder['_id'])
+    videoname = folder_session(folder)['file_id']
+    for t in tracks:
+        if 'attributes' in t.keys():
+            userDataFound = group_user_attributes(t['attributes'], VALENCE_HANDLERS)
+            for key in userDataFound.keys():
+                userId = userMap.get(key, {"uid": "unknown"})['uid']
+                userGirderId = userMap.get(key, {"id": "unknown"})['id']
+                if not record_user_annotations(filterMap, folderId, userGirderId):
+                    continue
+                yield [
+                    userId,
+                    videoname,
+                    f'{videoname}_{t["id"]:04}',
+                    userDataFound[key]['valence_continuous'],
+                    userDataFound[key]['valence_binned'],
+                    userDataFound[key]['arousal_continuous'],
+                    userDataFound[key]['arousal_binned'],
+                ]
+
+
+def segment_rows(folder, tracks, userMap, filterMap, state):
+    session = folder_session(folder)
+    fps = folder['meta']['fps']
+    updatedName = session['file_id']
+    if session['language']:
+        updatedName = f'{session["session_id"]}_{session["typebase"]}'
+    if summary_annotations_exists(folder[AnnotationSummaryMarker]):
+        minus_frames = 0
         for t in tracks:
-            if 'attributes' in t.keys():
-                attributes = t['attributes']
-                userDataFound = {}
-                dataFound = False
-                system_normMap = {}
-                system_norms = {}
-                alerts = []
-                rephrase = []
-                for key in attributes.keys():
-                    if 'alerts' == key:
-                        alerts = attributes[key]
-                    if 'rephrase' == key:
-                        rephrase = attributes[key]
-                    if 'norms' == key:
-                        norm_list = attributes[key]
-                        system_norms = attributes[key]
-                        for item in norm_list:
-                            if item.get('norm', False):
-                                system_normMap[item['norm']] = item['status']
-                    if '_ASRQuality' in key:
-                        login = key.replace('_ASRQuality', '')
-                        mapped = login
-                        if mapped not in userDataFound.keys():
-                            userDataFound[mapped] = {}
-                        userDataFound[mapped]['asr_quality'] = attributes[key]
-                        dataFound = True
-                    if '_MTQuality' in key:
-                        login = key.replace('_MTQuality', '')
-                        mapped = login
-                        if mapped not in userDataFound.keys():
-                            userDataFound[mapped] = {}
-                        userDataFound[mapped]['mt_quality'] = attributes[key]
-                        dataFound = True
-                    if '_AlertsQuality' in key:
-                        login = key.replace('_AlertsQuality', '')
-                        mapped = login
-                        if mapped not in userDataFound.keys():
-                            userDataFound[mapped] = {}
-                        userDataFound[mapped]['alert_quality'] = attributes[key]
-                        dataFound = True
-                    if '_DelayedRemediation' in key:
-                        login = key.replace('_DelayedRemediation', '')
-                        mapped = login
-                        if mapped not in userDataFound.keys():
-                            userDataFound[mapped] = {}
-                        if (attributes[key]):
-                            userDataFound[mapped]['delayed_remediation'] = 'yes'
-                        else:
-                            userDataFound[mapped]['delayed_remediation'] = 'no'
-                        dataFound = True
-                    if '_RephrasingQuality' in key:
-                        login = key.replace('_RephrasingQuality', '')
-                        mapped = login
-                        if mapped not in userDataFound.keys():
-                            userDataFound[mapped] = {}
-                        userDataFound[mapped]['rephrase_quality'] = attributes[key]
-                        dataFound = True
-                    if '_TA2Norms' in key:
-                        login = key.replace('_TA2Norms', '')
-                        mapped = login
-                        if mapped not in userDataFound.keys():
-                            userDataFound[mapped] = {}
-                        userDataFound[mapped]['norms'] = attributes[key]
-                        dataFound = True
-                if dataFound:
-                    if 'translation' in attributes.keys():
-                        turn = t['id'] + 1
-                    else:
-                        turn = t['id'] + 1
-                    if 'speaker' in attributes.keys():
-                        speaker = attributes['speaker']
-                print(userDataFound)
-                for key in userDataFound.keys():                        
-                    userId = userMap.get(key, {"uid": "unknown"})['uid']
-                    userGirderId = userMap.get(key, {"id": "unknown"})['id']
-                    norms = {}
-                    norm_list = []
-                    norm_name_list = []
-                    status_list = []
-                    status_value_list = []
-                    alertremed_list = []
-                    alertremed_decision_list = []
-                    alertremed_output_list = []
-                    alertremed_evaluation_list = []
-                    if 'norms' in userDataFound[key].keys():
-                        norms = userDataFound[key]['norms']
-                        for norm_key in norms.keys():
-                            norm_id = normMap[norm_key]
-                            if norm_id == 'none':
-                                norm_id = ''
-                            norm_name_list.append(norm_key)
-                            status = norms[norm_key].get('status', '')
-                            remediation = norms[norm_key].get('remediation', 0)
-                            norm_list.append(str(norm_id))
-                            status_list.append(str(status))
-                            if (str(status) in normValuesAdhere):
-                                status_value_list.append(1)
-                            elif (str(status) in normValuesViolate):
-                                status_value_list.append(0)
-                            else:
-                                status_value_list.append('')
-
-                            alertremed_list.append(str(remediation))
-                            alertremed_decision_value = 0
-                            if status in normValuesViolate:
-                                alertremed_decision_value = remediation
-                            alertremed_decision_list.append(alertremed_decision_value)
-                            alertremed_output_value = 0
-                            has_system_norm = get_system_norm(norm_key, system_norms)
-                            if has_system_norm:
-                                if len(alerts) > 0 or len(rephrase) > 0:
-                                    alertremed_output_value = 1
-                                    for alert in alerts:
-                                        if alert.get('delayed', False):
-                                            alertremed_output_value = 2
-                            alertremed_output_list.append(alertremed_output_value)
-                            alertremed_evaluation_value = -1
-                            if alertremed_decision_value == 0 and alertremed_output_value >= 1:
-                                alertremed_evaluation_value = -1
-                            elif alertremed_decision_value >= 1 and alertremed_output_value == 0:
-                                alertremed_evaluation_value = 0
-                            elif (alertremed_decision_value == 0 and alertremed_output_value == 0) or (alertremed_decision_value >= 1 and alertremed_output_value == 1):
-                                alertremed_evaluation_value = 1
-
-                            alertremed_evaluation_list.append(alertremed_evaluation_value)
-                    
-                    if len(norm_list):
-                        for index in range(0, len(norm_list)):
-                            norm_id = norm_list[index]
-                            norm_name = norm_name_list[index]
-                            status_value = status_value_list[index]
-                            status = status_list[index]
-                            alertremed_decision = alertremed_decision_list[index]
-                            alertremed_output = alertremed_output_list[index]
-                            alertremed_evaluation = alertremed_evaluation_list[index]
-                            if 'FLE' in speaker:
-                                alertremed_evaluation = ''
-                            asrQuality = userDataFound[key].get('asr_quality', '')
-                            if 'CLNG' in videoname:
-                                asrQuality = ''
-                            if norm_name == '' or norm_name == 'No Norm':
-                                status_value = ''
-                            columns = [
-                                userId,
-                                session_id,
-                                turn,
-                                speaker,
-                                asrQuality,
-                                userDataFound[key].get('mt_quality', ''),
-                                norm_id,
-                                status_value,
-                                alertremed_decision,
-                                alertremed_output,
-                                alertremed_evaluation,
-                                userDataFound[key].get('alert_quality', ''),
-                                userDataFound[key].get('rephrase_quality', ''),
-                                userDataFound[key].get('delayed_remediation', 'no'),
-                                f"{norm_name}/{status}/{alertremed_decision}/{alertremed_output}/{alertremed_evaluation}"
-                            ]
-
-                            writer.writerow(columns)
-                    else:
-                        norm_id = None
-                        norm_name = None
-                        status_value = None
-                        status = None
-                        alertremed_decision = None
-                        alertremed_output = None
-                        alertremed_evaluation = None
-                        asrQuality = userDataFound[key].get('asr_quality', '')
-                        if 'CLNG' in videoname:
-                            asrQuality = ''
-                        if 'FLE' in speaker:
-                            alertremed_evaluation = ''
-                        if norm_name == '' or norm_name == 'No Norm':
-                            status_value = ''
-                        columns = [
-                            userId,
-                            session_id,
-                            turn,
-                            speaker,
-                            asrQuality,
-                            userDataFound[key].get('mt_quality', ''),
-                            norm_id,
-                            status_value,
-                            alertremed_decision,
-                            alertremed_output,
-                            alertremed_evaluation,
-                            userDataFound[key].get('alert_quality', ''),
-                            userDataFound[key].get('rephrase_quality', ''),
-                            userDataFound[key].get('delayed_remediation', 'no'),
-                            f"{norm_name}/{status}/{alertremed_decision}/{alertremed_output}/{alertremed_evaluation}"
-                        ]
-
-                        writer.writerow(columns)
+            if t['id'] == 0 and t['begin'] > 0:
+                minus_frames = t['begin']
+            start = (t['begin'] - minus_frames) * (1 / fps)
+            end = (t['end'] - minus_frames) * (1 / fps)
+            yield [updatedName, f'{updatedName}_{t["id"]:04}', start, end]
 
 
-    yield csvFile.getvalue()
-    csvFile.seek(0)
-    csvFile.truncate(0)
-    yield csvFile.getvalue()
+def set_emotions(data, value, version):
+    base = ','.join(value.split('_'))
+    if base == 'No emotions':
+        base = 'none'
+    data['Emotions'] = base
 
 
-def export_valence_tab(folders, userMap, user, filterMap):
-    csvFile = io.StringIO()
-    writer = csv.writer(csvFile, delimiter='\t')
-    VAE_filterMap = None
-    if filterMap is not None:
-        VAE_filterMap = filterMap['videos']['VAE']
-    writer.writerow(
-        [
+def set_multi_speaker(data, value, version):
+    data['MultiSpeaker'] = value
+
+
+EMOTIONS_HANDLERS = {
+    'Emotions': set_emotions,
+    'MultiSpeaker': set_multi_speaker,
+}
+
+
+def emotions_rows(folder, tracks, userMap, filterMap, state):
+    folderId = str(folder['_id'])
+    name = folder_session(folder)['file_id']
+    for t in tracks:
+        if 'attributes' in t.keys():
+            userDataFound = group_user_attributes(t['attributes'], EMOTIONS_HANDLERS)
+            for key in userDataFound.keys():
+                userId = userMap.get(key, {"uid": "unknown"})['uid']
+                userGirderId = userMap.get(key, {"id": "unknown"})['id']
+                if not record_user_annotations(filterMap, folderId, userGirderId):
+                    continue
+                multiSpeaker = userDataFound[key]['MultiSpeaker']
+                if userDataFound[key]["Emotions"] == 'none':
+                    multiSpeaker = 'EMPTY_NA'
+                yield [
+                    userId,
+                    name,
+                    f'{name}_{t["id"]:04}',
+                    f'{userDataFound[key]["Emotions"].lower()}',
+                    multiSpeaker,
+                ]
+
+
+def session_info_rows(folder, tracks, userMap, filterMap, state):
+    existing_session = state.setdefault('existing_session', set())
+    session = folder_session(folder)
+    session_id = session['session_id']
+    recording_time = ''
+
+    if session_id in existing_session:
+        return
+    existing_session.add(session_id)
+    yield [
+        session_id,
+        session['language'],
+        session['condition'],
+        session['scenario'],
+        session['fle'],
+        session['sme'],
+        session['date'],
+        recording_time,
+    ]
+
+
+def file_info_rows(folder, tracks, userMap, filterMap, state):
+    session = folder_session(folder)
+    length = folder['meta']['ffprobe_info']['duration']
+    type = session['typebase'].split('-')[0]
+    if summary_annotations_exists(folder[AnnotationSummaryMarker]):
+        yield [session['session_id'], session['file_id'], 'video', length, type]
+
+
+def system_input_rows(folder, tracks, userMap, filterMap, state):
+    yield [folder_session(folder)['file_id']]
+
+
+def versions_per_file_rows(folder, tracks, userMap, filterMap, state):
+    name = folder_session(folder)['file_id']
+    complete = folder[AnnotationSummaryMarker]['complete']
+    emotions_count = len(complete['Emotions'])
+    valence_arousal_count = len(complete['Valence'])
+    norms_count = len(complete['Norms'])
+    change_point_count = len(complete['ChangePointComplete'])
+    if emotions_count + valence_arousal_count + norms_count + change_point_count > 0:
+        yield [name, emotions_count, valence_arousal_count, norms_count, change_point_count]
+
+
+# Folder fields read by the tabs built from the folder documents alone
+DOC_FOLDER_FIELDS = ['name', 'meta', AnnotationSummaryMarker]
+# Folders loaded by a single query
+FOLDER_BATCH_SIZE = 500
+# Track fields read by the tab writers, used to project the track queries
+ATTRIBUTE_FIELDS = ['id', 'attributes']
+FEATURE_FIELDS = ['id', 'begin', 'features.frame', 'features.attributes']
+SEGMENT_FIELDS = ['id', 'begin', 'end']
+UMD_KINDS = ANNOTATION_EXISTS_KINDS['UMD']['tracks'] | ANNOTATION_EXISTS_KINDS['UMD']['features']
+COMPLETION_KINDS = frozenset(['Emotions', 'Valence', 'Norms', 'ChangePointComplete'])
+
+# Registered tab writers, each one turns a single folder and its tracks into rows.
+# 'filter' is the filterMap['videos'] task applied to the tab and 'fields' are the
+# track fields it reads, or None for the tabs that only read the folder document.
+# Tabs with 'summary' read the annotation summary stored on the folder instead of
+# scanning the tracks for annotator attributes, and 'kinds' are the attribute kinds
+# a folder needs for the tab to have any rows, so other folders are skipped.
+# Annotators of the 'kinds' of tabs with 'users' are listed in userMap.tab.
+# 'state' makes the state shared by the rows of a tab throughout an export.
+# Rows of the tabs that read tracks are cached per folder annotation revision.
+# 'types' are the column types of the data tabs written as parquet files, with
+# the columns mixing ids and sentinels such as an 'unknown' user id as 'string'.
+TAB_WRITERS = {
+    'segment': {
+        'header': ["file_id", "segment_id", "start", "end"],
+        'rows': segment_rows,
+        'filter': None,
+        'fields': SEGMENT_FIELDS,
+        'summary': True,
+        'kinds': UMD_KINDS,
+    },
+    'valence': {
+        'header': [
             "user_id",
             "file_id",
             "segment_id",
@@ -596,420 +669,795 @@ def export_valence_tab(folders, userMap, user, filterMap):
             "valence_binned",
             "arousal_continuous",
             "arousal_binned",
-        ]
-    )
-    for folderId in folders:
-        folder = Folder().load(folderId, level=AccessType.READ, user=user)
-        videoname = process_video_name(folder['name'])
-        fps = folder['meta']['fps']
-        tracks = crud_annotation.TrackItem().list(folder)
+        ],
+        'rows': valence_rows,
+        'filter': 'VAE',
+        'fields': ATTRIBUTE_FIELDS,
+        'kinds': frozenset(VALENCE_HANDLERS),
+        'users': True,
+        'types': ['string', 'string', 'string', 'float64', 'int64', 'float64', 'int64'],
+    },
+    'emotions': {
+        'header': ["user_id", "file_id", "segment_id", "emotion", "multi_speaker"],
+        'rows': emotions_rows,
+        'filter': 'VAE',
+        'fields': ATTRIBUTE_FIELDS,
+        'kinds': frozenset(EMOTIONS_HANDLERS),
+        'users': True,
+        'types': ['string', 'string', 'string', 'string', 'string'],
+    },
+    'norms': {
+        'header': ["user_id", "file_id", "segment_id", "norm", "status"],
+        'rows': norms_rows,
+        'filter': 'Social Norms',
+        'fields': ATTRIBUTE_FIELDS,
+        'kinds': frozenset(NORMS_HANDLERS),
+        'users': True,
+        'types': ['string', 'string', 'string', 'string', 'string'],
+    },
+    'changepoint': {
+        'header': ["user_id", "file_id", "timestamp", "impact_scalar", "comment"],
+        'rows': changepoint_rows,
+        'filter': 'Changepoint',
+        'fields': FEATURE_FIELDS,
+        'kinds': frozenset(CHANGEPOINT_HANDLERS),
+        'users': True,
+        'types': ['string', 'string', 'float64', 'int64', 'string'],
+    },
+    'remediation': {
+        'header': ["user_id", "file_id", "timestamp", "comment"],
+        'rows': remediation_rows,
+        'filter': None,
+        'fields': FEATURE_FIELDS,
+        'kinds': frozenset(REMEDIATION_HANDLERS),
+        'users': True,
+        'types': ['string', 'string', 'float64', 'string'],
+    },
+    'session_info': {
+        'header': [
+            "session_id",
+            "language",
+            "condition",
+            "scenario",
+            "fle_id",
+            "sme_id",
+            'recording_date',
+            'recording_time',
+        ],
+        'rows': session_info_rows,
+        'filter': None,
+        'fields': None,
+    },
+    'file_info': {
+        'header': ["session_id", "file_uid", "type", "length", "source"],
+        'rows': file_info_rows,
+        'filter': None,
+        'fields': None,
+        'summary': True,
+        'kinds': UMD_KINDS,
+    },
+    'system_input': {
+        'header': ["file_id"],
+        'rows': system_input_rows,
+        'filter': None,
+        'fields': None,
+    },
+    'TA2Annotation': {
+        'header': TA2_HEADER,
+        'rows': ta2_rows,
+        'filter': None,
+        'fields': ATTRIBUTE_FIELDS,
+        'kinds': frozenset(TA2_HANDLERS),
+        'users': True,
+        'state': ta2_state,
+        'types': [
+            'string',
+            'string',
+            'int64',
+            'string',
+            'string',
+            'string',
+            'string',
+            'string',
+            'string',
+            'string',
+            'string',
+            'string',
+            'string',
+            'string',
+            'string',
+        ],
+    },
+    'versions_per_file': {
+        'header': [
+            "file_id",
+            "emotions_count",
+            "valence_arousal_count",
+            "norms_count",
+            "changepoint_count",
+        ],
+        'rows': versions_per_file_rows,
+        'filter': None,
+        'fields': None,
+        'summary': True,
+        'kinds': COMPLETION_KINDS,
+    },
+}
+
+TOMBSTONES_HEADER = ["file_id", "segment_id", "type"]
+# Bumped whenever the layout of manifest.json changes
+MANIFEST_VERSION = 2
+
+# Order and location of the tabs inside of the UMD export zip
+UMD_ZIP_TABS = [
+    ('segment', 'docs/segments.tab'),
+    ('valence', 'data/valence_arousal.tab'),
+    ('emotions', 'data/emotions.tab'),
+    ('norms', 'data/norms.tab'),
+    ('changepoint', 'data/changepoint.tab'),
+    ('remediation', 'data/remediation.tab'),
+    ('session_info', 'docs/session_info.tab'),
+    ('file_info', 'docs/file_info.tab'),
+    ('system_input', 'index_files/system_input.index.tab'),
+    ('versions_per_file', 'docs/versions_per_file.tab'),
+]
+
+
+def track_fields(types):
+    fields = set()
+    for type in types:
+        fields.update(TAB_WRITERS[type]['fields'] or [])
+    return sorted(fields)
+
+
+def get_tab_filter_map(filterMap, task):
+    if filterMap is None or task is None:
+        return None
+    return filterMap['videos'].get(task, None)
+
+
+def tab_rows(folders, userMap, user, type, filterMap=None):
+    for _, fragments in folder_fragments(
+        folders, userMap, user, [type], filterMap, rowTypes=[type]
+    ):
+        yield from fragments[type]
 
-        for t in tracks:
-            if 'attributes' in t.keys():
-                attributes = t['attributes']
-                userDataFound = {}
-                for key in attributes.keys():
-                    if '_Valence' in key:
-                        login = key.replace('_Valence', '')
-                        mapped = login
-                        if mapped not in userDataFound.keys():
-                            userDataFound[mapped] = {}
-                        userDataFound[mapped]['valence_continuous'] = attributes[key]
-                        userDataFound[mapped]['valence_binned'] = bin_value(attributes[key])
-                    if '_Arousal' in key:
-                        login = key.replace('_Arousal', '')
-                        mapped = login
-                        if mapped not in userDataFound.keys():
-                            userDataFound[mapped] = {}
-                        userDataFound[mapped]['arousal_continuous'] = attributes[key]
-                        userDataFound[mapped]['arousal_binned'] = bin_value(attributes[key])
-                for key in userDataFound.keys():                        
-                    userId = userMap.get(key, {"uid": "unknown"})['uid']
-                    userGirderId = userMap.get(key, {"id": "unknown"})['id']
-                    if not record_user_annotations(VAE_filterMap, folderId, userGirderId):
-                        continue
-                    columns = [
-                        userId,
-                        videoname,
-                        f'{videoname}_{t["id"]:04}',
-                        userDataFound[key]['valence_continuous'],
-                        userDataFound[key]['valence_binned'],
-                        userDataFound[key]['arousal_continuous'],
-                        userDataFound[key]['arousal_binned'],
-                    ]
-                    writer.writerow(columns)
-    yield csvFile.getvalue()
-    csvFile.seek(0)
-    csvFile.truncate(0)
-    yield csvFile.getvalue()
+
+def export_tab(folders, userMap, user, type, filterMap=None):
+    rows = tab_rows(folders, userMap, user, type, filterMap)
+    return write_chunks(TAB_WRITERS[type]['header'], rows)
+
+
+def export_changepoint_tab(folders, userMap, user, filterMap):
+    return export_tab(folders, userMap, user, 'changepoint', filterMap)
+
+
+def export_remediation_tab(folders, userMap, user):
+    return export_tab(folders, userMap, user, 'remediation')
+
+
+def export_norms_tab(folders, userMap, user, filterMap):
+    return export_tab(folders, userMap, user, 'norms', filterMap)
+
+
+def export_valence_tab(folders, userMap, user, filterMap):
+    return export_tab(folders, userMap, user, 'valence', filterMap)
 
 
 def export_segment_tab(folders, userMap, user):
-    csvFile = io.StringIO()
-    writer = csv.writer(csvFile, delimiter='\t')
-    writer.writerow(
-        [
-            "file_id",
-            "segment_id",
-            "start",
-            "end",
-        ]
-    )
-    for folderId in folders:
-        folder = Folder().load(folderId, level=AccessType.READ, user=user)
-        videoname = folder['name']
-        name = process_video_name(videoname)
-        fps = folder['meta']['fps']
-        tracks = crud_annotation.TrackItem().list(folder)
-        splits = name.split('_')
-        session_id = name
-        language = ''
-        condition = ''
-        scenario = ''
-        fle_id = ''
-        fme_id = ''
-        recording_date = ''
-        recording_time = ''
-        typebase = ''
-        if len(splits) > 5:
-            language = splits[0]
-            condition = splits[1]
-            scenario = splits[2]
-            fle_id = splits[3]
-            sme_id = splits[4]
-            recording_date = splits[5]
-            if len(splits) > 6:
-                typebase = splits[6]
-
-            updatedName = f'{language}_{condition}_{scenario}_{fle_id}_{sme_id}_{recording_date}_{typebase}'
-        if annotations_exists(tracks):
-            tracks.rewind()
-            minus_frames = 0
-            for t in tracks:
-                if t['id'] == 0 and t['begin'] > 0:
-                    minus_frames = t['begin']
-                start = (t['begin'] - minus_frames) * (1 / fps)
-                end = (t['end'] - minus_frames) * (1 / fps)
-                columns = [updatedName, f'{updatedName}_{t["id"]:04}', start, end]
-                writer.writerow(columns)
-    yield csvFile.getvalue()
-    csvFile.seek(0)
-    csvFile.truncate(0)
-    yield csvFile.getvalue()
+    return export_tab(folders, userMap, user, 'segment')
 
 
 def export_emotions_tab(folders, userMap, user, filterMap):
-    csvFile = io.StringIO()
-    writer = csv.writer(csvFile, delimiter='\t', quotechar='"')
-    writer.writerow(["user_id", "file_id", "segment_id", "emotion", "multi_speaker"])
-    emotions_filterMap = None
-    if filterMap is not None:
-        emotions_filterMap = filterMap['videos']['VAE']
-
-    for folderId in folders:
-        folder = Folder().load(folderId, level=AccessType.READ, user=user)
-        videoname = process_video_name(folder['name'])
-        fps = folder['meta']['fps']
-        tracks = crud_annotation.TrackItem().list(folder)
-        name = videoname
-
-        for t in tracks:
-            if 'attributes' in t.keys():
-                attributes = t['attributes']
-                userDataFound = {}
-                emotionIsNone = False
-                for key in attributes.keys():
-                    if '_Emotions' in key:
-                        login = key.replace('_Emotions', '')
-                        mapped = login
-                        if mapped not in userDataFound.keys():
-                            userDataFound[mapped] = {}
-                        base = ','.join(attributes[key].split('_'))
-                        if base == 'No emotions':
-                            base = 'none'
-                        userDataFound[mapped]['Emotions'] = base
-                    if '_MultiSpeaker' in key:
-                        login = key.replace('_MultiSpeaker', '')
-                        mapped = login
-                        if mapped not in userDataFound.keys():
-                            userDataFound[mapped] = {}
-                        userDataFound[mapped]['MultiSpeaker'] = attributes[key]
-                for key in userDataFound.keys():
-                    userId = userMap.get(key, {"uid": "unknown"})['uid']
-                    userGirderId = userMap.get(key, {"id": "unknown"})['id']
-                    if not record_user_annotations(emotions_filterMap, folderId, userGirderId):
-                        continue
-                    multiSpeaker = userDataFound[key]['MultiSpeaker']
-                    if userDataFound[key]["Emotions"] == 'none':
-                        multiSpeaker = 'EMPTY_NA'
-                    columns = [
-                        userId,
-                        name,
-                        f'{name}_{t["id"]:04}',
-                        f'{userDataFound[key]["Emotions"].lower()}',
-                        multiSpeaker,
-                    ]
-                    writer.writerow(columns)
-    yield csvFile.getvalue()
-    csvFile.seek(0)
-    csvFile.truncate(0)
-    yield csvFile.getvalue()
+    return export_tab(folders, userMap, user, 'emotions', filterMap)
 
 
 def export_session_info_tab(folders, userMap, user):
-    csvFile = io.StringIO()
-    writer = csv.writer(csvFile, delimiter='\t', quotechar='"')
-    writer.writerow(["session_id", "language", "condition", "scenario", "fle_id", "sme_id", 'recording_date', 'recording_time'])
-    existing_session = []
-    for folderId in folders:
-        folder = Folder().load(folderId, level=AccessType.READ, user=user)
-        videoname = process_video_name(folder['name'])
-        name = videoname
-        splits = name.split('_')
-        session_id = name
-        language = ''
-        condition = ''
-        scenario = ''
-        fle_id = ''
-        fme_id = ''
-        recording_date = ''
-        recording_time = ''
-        if len(splits) > 5:
-            language = splits[0]
-            condition = splits[1]
-            scenario = splits[2]
-            fle_id = splits[3]
-            sme_id = splits[4]
-            recording_date = splits[5]
-            session_id = f'{language}_{condition}_{scenario}_{fle_id}_{sme_id}_{recording_date}'
-
-        if session_id in existing_session:
-            continue
-        columns = [session_id, language, condition, scenario, fle_id, sme_id, recording_date, recording_time]
-        writer.writerow(columns)
-        existing_session.append(session_id)
-    yield csvFile.getvalue()
-    csvFile.seek(0)
-    csvFile.truncate(0)
-    yield csvFile.getvalue()
+    return export_tab(folders, userMap, user, 'session_info')
+
 
 def export_file_info_tab(folders, userMap, user):
-    csvFile = io.StringIO()
-    writer = csv.writer(csvFile, delimiter='\t', quotechar='"')
-    writer.writerow(["session_id", "file_uid", "type", "length", "source"])
-    for folderId in folders:
-        folder = Folder().load(folderId, level=AccessType.READ, user=user)
-        videoname = process_video_name(folder['name'])
-        length = folder['meta']['ffprobe_info']['duration']
-        name = videoname
-        splits = name.split('_')
-        session_id = name
-        language = ''
-        condition = ''
-        scenario = ''
-        fle_id = ''
-        fme_id = ''
-        recording_date = ''
-        type = ''
-        tracks = crud_annotation.TrackItem().list(folder)
-        if (annotations_exists(tracks)):
-            if len(splits) > 5:
-                language = splits[0]
-                condition = splits[1]
-                scenario = splits[2]
-                fle_id = splits[3]
-                sme_id = splits[4]
-                recording_date = splits[5]
-                if len(splits) > 6:
-                    typebase = splits[6]
-                    type = typebase.split('-')[0]
-                session_id = f'{language}_{condition}_{scenario}_{fle_id}_{sme_id}_{recording_date}'
-
-            columns = [session_id, name, 'video', length, type]
-            writer.writerow(columns)
-    yield csvFile.getvalue()
-    csvFile.seek(0)
-    csvFile.truncate(0)
-    yield csvFile.getvalue()
+    return export_tab(folders, userMap, user, 'file_info')
+
 
 def export_system_input(folders, userMap, user):
-    csvFile = io.StringIO()
-    writer = csv.writer(csvFile, delimiter='\t', quotechar='"')
-    writer.writerow(["file_id"])
-    for folderId in folders:
-        folder = Folder().load(folderId, level=AccessType.READ, user=user)
-        videoname = process_video_name(folder['name'])
-        length = folder['meta']['ffprobe_info']['duration']
-        name = videoname
-        columns = [name]
-        writer.writerow(columns)
-    yield csvFile.getvalue()
-    csvFile.seek(0)
-    csvFile.truncate(0)
-    yield csvFile.getvalue()
+    return export_tab(folders, userMap, user, 'system_input')
 
-def export_versions_per_file(folders, userMap, user):
-    csvFile = io.StringIO()
-    writer = csv.writer(csvFile, delimiter='\t', quotechar='"')
-    writer.writerow(["file_id", "emotions_count", "valence_arousal_count", "norms_count", "changepoint_count"])
-    for folderId in folders:
-        folder = Folder().load(folderId, level=AccessType.READ, user=user)
-        videoname = process_video_name(folder['name'])
-        fps = folder['meta']['fps']
-        name = videoname
-        tracks = crud_annotation.TrackItem().list(folder)
-        change_point_count = 0
-        changepointUserDataFound = []
-        emotions_count = 0
-        emotionsUserDataFound = {}
-        norms_count = 0
-        normsUserDataFound = {}
-        valence_arousal_count = 0
-        valenceUserDataFound = {}
-        track_length = tracks.count()
-        for t in tracks:
-            if 'features' in t.keys():
-                features = t['features']
-                if 'attributes' in t.keys():
-                    track_attributes = t['attributes']
-                    for key in track_attributes.keys():
-                        if '_Emotions' in key:
-                            login = key.replace('_Emotions', '')
-                            if login not in emotionsUserDataFound.keys():
-                                emotionsUserDataFound[login] = 1
-                            else:
-                                emotionsUserDataFound[login] += 1
-                        if '_Valence' in key:
-                            login = key.replace('_Valence', '')
-                            if login not in valenceUserDataFound.keys():
-                                valenceUserDataFound[login] = 1
-                            else:
-                                valenceUserDataFound[login] += 1
-                        if '_Norms' in key:
-                            login = key.replace('_Norms', '')
-                            if login not in normsUserDataFound.keys():
-                                normsUserDataFound[login] = 1
-                            else:
-                                normsUserDataFound[login] += 1
-                        if '_ChangePointComplete' in key:
-                            login = key.replace('_Norms', '')
-                            if login not in changepointUserDataFound:
-                                changepointUserDataFound.append(login)
-        # iterate over the user counts and make sure they match the track length
-        for login in emotionsUserDataFound.keys():
-            if emotionsUserDataFound[login] == track_length:
-                emotions_count += 1
-        for login in valenceUserDataFound.keys():
-            if valenceUserDataFound[login] == track_length:
-                valence_arousal_count += 1
-        for login in normsUserDataFound.keys():
-            if normsUserDataFound[login] == track_length:
-                norms_count += 1
-        change_point_count = len(changepointUserDataFound)
-        if emotions_count + valence_arousal_count + norms_count + change_point_count > 0:
-            columns = [name, emotions_count, valence_arousal_count, norms_count, change_point_count]
-            writer.writerow(columns)
-    yield csvFile.getvalue()
-    csvFile.seek(0)
-    csvFile.truncate(0)
-    yield csvFile.getvalue()
 
-def generate_tab(folders, userMap, user, type, filterMap=None):
+def export_versions_per_file(folders, userMap, user):
+    return export_tab(folders, userMap, user, 'versions_per_file')
+
+
+class FragmentPlan:
+    """
+    The tabs of an export and what has to be loaded to build their fragments.
+    'summaryTypes' are the tabs that read the folder's annotation summary, the
+    fragments of 'cacheTypes' are cached per folder annotation revision and
+    'userKinds' are the attribute kinds of the annotators listed in userMap.tab.
+    Fragments are cached in `cache`, the export_fragment_cache by default.
+    """
+
+    def __init__(self, types, userMap, filterMap=None, rowTypes=(), cache=None):
+        self.types = types
+        self.cache = export_fragment_cache if cache is None else cache
+        self.rowTypes = rowTypes
+        self.tabs = {type: TAB_WRITERS[type] for type in types}
+        self.filterMaps = {
+            type: get_tab_filter_map(filterMap, self.tabs[type]['filter']) for type in types
+        }
+        self.states = {type: self.tabs[type].get('state', dict)() for type in types}
+        self.summaryTypes = [
+            type
+            for type in types
+            if self.tabs[type]['fields'] is not None or self.tabs[type].get('summary', False)
+        ]
+        self.docOnly = all(self.tabs[type]['fields'] is None for type in types)
+        self.cacheTypes = (
+            [] if self.docOnly else [type for type in self.summaryTypes if type not in rowTypes]
+        )
+        self.fields = track_fields(self.summaryTypes)
+        self.digests = {
+            type: export_digest(
+                type,
+                self.filterMaps[type],
+                userMap.digest,
+                self.states[type].get('normMap', normMap),
+            )
+            for type in self.cacheTypes
+        }
+        self.userKinds = set()
+        for type in types:
+            if self.tabs[type].get('users', False):
+                self.userKinds.update(self.tabs[type]['kinds'])
+
+    def empty_fragments(self, folder, fragments):
+        """Empty the fragments of the tabs the folder has none of the annotations of"""
+        for type in self.summaryTypes:
+            kinds = self.tabs[type].get('kinds', None)
+            if type in fragments or kinds is None:
+                continue
+            if not summary_has_kinds(folder[AnnotationSummaryMarker], kinds):
+                fragments[type] = [] if type in self.rowTypes else ''
+
+    def needs_tracks(self, fragments):
+        return any(
+            self.tabs[type]['fields'] is not None and type not in fragments
+            for type in self.summaryTypes
+        )
+
+
+def cached_fragments(plan, folder, revision):
+    """
+    The cached fragments of the folder at its annotation revision, the types they
+    were found for and the cache key of every cached type.
+    """
+    keys = {}
+    fragments = {}
+    cached = set()
+    for type in plan.cacheTypes:
+        keys[type] = (str(folder['_id']), revision, str(folder.get('updated')), plan.digests[type])
+        fragment = plan.cache.get(keys[type])
+        if fragment is not None:
+            fragments[type] = fragment
+            cached.add(type)
+    return fragments, cached, keys
+
+
+def load_folder_docs(plan, folders, user, metrics):
+    """
+    Yield (folder, tracks, fragments, cached, keys, seconds) of the tabs that only
+    read the folder documents, projected and summarized FOLDER_BATCH_SIZE at a time.
+    """
+    for start in range(0, len(folders), FOLDER_BATCH_SIZE):
+        begin = time.perf_counter()
+        batch = load_folders(
+            folders[start : start + FOLDER_BATCH_SIZE], user, fields=DOC_FOLDER_FIELDS
+        )
+        metrics.count_query('folder')
+        if plan.summaryTypes:
+            metrics.count_query('revision')
+            rebuilt = folder_summaries(batch)
+            if rebuilt:
+                # the summary aggregation and the folder updates
+                metrics.count_query('summary', 1 + rebuilt)
+        seconds = (time.perf_counter() - begin) / max(len(batch), 1)
+        for folder in batch:
+            fragments = {}
+            plan.empty_fragments(folder, fragments)
+            yield folder, [], fragments, set(), {}, seconds
+
+
+def load_folder_tracks(plan, folders, user, metrics):
+    """
+    Yield (folder, tracks, fragments, cached, keys, seconds) in folder order with the
+    cached fragments of every folder, prefetching the tracks of the next folders
+    only when some fragment is neither cached nor empty.
+    """
+
+    def load(item):
+        folder, revision = item
+        start = time.perf_counter()
+        fragments, cached, keys = {}, set(), {}
+        if plan.summaryTypes:
+            stored = folder.get(AnnotationSummaryMarker, None)
+            folder[AnnotationSummaryMarker] = folder_summary(folder, revision)
+            if folder[AnnotationSummaryMarker] is not stored:
+                # the summary aggregation and the folder update
+                metrics.count_query('summary', 2)
+            fragments, cached, keys = cached_fragments(plan, folder, revision)
+        plan.empty_fragments(folder, fragments)
+        tracks = []
+        if plan.needs_tracks(fragments):
+            tracks = load_tracks(folder, plan.fields)
+            metrics.count_query('tracks')
+        return folder, tracks, fragments, cached, keys, time.perf_counter() - start
+
+    return prefetch(folders_with_revisions(folders, user, metrics), load)
+
+
+def build_fragments(plan, folder, tracks, fragments, cached, keys, userMap, metrics):
+    """
+    Serialize the rows of every tab missing from the folder's `fragments`, caching
+    the new fragments under their `keys`.  Returns the seconds spent.
+    """
+    seconds = 0
+    for type in plan.types:
+        start = time.perf_counter()
+        if type in fragments:
+            # cached rows are counted by their line endings
+            rows = len(fragments[type]) if type in plan.rowTypes else fragments[type].count('\n')
+            metrics.add_tab(type, rows=rows, cached=int(type in cached))
+            continue
+        rowArgs = (folder, tracks, userMap, plan.filterMaps[type], plan.states[type])
+        if type in plan.rowTypes:
+            fragments[type] = list(plan.tabs[type]['rows'](*rowArgs))
+            rows = len(fragments[type])
+        else:
+            csvFile = io.StringIO()
+            writer = csv.writer(csvFile, delimiter='\t', quotechar='"')
+            rows = 0
+            for columns in plan.tabs[type]['rows'](*rowArgs):
+                writer.writerow(columns)
+                rows += 1
+            fragments[type] = csvFile.getvalue()
+            if type in keys:
+                plan.cache.put(keys[type], fragments[type])
+        elapsed = time.perf_counter() - start
+        seconds += elapsed
+        metrics.add_tab(type, seconds=elapsed, rows=rows)
+    return seconds
+
+
+def folder_fragments(
+    folders,
+    userMap,
+    user,
+    types,
+    filterMap=None,
+    progress=None,
+    rowTypes=(),
+    metrics=None,
+    cache=None,
+):
+    """
+    Yield (folder, {type: text}) in folder order with the serialized rows of every
+    requested tab.  Each folder and its tracks are loaded once for all of the tabs,
+    and tracks are skipped entirely when every fragment is already cached for the
+    folder's current annotation revision or the folder's annotation summary shows
+    none of the annotations the remaining tabs are built from.
+    Folders and their revisions are loaded FOLDER_BATCH_SIZE at a time.  When none
+    of the tabs read tracks the folder documents are projected and summarized a batch
+    at a time instead, and those cheap fragments are not cached.
+    The fragments of `rowTypes` are the list of rows instead, which are not cached.
+    `progress(done, total)` is called once every folder is serialized and the time,
+    rows and queries of every tab and folder are added to the ExportMetrics `metrics`.
+    Fragments are cached in `cache`, the export_fragment_cache by default.
+    """
+    metrics = metrics or ExportMetrics()
+    plan = FragmentPlan(types, userMap, filterMap, rowTypes, cache)
+    if plan.docOnly:
+        loaded = load_folder_docs(plan, folders, user, metrics)
+    else:
+        loaded = load_folder_tracks(plan, folders, user, metrics)
+    for done, (folder, tracks, fragments, cached, keys, seconds) in enumerate(loaded, 1):
+        if plan.userKinds:
+            userMap.reference(summary_logins(folder[AnnotationSummaryMarker], plan.userKinds))
+        seconds += build_fragments(plan, folder, tracks, fragments, cached, keys, userMap, metrics)
+        metrics.add_folder(folder, seconds, len(tracks))
+        if progress is not None:
+            progress(done, len(folders))
+        yield folder, fragments
+
+
+def export_shard(folderIds, userMap, user, types, filterMap, rowTypes):
+    """
+    folder_fragments of a shard of the folders, built in an export worker process.
+    Returns the [(folder, fragments)] of the shard, the logins it referenced, the
+    state of its metrics and the [(key, fragment)] to cache.  Workers don't keep a
+    fragment cache of their own, so it isn't multiplied by the number of workers
+    and is purged along with the server's.
+    """
+    metrics = ExportMetrics()
+    cache = CollectingCache()
+    fragments = folder_fragments(
+        folderIds, userMap, user, types, filterMap, rowTypes=rowTypes, metrics=metrics, cache=cache
+    )
+    results = list(fragments)
+    return results, userMap.referenced, metrics.state(), cache.entries
+
+
+def sharded_fragments(
+    folders, userMap, user, types, filterMap=None, progress=None, rowTypes=(), metrics=None
+):
+    """
+    folder_fragments of large exports with the tabs built from tracks split across
+    the export worker processes, EXPORT_SHARD_FOLDERS folders at a time, and merged
+    back in folder order.  The tabs built from the folder documents alone stay in
+    process as their rows depend on the preceding folders (e.g. session_info).
+    Small exports are built in process entirely.  The fragments the workers build
+    are cached by this process, for the exports built in process.
+    """
+    metrics = metrics or ExportMetrics()
+    shardTypes = [type for type in types if TAB_WRITERS[type]['fields'] is not None]
+    localTypes = [type for type in types if type not in shardTypes]
+    if not shardTypes or not use_shards(len(folders)):
+        yield from folder_fragments(
+            folders, userMap, user, types, filterMap, progress, rowTypes, metrics
+        )
+        return
+    shardRowTypes = [type for type in rowTypes if type in shardTypes]
+    shards = [
+        (
+            folders[start : start + EXPORT_SHARD_FOLDERS],
+            userMap,
+            user,
+            shardTypes,
+            filterMap,
+            shardRowTypes,
+        )
+        for start in range(0, len(folders), EXPORT_SHARD_FOLDERS)
+    ]
+    local = None
+    localMetrics = ExportMetrics()
+    if localTypes:
+        local = folder_fragments(
+            folders, userMap, user, localTypes, filterMap, rowTypes=rowTypes, metrics=localMetrics
+        )
+    done = 0
+    for results, referenced, state, entries in map_shards(export_shard, shards):
+        userMap.reference(referenced)
+        metrics.merge(state)
+        for key, fragment in entries:
+            export_fragment_cache.put(key, fragment)
+        for folder, fragments in results:
+            if local is not None:
+                fragments.update(next(local)[1])
+            done += 1
+            if progress is not None:
+                progress(done, len(folders))
+            yield folder, fragments
+    # the folders are counted by the shards
+    metrics.merge(localMetrics.state(), folders=False)
+
+
+def parquet_types(types, format='tab'):
+    """The tab types written as parquet files in the export format"""
+    if format != 'parquet':
+        return []
+    return [type for type in types if 'types' in TAB_WRITERS[type]]
+
+
+def tab_path(type, path, format='tab'):
+    if type in parquet_types([type], format):
+        return str(Path(path).with_suffix('.parquet'))
+    return path
+
+
+def export_single_pass(
+    folders,
+    userMap,
+    user,
+    types,
+    filterMap=None,
+    progress=None,
+    manifestFolders=None,
+    format='tab',
+    metrics=None,
+):
+    """
+    Write the fragments of every folder into a buffer for each tab type.  Buffers
+    spill to disk past EXPORT_SPOOL_MB so a large corpus does not stay in memory.
+    With the 'parquet' format the data tabs are written as parquet files instead.
+    The manifest entry of every folder is added to `manifestFolders`.
+    """
+    rowTypes = parquet_types(types, format)
+    buffers = {}
+    parquetTabs = {}
+    for type in types:
+        if type in rowTypes:
+            parquetTabs[type] = ParquetTab(TAB_WRITERS[type]['header'], TAB_WRITERS[type]['types'])
+            continue
+        buffers[type] = tempfile.SpooledTemporaryFile(
+            max_size=EXPORT_SPOOL_MB * 1024 * 1024, mode='w+', newline=''
+        )
+        writer = csv.writer(buffers[type], delimiter='\t', quotechar='"')
+        writer.writerow(TAB_WRITERS[type]['header'])
+    for folder, fragments in sharded_fragments(
+        folders, userMap, user, types, filterMap, progress, rowTypes, metrics
+    ):
+        for type in types:
+            if type in parquetTabs:
+                parquetTabs[type].write_rows(fragments[type])
+            else:
+                buffers[type].write(fragments[type])
+        if manifestFolders is not None:
+            manifestFolders[str(folder['_id'])] = manifest_entry(folder)
+    for type, parquetTab in parquetTabs.items():
+        buffers[type] = parquetTab.close()
+    return buffers
+
+
+def generate_buffer(buffer):
     def downloadGenerator():
-        if type == 'segment':
-            for data in export_segment_tab(folders, userMap, user):
-                yield data
-        if type == 'valence':
-            for data in export_valence_tab(folders, userMap, user, filterMap):
-                yield data
-        if type == 'emotions':
-            for data in export_emotions_tab(folders, userMap, user, filterMap):
-                yield data
-        if type == 'norms':
-            for data in export_norms_tab(folders, userMap, user, filterMap):
-                yield data
-        if type == 'changepoint':
-            for data in export_changepoint_tab(folders, userMap, user, filterMap):
-                yield data
-        if type == 'remediation':
-            for data in export_remediation_tab(folders, userMap, user):
-                yield data
-        if type == 'session_info':
-            for data in export_session_info_tab(folders, userMap, user):
-                yield data
-        if type == 'file_info':
-            for data in export_file_info_tab(folders, userMap, user):
-                yield data
-        if type == 'system_input':
-            for data in export_system_input(folders, userMap, user):
-                yield data
-        if type == 'versions_per_file':
-            for data in export_versions_per_file(folders, userMap, user):
-                yield data
-        if type == 'userMap':
-            for data in export_user_map(userMap):
-                yield data
-        if type == 'TA2Annotation':
-            print('Exporintg TA2 Annotation')
-            for data in export_ta2_annotation(folders, userMap, user):
+        with buffer:
+            buffer.seek(0)
+            data = buffer.read(EXPORT_CHUNK_KB * 1024)
+            while data:
                 yield data
+                data = buffer.read(EXPORT_CHUNK_KB * 1024)
+
     return downloadGenerator
 
-def convert_to_zips(folders, userMap, user, filterMap):
-    def stream():
-        z = ziputil.ZipGenerator()            
-        zip_path = './'
 
-        seg_gen = generate_tab(folders, userMap, user, 'segment', filterMap)
-        for data in z.addFile(seg_gen, Path(f'{zip_path}/docs/segments.tab')):
-            yield data
-        valence_gen = generate_tab(folders, userMap, user, 'valence', filterMap)
-        for data in z.addFile(valence_gen, Path(f'{zip_path}/data/valence_arousal.tab')):
-            yield data
-        emotion_gen = generate_tab(folders, userMap, user, 'emotions', filterMap)
-        for data in z.addFile(emotion_gen, Path(f'{zip_path}/data/emotions.tab')):
-            yield data
-        norm_gen = generate_tab(folders, userMap, user, 'norms', filterMap)
-        for data in z.addFile(norm_gen, Path(f'{zip_path}/data/norms.tab')):
-            yield data
-        changepoint_gen = generate_tab(folders, userMap, user, 'changepoint', filterMap)
-        for data in z.addFile(changepoint_gen, Path(f'{zip_path}/data/changepoint.tab')):
-            yield data
-        remediation_gen = generate_tab(folders, userMap, user, 'remediation', filterMap)
-        for data in z.addFile(remediation_gen, Path(f'{zip_path}/data/remediation.tab')):
-            yield data
-        session_gen = generate_tab(folders, userMap, user, 'session_info')
-        for data in z.addFile(session_gen, Path(f'{zip_path}/docs/session_info.tab')):
+def generate_tab(folders, userMap, user, type, filterMap=None, profile=False):
+    """
+    Download of a single tab, whose metrics are logged once it is written.  With
+    `profile` the export is sampled by the SamplingProfiler.
+    """
+
+    def tabGenerator(metrics):
+        if type in TAB_WRITERS:
+            yield from write_chunks(TAB_WRITERS[type]['header'], [])
+            for _, fragments in sharded_fragments(
+                folders, userMap, user, [type], filterMap, metrics=metrics
+            ):
+                yield fragments[type]
+        if type == 'userMap':
+            metrics.count_query('users')
+            for data in export_user_map(userMap.resolve()):
+                yield data
+
+    def downloadGenerator(profiler):
+        metrics = ExportMetrics()
+        size = 0
+        for data in tabGenerator(metrics):
+            size += len(data)
             yield data
-        file_info_gen = generate_tab(folders, userMap, user, 'file_info')
-        for data in z.addFile(file_info_gen, Path(f'{zip_path}/docs/file_info.tab')):
+        metrics.add_tab(type, size=size)
+        export_report(type, metrics, profiler)
+
+    return profiled(downloadGenerator, profile)
+
+
+def generate_user_map(userMap, allUsers=False, metrics=None):
+    def downloadGenerator():
+        logins = None if allUsers else userMap.referenced
+        if metrics is not None:
+            metrics.count_query('users')
+        for data in export_user_map(userMap.resolve(logins)):
             yield data
-        system_input_gen = generate_tab(folders, userMap, user, 'system_input')
-        for data in z.addFile(system_input_gen, Path(f'{zip_path}/index_files/system_input.index.tab')):
+
+    return downloadGenerator
+
+
+def manifest_entry(folder):
+    return {
+        'revision': folder[AnnotationSummaryMarker]['revision'],
+        'file_id': folder_session(folder)['file_id'],
+    }
+
+
+def deleted_segments(folder, revision):
+    """Ids of the segments of the folder deleted after the annotation revision"""
+    tracks = crud_annotation.TrackItem().find(track_query(folder), fields=['id'])
+    current = set(track['id'] for track in tracks)
+    deleted = crud_annotation.TrackItem().find(
+        {
+            crud_annotation.DATASET: folder['_id'],
+            crud_annotation.REVISION_DELETED: {'$gt': revision},
+        },
+        fields=['id'],
+    )
+    return sorted(set(track['id'] for track in deleted) - current)
+
+
+def delta_folders(folders, user, baseManifest, filterVersions=None):
+    """
+    Compare the folders against the manifest of an earlier export.  Returns the
+    ids of the folders whose annotations changed since, the manifest entries of
+    the unchanged folders and tombstone rows of the segments deleted since and of
+    the files that are no longer exported.  Every folder counts as changed when
+    the filter_file_versions of the export filter files differ from the base
+    export's, so a filter file replaced under the same id is noticed.
+    """
+    baseFolders = baseManifest.get('folders', {})
+    filterChanged = baseManifest.get('filter', []) != (filterVersions or [])
+
+    changed = []
+    unchanged = {}
+    tombstones = []
+    for folder, revision in folders_with_revisions(folders, user):
+        folderId = str(folder['_id'])
+        base = baseFolders.get(folderId, None)
+        if base is not None and base['revision'] == revision and not filterChanged:
+            unchanged[folderId] = base
+            continue
+        changed.append(folderId)
+        if base is not None and base['revision'] != revision:
+            file_id = folder_session(folder)['file_id']
+            for segment in deleted_segments(folder, base['revision']):
+                tombstones.append([file_id, f'{file_id}_{segment:04}', 'segment'])
+    exported = set(str(folderId) for folderId in folders)
+    for folderId, base in baseFolders.items():
+        if folderId not in exported:
+            tombstones.append([base['file_id'], '', 'file'])
+    return {
+        'base': baseManifest.get('created', None),
+        'folders': changed,
+        'unchanged': unchanged,
+        'order': [str(folderId) for folderId in folders],
+        'tombstones': tombstones,
+    }
+
+
+def export_manifest(type, manifestFolders, manifestInfo=None, delta=None, report=None):
+    """
+    manifest.json of an export, which can be passed back as the base manifest of
+    a later export to only receive the changes since.  The `report` of
+    export_report adds the export's metrics and profile.
+    """
+    folders = manifestFolders
+    if delta is not None:
+        folders = {}
+        for folderId in delta['order']:
+            folders[folderId] = delta['unchanged'].get(folderId, None) or manifestFolders[folderId]
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'type': type,
+        'created': datetime.datetime.utcnow().isoformat(),
+        'base': None if delta is None else delta['base'],
+        'folders': folders,
+    }
+    manifest.update(manifestInfo or {})
+    manifest.update(report or {})
+    return manifest
+
+
+def generate_manifest(manifest):
+    def downloadGenerator():
+        yield json.dumps(manifest, indent=2, default=str)
+
+    return downloadGenerator
+
+
+def generate_tombstones(rows):
+    def downloadGenerator():
+        for data in write_chunks(TOMBSTONES_HEADER, rows):
             yield data
-        version_per_file_gen = generate_tab(folders, userMap, user, 'versions_per_file')
-        for data in z.addFile(version_per_file_gen, Path(f'{zip_path}/docs/versions_per_file.tab')):
+
+    return downloadGenerator
+
+
+def generate_delta_files(
+    z, zip_path, type, manifestFolders, manifestInfo, delta, metrics, profiler=None
+):
+    if delta is not None:
+        tombstones = metrics.count_bytes('tombstones', generate_tombstones(delta['tombstones']))
+        for data in z.addFile(tombstones, Path(f'{zip_path}/docs/tombstones.tab')):
             yield data
-        userMap_file = generate_tab(folders, userMap, user, 'userMap')
+    report = export_report(type, metrics, profiler)
+    manifest = export_manifest(type, manifestFolders, manifestInfo, delta, report)
+    for data in z.addFile(generate_manifest(manifest), Path(f'{zip_path}/manifest.json')):
+        yield data
+
+
+def convert_to_zips(
+    folders,
+    userMap,
+    user,
+    filterMap,
+    allUsers=False,
+    progress=None,
+    manifestInfo=None,
+    delta=None,
+    format='tab',
+    profile=False,
+):
+    """
+    Zip of the UMD tabs.  userMap.tab lists the annotators found in the exported
+    folders, or every user with `allUsers`.  With a `delta` from delta_folders
+    only the changed folders are exported, along with their tombstones.  The
+    'parquet' format writes the data tabs as .parquet files.  The metrics of the
+    export, and its profile with `profile`, are written to manifest.json.
+    """
+
+    def stream(profiler):
+        z = ziputil.ZipGenerator()
+        zip_path = './'
+        exportFolders = folders if delta is None else delta['folders']
+        manifestFolders = {}
+        metrics = ExportMetrics()
+
+        buffers = export_single_pass(
+            exportFolders,
+            userMap,
+            user,
+            [type for type, _ in UMD_ZIP_TABS],
+            filterMap,
+            progress,
+            manifestFolders,
+            format,
+            metrics,
+        )
+        for type, path in UMD_ZIP_TABS:
+            path = tab_path(type, path, format)
+            tab_file = metrics.count_bytes(type, generate_buffer(buffers.pop(type)))
+            for data in z.addFile(tab_file, Path(f'{zip_path}/{path}')):
+                yield data
+        userMap_file = metrics.count_bytes('userMap', generate_user_map(userMap, allUsers, metrics))
         for data in z.addFile(userMap_file, Path(f'{zip_path}/userMap.tab')):
             yield data
+        yield from generate_delta_files(
+            z, zip_path, 'UMD', manifestFolders, manifestInfo, delta, metrics, profiler
+        )
         yield z.footer()
 
-    return stream
-
-def convert_to_zips_TA2(folders, userMap, user,):
-    def stream():
-        z = ziputil.ZipGenerator()            
+    return profiled(stream, profile)
+
+
+def convert_to_zips_TA2(
+    folders,
+    userMap,
+    user,
+    allUsers=False,
+    progress=None,
+    manifestInfo=None,
+    delta=None,
+    format='tab',
+    profile=False,
+):
+    def stream(profiler):
+        z = ziputil.ZipGenerator()
         zip_path = './'
-        userMap_file = generate_tab(folders, userMap, user, 'userMap')
+        exportFolders = folders if delta is None else delta['folders']
+        manifestFolders = {}
+        metrics = ExportMetrics()
+        # TA2.tab is written first so userMap.tab only lists the annotators found
+        buffers = export_single_pass(
+            exportFolders,
+            userMap,
+            user,
+            ['TA2Annotation'],
+            progress=progress,
+            manifestFolders=manifestFolders,
+            format=format,
+            metrics=metrics,
+        )
+        userMap_file = metrics.count_bytes('userMap', generate_user_map(userMap, allUsers, metrics))
         for data in z.addFile(userMap_file, Path(f'{zip_path}/userMap.tab')):
             yield data
-        ta2_file = generate_tab(folders, userMap, user, 'TA2Annotation')
-        for data in z.addFile(ta2_file, Path(f'{zip_path}/TA2.tab')):
+        ta2_file = metrics.count_bytes(
+            'TA2Annotation', generate_buffer(buffers.pop('TA2Annotation'))
+        )
+        path = tab_path('TA2Annotation', 'TA2.tab', format)
+        for data in z.addFile(ta2_file, Path(f'{zip_path}/{path}')):
             yield data
+        yield from generate_delta_files(
+            z, zip_path, 'TA2', manifestFolders, manifestInfo, delta, metrics, profiler
+        )
         yield z.footer()
 
-    return stream
+    return profiled(stream, profile)
 
 
 def generate_links_tab(url, folders):
@@ -1040,7 +1488,8 @@ def export_links_tab(url, folders):
         ]
     )
     for folder in folders:
-        name = folder['name'].replace('.mp4', '').replace('Video ', '')
+        session = folder_session(folder)
+        name = session['name']
         LC = 'missing'
         CONDITION = ''
         SCENARIO = ''
@@ -1049,19 +1498,15 @@ def export_links_tab(url, folders):
         DATE = ''
         PERSON = ''
         PERSPECTIVE = ''
-        splits = name.split('_')
-        if len(splits) > 6:
-            LC = splits[0]
-            CONDITION = splits[1]
-            SCENARIO = splits[2]
-            FLE = splits[3]
-            SME = splits[4]
-            DATE = splits[5]
-            PERSON = splits[6]
-            if '-' in PERSON:
-                person_split = PERSON.split('-')
-                PERSON = person_split[0]
-                PERSPECTIVE = person_split[1]
+        if session['person'] is not None:
+            LC = session['language']
+            CONDITION = session['condition']
+            SCENARIO = session['scenario']
+            FLE = session['fle']
+            SME = session['sme']
+            DATE = session['date']
+            PERSON = session['person']
+            PERSPECTIVE = session['perspective']
         root = f'{url}/viewer/{folder["_id"]}?mode='
         vae = f'{root}VAE'
         norms = f'{root}norms'
@@ -1118,108 +1563,3 @@ def export_user_map(userMap):
         csvFile.seek(0)
         csvFile.truncate(0)
     yield csvFile.getvalue()
-
-
-def create_user_filter_map(excel_file):
-    # Read the Excel file
-    try:
-        df = pd.read_excel(excel_file, sheet_name='UserMap')
-    except pd.errors.EmptyDataError:
-        print("The UserMap sheet is empty.")
-        return
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        return
-    expected_columns = ['Name', 'UserName', 'Email', 'GirderId']
-    if not all(col in df.columns for col in expected_columns):
-        print("The sheet UserMap does not contain all the expected columns.")
-        return
-
-    # Create a dictionary to store user data
-    users = {}
-
-    # Iterate through the rows and create a dictionary for each user
-    for _, row in df.iterrows():
-        user_data = {
-            'Name': row['Name'],
-            'UserName': row['UserName'],
-            'Email': row['Email'],
-            'GirderId': row['GirderId']
-        }
-        users[user_data['Name']] = user_data
-    return users
-
-def read_sheet(excel_file, sheet_name, userMap):
-    # Read the Excel file
-    try:
-        df = pd.read_excel(excel_file, sheet_name=sheet_name, header=1)  # Skip the first row (header) in the data
-    except pd.errors.EmptyDataError:
-        print(f"The '{sheet_name}' sheet is empty.")
-        return
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        return
-
-    # Verify that the expected columns exist in the sheet
-    expected_columns = ['File Name', 'Link', 'Annotator', 'Status', 'Completion Date']
-    if not all(col in df.columns for col in expected_columns):
-        print(f"The sheet '{sheet_name}' does not contain all the expected columns.")
-        return
-    df = df.dropna(subset=['File Name', 'Link'])
-
-    # Create a dictionary to store the desired data
-    data_dict = {}
-
-    # Iterate through the rows and extract the desired fields
-    for _, row in df.iterrows():
-        file_name = row['File Name']
-        link = row['Link']
-        annotators = []
-        userGirderIds = []
-        if not row['Annotator'] or pd.isna(row['Annotator']):
-            continue
-        annotators.append(row['Annotator'])
-        userGirderIds = [userMap[row['Annotator']]['GirderId']]
-        status = row['Status']
-        completion_date = row['Completion Date']
-        # Extract GirderId from the link
-        girder_id_match = re.search(r'/([a-f0-9\-]+)\?', link)
-        girder_id = girder_id_match.group(1) if girder_id_match else None
-        if 'Annotator.1' in row.keys() and not pd.isna(row['Annotator.1']):
-            annotators.append(row['Annotator.1'])
-            userGirderIds.append(userMap[row['Annotator.1']]['GirderId'])
-
-        # Create a dictionary for the current row
-        row_data = {
-            'FileName': file_name,
-            'Link': link,
-            'GirderId': girder_id,
-            'Annotator': annotators,
-            'UserGirderIds': userGirderIds,
-            'Status': status,
-            'Completion Date': completion_date
-        }
-
-        # Use the FileName as the dictionary key
-        data_dict[girder_id] = row_data
-
-    return data_dict
-
-def create_filter_mapping(excel_file):
-    filterMap = {}
-
-    userMap = create_user_filter_map(excel_file)
-    fle_vae = read_sheet(excel_file, 'FLE VAE', userMap)
-    fle_social_norms = read_sheet(excel_file, 'FLE Social Norms', userMap)
-    change_point = read_sheet(excel_file, 'Changepoint', userMap)
-    sme_social_norms = read_sheet(excel_file, 'SME Social Norms', userMap)
-    filterMap['users'] = userMap
-    filterMap['videos'] = {
-        'VAE': fle_vae,
-        'Changepoint': change_point,
-    }
-    if (fle_social_norms):
-        filterMap['videos']['Social Norms'] = fle_social_norms
-    if sme_social_norms:
-        filterMap['videos']['Social Norms'] = {**filterMap['videos']['Social Norms'], **sme_social_norms}
-    return filterMap
@@ -0,0 +1,229 @@
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+import time
+
+from girder import logger
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.setting import Setting
+from girder.models.upload import Upload
+from girder.models.user import User
+from girder_jobs.constants import JobStatus
+from girder_jobs.models.job import Job
+
+from UMD_utils import UMD_export
+from UMD_utils.UMD_filter import filter_cache_key, load_filter_map
+from UMD_utils.UMD_users import UserMap
+from UMD_utils.constants import EXPORT_JOB_WORKERS, TA2_CONFIG
+
+EXPORT_JOB_TYPE = 'UMD_export'
+# Folder of the user's Private folder the export zips are written to
+EXPORT_FOLDER_NAME = 'UMD Exports'
+# Minimum number of seconds between job progress updates
+PROGRESS_INTERVAL = 2
+PENDING_STATUSES = [JobStatus.INACTIVE, JobStatus.QUEUED, JobStatus.RUNNING]
+
+_executorLock = threading.Lock()
+_executor = None
+# Ids of the export jobs submitted to the executor of this process
+_submittedJobIds = set()
+
+
+def export_executor():
+    """
+    Threads running the export jobs, started on first use.  Exports don't run on
+    Girder's single events daemon thread so they don't hold up its other handlers.
+    """
+    global _executor
+    with _executorLock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=EXPORT_JOB_WORKERS, thread_name_prefix='UMD_export_job'
+            )
+        return _executor
+
+
+def forget_export(jobId):
+    with _executorLock:
+        _submittedJobIds.discard(jobId)
+
+
+def submit_export(job):
+    with _executorLock:
+        _submittedJobIds.add(job['_id'])
+    future = export_executor().submit(run_export, job)
+    future.add_done_callback(lambda future: forget_export(job['_id']))
+
+
+def fail_orphaned_export_jobs():
+    """
+    Mark the pending export jobs of earlier server processes as failed, as their
+    executor threads are gone.  Called when the plugin is loaded.
+    """
+    with _executorLock:
+        owned = list(_submittedJobIds)
+    jobs = Job().find(
+        {
+            'type': EXPORT_JOB_TYPE,
+            'status': {'$in': PENDING_STATUSES},
+            '_id': {'$nin': owned},
+        }
+    )
+    for job in jobs:
+        Job().updateJob(
+            job, status=JobStatus.ERROR, log='The server restarted before the export finished\n'
+        )
+
+
+def export_key(user, folderIds, ta2Only, allUsers, filterFiles, format='tab'):
+    """
+    Digest of everything the export zip depends on, the contents of the filter
+    files included, so an unchanged export can be served from the artifact of an
+    earlier job.
+    """
+    folders = UMD_export.folders_with_revisions(folderIds, user)
+    return UMD_export.export_digest(
+        'TA2' if ta2Only else 'UMD',
+        allUsers,
+        format,
+        [
+            [str(folder['_id']), revision, str(folder.get('updated'))]
+            for folder, revision in folders
+        ],
+        [filter_cache_key(file) for file in filterFiles],
+        UserMap().digest,
+        Setting().get(TA2_CONFIG),
+    )
+
+
+def find_export_job(user, key):
+    """
+    A pending export job of the user with the same key running in this process, or
+    a successful one whose zip item still exists.
+    """
+    jobs = Job().find(
+        {
+            'meta.umdExportKey': key,
+            'userId': user['_id'],
+            'status': {'$in': PENDING_STATUSES + [JobStatus.SUCCESS]},
+        },
+        sort=[('created', -1)],
+    )
+    for job in jobs:
+        if job['status'] != JobStatus.SUCCESS:
+            with _executorLock:
+                if job['_id'] in _submittedJobIds:
+                    return job
+            continue
+        itemId = job['meta'].get('umdExportItemId', None)
+        if itemId is not None and Item().load(itemId, force=True) is not None:
+            return job
+    return None
+
+
+def create_export_job(
+    user, folderIds, zipName, ta2Only=False, allUsers=False, filterFiles=None, format='tab'
+):
+    """
+    Queue a local job writing the export zip into an item, or reuse an earlier one.
+    The export key and, once written, the item id are in the job's 'meta' so they
+    are visible to the user.
+    """
+    filterFiles = filterFiles or []
+    filterFileIds = [str(file['_id']) for file in filterFiles]
+    key = export_key(user, folderIds, ta2Only, allUsers, filterFiles, format)
+    job = find_export_job(user, key)
+    if job is not None:
+        return job
+    job = Job().createLocalJob(
+        module='UMD_utils.UMD_export_job',
+        function='run_export',
+        title=f'Exporting {zipName}',
+        type=EXPORT_JOB_TYPE,
+        user=user,
+        kwargs={
+            'folderIds': [str(folderId) for folderId in folderIds],
+            'zipName': zipName,
+            'ta2Only': ta2Only,
+            'allUsers': allUsers,
+            'filterFileIds': filterFileIds,
+            'format': format,
+        },
+        otherFields={'meta': {'umdExportKey': key}},
+    )
+    job = Job().updateJob(job, status=JobStatus.QUEUED)
+    submit_export(job)
+    return job
+
+
+def export_folder(user):
+    privateFolder = Folder().createFolder(
+        user, 'Private', parentType='user', public=False, creator=user, reuseExisting=True
+    )
+    return Folder().createFolder(
+        privateFolder, EXPORT_FOLDER_NAME, creator=user, reuseExisting=True
+    )
+
+
+def job_progress(job):
+    last = {'time': 0}
+
+    def progress(done, total):
+        now = time.monotonic()
+        if done == total or now - last['time'] >= PROGRESS_INTERVAL:
+            last['time'] = now
+            Job().updateJob(
+                job,
+                progressTotal=total,
+                progressCurrent=done,
+                progressMessage=f'{done} of {total} folders exported',
+            )
+
+    return progress
+
+
+def run_export(job):
+    kwargs = job['kwargs']
+    job = Job().updateJob(job, status=JobStatus.RUNNING, log='Started export\n')
+    try:
+        user = User().load(job['userId'], force=True)
+        folderIds = kwargs['folderIds']
+        filterFiles = [File().load(fileId, force=True) for fileId in kwargs['filterFileIds']]
+        filterMap = load_filter_map(filterFiles)
+        userMap = UserMap()
+        progress = job_progress(job)
+        format = kwargs.get('format', 'tab')
+        if kwargs['ta2Only']:
+            stream = UMD_export.convert_to_zips_TA2(
+                folderIds, userMap, user, kwargs['allUsers'], progress, format=format
+            )
+        else:
+            stream = UMD_export.convert_to_zips(
+                folderIds, userMap, user, filterMap, kwargs['allUsers'], progress, format=format
+            )
+        with tempfile.TemporaryFile() as zipFile:
+            for data in stream():
+                zipFile.write(data)
+            size = zipFile.tell()
+            zipFile.seek(0)
+            item = Item().createItem(kwargs['zipName'], creator=user, folder=export_folder(user))
+            Upload().uploadFromFile(
+                zipFile,
+                size,
+                kwargs['zipName'],
+                parentType='item',
+                parent=item,
+                user=user,
+                mimeType='application/zip',
+            )
+        Job().updateJob(
+            job,
+            status=JobStatus.SUCCESS,
+            log=f'Export written to item {item["_id"]}\n',
+            otherFields={'meta': dict(job['meta'], umdExportItemId=str(item['_id']))},
+        )
+    except Exception as e:
+        logger.exception(f'UMD export job {job["_id"]} failed')
+        Job().updateJob(job, status=JobStatus.ERROR, log=f'Error in exporting data: {e}\n')
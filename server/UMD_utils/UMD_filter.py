@@ -0,0 +1,156 @@
+import io
+
+from girder import logger
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+import pandas as pd
+
+from UMD_utils import TRUTHY_META_VALUES
+from UMD_utils.UMD_cache import LRUCache
+from UMD_utils.constants import AnnotationFilterMarker
+
+# Number of compiled filter workbooks kept in memory
+FILTER_CACHE_ENTRIES = 16
+USER_COLUMNS = ['Name', 'UserName', 'Email', 'GirderId']
+VIDEO_COLUMNS = ['File Name', 'Link', 'Annotator', 'Status', 'Completion Date']
+# Folder id in the DIVE link of a video row
+LINK_FOLDER_REGEX = r'/([a-f0-9\-]+)\?'
+# Sheets of the videos assigned for every task, later sheets take precedence
+TASK_SHEETS = {
+    'VAE': ['FLE VAE'],
+    'Changepoint': ['Changepoint'],
+    'Social Norms': ['FLE Social Norms', 'SME Social Norms'],
+}
+
+# Compiled filter maps keyed by the filter file and its contents
+filter_map_cache = LRUCache(FILTER_CACHE_ENTRIES, sizeOf=lambda value: 1)
+
+
+def filter_files(folder):
+    """Files uploaded to the annotation filter folder directly under the folder"""
+    filterFolder = Folder().findOne(
+        {
+            'parentId': folder["_id"],
+            f'meta.{AnnotationFilterMarker}': {'$in': TRUTHY_META_VALUES},
+        }
+    )
+    files = []
+    if filterFolder:
+        for item in Folder().childItems(filterFolder):
+            files.extend(Item().childFiles(item))
+    return files
+
+
+def read_sheet(workbook, sheetName, columns, header=0):
+    """The sheet of the workbook, or None when it is missing or lacks the columns"""
+    if sheetName not in workbook.sheet_names:
+        logger.warning(f'The filter workbook has no {sheetName} sheet')
+        return None
+    df = workbook.parse(sheetName, header=header)
+    if not all(column in df.columns for column in columns):
+        logger.warning(f'The {sheetName} sheet does not contain all the expected columns')
+        return None
+    return df
+
+
+def compile_users(workbook):
+    df = read_sheet(workbook, 'UserMap', USER_COLUMNS)
+    if df is None:
+        return {}
+    return {user['Name']: user for user in df[USER_COLUMNS].to_dict('records')}
+
+
+def compile_videos(workbook, sheetName, girderIds):
+    """
+    {folderId: frozenset(userGirderIds)} of the annotators assigned to every video
+    of the sheet, the last row of a video wins.
+    """
+    df = read_sheet(workbook, sheetName, VIDEO_COLUMNS, header=1)
+    if df is None:
+        return None
+    df = df.dropna(subset=['File Name', 'Link', 'Annotator'])
+    df = df[df['Annotator'].astype(bool)]
+    folderIds = df['Link'].astype(str).str.extract(LINK_FOLDER_REGEX, expand=False)
+    annotatorColumns = [df['Annotator']]
+    if 'Annotator.1' in df.columns:
+        annotatorColumns.append(df['Annotator.1'])
+    videos = {}
+    unknown = set()
+    for folderId, *annotators in zip(folderIds, *annotatorColumns):
+        if pd.isna(folderId):
+            continue
+        userIds = set()
+        for annotator in annotators:
+            if pd.isna(annotator) or not annotator:
+                continue
+            if annotator in girderIds:
+                userIds.add(girderIds[annotator])
+            else:
+                unknown.add(annotator)
+        videos[folderId] = frozenset(userIds)
+    if unknown:
+        logger.warning(
+            f'Annotators of the {sheetName} sheet missing from UserMap: {sorted(unknown)}'
+        )
+    return videos
+
+
+def create_filter_mapping(data):
+    """
+    Compile the filter workbook into the filterMap of the exports, parsing the
+    workbook once.  filterMap['videos'][task] maps the folder ids of the task to the
+    girder ids of their assigned annotators, and is None for a task without a sheet.
+    """
+    try:
+        workbook = pd.ExcelFile(io.BytesIO(data))
+    except Exception:
+        logger.exception('The filter workbook could not be read')
+        return {'users': {}, 'videos': {}}
+    users = compile_users(workbook)
+    girderIds = {name: str(user['GirderId']) for name, user in users.items()}
+    videos = {}
+    for task, sheetNames in TASK_SHEETS.items():
+        sheets = [compile_videos(workbook, sheetName, girderIds) for sheetName in sheetNames]
+        sheets = [sheet for sheet in sheets if sheet is not None]
+        if task == 'Social Norms':
+            # only filtered once one of the sheets lists videos
+            sheets = [sheet for sheet in sheets if sheet]
+            if not sheets:
+                continue
+        videos[task] = None
+        for sheet in sheets:
+            videos[task] = {**(videos[task] or {}), **sheet}
+    return {'users': users, 'videos': videos}
+
+
+def filter_cache_key(file):
+    return (
+        str(file['_id']),
+        file.get('sha512', None),
+        str(file.get('updated', file.get('created', None))),
+        file.get('size', None),
+    )
+
+
+def filter_file_versions(files):
+    """The filter_cache_key of every file as lists, recorded in the export manifest"""
+    return [list(filter_cache_key(file)) for file in files or []]
+
+
+def load_filter_map(files):
+    """
+    The compiled filterMap of the last filter file, cached by the file's sha512
+    and updated time so the workbook is only downloaded and parsed once.
+    The cached filterMap is shared by every export and must not be modified.
+    """
+    if not files:
+        return None
+    file = files[-1]
+    key = filter_cache_key(file)
+    filterMap = filter_map_cache.get(key)
+    if filterMap is None:
+        data = b''.join(File().download(file, headers=False)())
+        filterMap = create_filter_mapping(data)
+        filter_map_cache.put(key, filterMap)
+    return filterMap
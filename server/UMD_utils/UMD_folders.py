@@ -0,0 +1,220 @@
+from collections import OrderedDict
+import copy
+import threading
+import time
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from girder.constants import AccessType
+from girder.exceptions import AccessException, ValidationException
+from girder.models.folder import Folder
+
+from UMD_utils.constants import FOLDER_CACHE_TTL
+
+# Folder fields returned by the dataset discovery
+DISCOVERY_FIELDS = ['name', 'created', 'parentId', 'meta']
+# Number of root folder and ACL scope pairs whose datasets are cached
+DISCOVERY_CACHE_ENTRIES = 256
+# Number of folders whose child folders are found with a single query
+DISCOVERY_BATCH_SIZE = 1000
+
+
+class DiscoveryCache:
+    """
+    Thread safe cache of the dataset folders discovered under a root folder for an
+    ACL scope.  Every entry keeps the ids of the folders of the tree it was found
+    in, so it is dropped once one of them or a new child of one of them changes.
+    Entries expire after `ttl` seconds for the changes made without events.
+    `generation` counts the invalidations, a tree discovered while one happened is
+    not stored.
+    """
+
+    def __init__(self, maxEntries, ttl):
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+            expires, _, value = entry
+            if time.monotonic() >= expires:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, treeIds, value, generation):
+        if self.maxEntries < 1 or self.ttl <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, frozenset(treeIds), value)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, folderIds):
+        folderIds = set(folderIds)
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, entry in self._entries.items() if entry[1] & folderIds]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+discovery_cache = DiscoveryCache(DISCOVERY_CACHE_ENTRIES, FOLDER_CACHE_TTL)
+
+
+def dataset_kind(folder):
+    """'TA2' or 'UMD' for the dataset folders, None for the folders organizing them"""
+    meta = folder.get('meta', {})
+    if meta.get('UMDAnnotation', False) == 'TA2':
+        return 'TA2'
+    if meta.get('annotate', False) == True:  # noqa: E712
+        return 'UMD'
+    return None
+
+
+def discovery_restriction(user):
+    """Query of the folders under folders that the user can read"""
+    restrict = {'parentCollection': 'folder'}
+    if not (user and user.get('admin', False)):
+        restrict = {'$and': [restrict, Folder().permissionClauses(user, AccessType.READ)]}
+    return restrict
+
+
+def descendant_folders(root, user):
+    """
+    Every descendant folder of the root the user can read with its 'depth' under
+    the root, sorted by creation.  The tree is walked a level at a time, finding
+    the children of DISCOVERY_BATCH_SIZE parents with a query, and only through
+    readable folders so the descendants of an unreadable folder are left out as
+    well.  No document holds the whole tree, so large trees stay clear of the
+    document and aggregation stage size limits.
+    """
+    restrict = discovery_restriction(user)
+    folders = []
+    parentIds = [root['_id']]
+    depth = 0
+    while parentIds:
+        children = []
+        for start in range(0, len(parentIds), DISCOVERY_BATCH_SIZE):
+            query = {
+                '$and': [
+                    {'parentId': {'$in': parentIds[start : start + DISCOVERY_BATCH_SIZE]}},
+                    restrict,
+                ]
+            }
+            for folder in Folder().find(query, fields=DISCOVERY_FIELDS):
+                folder['depth'] = depth
+                children.append(folder)
+        folders.extend(children)
+        parentIds = [folder['_id'] for folder in children]
+        depth += 1
+    folders.sort(key=lambda folder: (folder['created'], folder['_id']))
+    return folders
+
+
+def acl_scope(user):
+    """Users of the same scope can read the same folders"""
+    if user is None:
+        return ('anonymous',)
+    if user.get('admin', False):
+        return ('admin',)
+    return (str(user['_id']),) + tuple(sorted(str(group) for group in user.get('groups', [])))
+
+
+def discover_dataset_folders(root, user):
+    """
+    The UMD and TA2 dataset folders under the root readable by the user, each list
+    sorted by creation, found a level of the tree at a time, and the ids of every
+    folder of the tree.  Folders inside of a dataset folder are not datasets of
+    their own.
+    """
+    folders = descendant_folders(root, user)
+    treeIds = [root['_id']] + [folder['_id'] for folder in folders]
+    # whether the folder is a dataset or inside of one
+    inDataset = {}
+    for folder in sorted(folders, key=lambda folder: folder['depth']):
+        inDataset[folder['_id']] = dataset_kind(folder) is not None or inDataset.get(
+            folder['parentId'], False
+        )
+    totalFolders = []
+    ta2Folders = []
+    for folder in folders:
+        kind = dataset_kind(folder)
+        if kind is None or inDataset.get(folder['parentId'], False):
+            continue
+        del folder['depth']
+        if kind == 'TA2':
+            ta2Folders.append(folder)
+        else:
+            totalFolders.append(folder)
+    return totalFolders, ta2Folders, treeIds
+
+
+def copy_folder(folder):
+    """Copy of a cached folder whose fields and meta values callers may change"""
+    folder = dict(folder)
+    if 'meta' in folder:
+        folder['meta'] = copy.deepcopy(folder['meta'])
+    return folder
+
+
+def dataset_folders(root, user):
+    """
+    The UMD and TA2 dataset folders under the root readable by the user, cached
+    per root folder and ACL scope.
+    """
+    key = (str(root['_id']), acl_scope(user))
+    cached = discovery_cache.get(key)
+    if cached is None:
+        generation = discovery_cache.generation
+        totalFolders, ta2Folders, treeIds = discover_dataset_folders(root, user)
+        cached = (totalFolders, ta2Folders)
+        discovery_cache.put(key, treeIds, cached, generation)
+    # copies so callers may change the folders and their meta
+    return tuple([copy_folder(folder) for folder in folders] for folders in cached)
+
+
+def invalidate_dataset_folders(event):
+    """
+    Drop the cached datasets of the trees of a folder created, moved, changed or
+    removed.  A moved folder is found in its former tree by its id and in its new
+    one by its parent.
+    """
+    folder = event.info
+    discovery_cache.invalidate([folder.get('_id', None), folder.get('parentId', None)])
+
+
+def load_folders(folderIds, user, level=AccessType.READ, fields=None):
+    """
+    The documents of the folder ids in the requested order, found with a single
+    query and access checked together.  An AccessException lists every folder
+    that doesn't exist or the user lacks `level` access to.
+    """
+    try:
+        ids = [ObjectId(str(folderId)) for folderId in folderIds]
+    except InvalidId as e:
+        raise ValidationException(f'Invalid folder id: {e}', 'folderIds')
+    loadFields = None if fields is None else list(fields) + ['access', 'public']
+    cursor = Folder().find({'_id': {'$in': ids}}, fields=loadFields)
+    removeKeys = () if fields is None else ('access', 'public')
+    found = {
+        folder['_id']: folder
+        for folder in Folder().filterResultsByPermission(cursor, user, level, removeKeys=removeKeys)
+    }
+    denied = [str(folderId) for folderId in ids if folderId not in found]
+    if denied:
+        raise AccessException(f'Access denied for folders: {", ".join(denied)}')
+    return [found[folderId] for folderId in ids]
@@ -0,0 +1,86 @@
+from dive_server import crud_annotation
+from girder.constants import TokenScope
+from girder.exceptions import FilePathException
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.token import Token
+from girder_jobs.models.job import Job
+
+from UMD_tasks import constants, tasks
+
+
+def local_video_path(item):
+    """Path of the item's video when it is stored on a filesystem assetstore"""
+    for file in Item().childFiles(item, limit=1):
+        try:
+            return File().getLocalFilePath(file)
+        except FilePathException:
+            return None
+    return None
+
+
+def segment_videos(folder, user):
+    """
+    Mark the folder as a video dataset and return the videos of it that still
+    need segment tracks, none when the folder already has tracks.
+    """
+    videoItems = Folder().childItems(
+        folder, user=user, filters={"lowerName": {"$regex": constants.videoRegex}}
+    )
+    folder['meta']['type'] = 'video'
+    Folder().save(folder)
+    tracks = crud_annotation.TrackItem().list(folder)
+
+    videos = []
+    if len(list(tracks)) == 0:
+        for item in videoItems:
+            videos.append(
+                {
+                    'folderId': str(item["folderId"]),
+                    'itemId': str(item["_id"]),
+                    'local_path': local_video_path(item),
+                }
+            )
+    else:
+        originalFPS = folder['meta'][constants.OriginalFPSMarker]
+        originalFPSString = folder['meta'][constants.OriginalFPSStringMarker]
+        for item in videoItems:
+            if item['meta'].get('source_video', None) is None:
+                data = {
+                    'source_video': False,
+                    'transcoder': 'ffmpeg',
+                    'originalFps': originalFPS,
+                    'originalFpsString': originalFPSString,
+                    'codec': 'h264',
+                }
+                item['meta'].update(data)
+                Item().save(item)
+    return videos
+
+
+def probe_token(user):
+    """Short lived read only token ffprobe reads the download URLs of the videos with"""
+    token = Token().createToken(
+        user=user, days=constants.PROBE_TOKEN_MINUTES / (24 * 60), scope=TokenScope.DATA_READ
+    )
+    return str(token["_id"])
+
+
+def generate_segment_task(folder, user):
+    """Start a job generating the segment tracks of every video of the folder missing them"""
+    videos = segment_videos(folder, user)
+    if not videos:
+        return
+    token = Token().createToken(user=user, days=2)
+    probeToken = probe_token(user)
+    for video in videos:
+        newjob = tasks.generate_splits.delay(
+            **video,
+            user_id=str(user["_id"]),
+            user_login=str(user["login"]),
+            probe_token=probeToken,
+            girder_job_title="Generating Tracks for UMD video",
+            girder_client_token=str(token["_id"]),
+        )
+        Job().save(newjob.job)
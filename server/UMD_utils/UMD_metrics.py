@@ -0,0 +1,232 @@
+from collections import Counter
+import json
+import os
+import sys
+import threading
+import time
+
+from girder import logger
+
+# Number of the slowest folders listed in the export metrics
+SLOWEST_FOLDERS = 10
+# Seconds between the stack samples of the export profiler
+PROFILE_INTERVAL = 0.01
+# Number of the most sampled stacks and lines listed in the profile
+PROFILE_TOP = 25
+# Prefix of the names of the export's prefetch threads, which are profiled as well
+EXPORT_THREAD_PREFIX = 'UMD_export'
+# Functions of idle pool threads waiting for work, which are not sampled
+IDLE_FUNCTIONS = {('thread.py', '_worker')}
+
+
+def export_thread_prefix():
+    """
+    Name prefix of the prefetch threads of the export running on the current
+    thread, unique among the exports running at once so each profiler only samples
+    the threads of its own export.
+    """
+    return f'{EXPORT_THREAD_PREFIX}-{threading.get_ident()}'
+
+
+class ExportMetrics:
+    """
+    Thread safe counters of an export: the time spent building ('seconds') and
+    writing ('writeSeconds') every tab with its rows and bytes, the folders scanned,
+    the Mongo queries issued by kind and the slowest folders.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.tabs = {}
+        self.queries = Counter()
+        self.folders = []
+        self._lock = threading.Lock()
+
+    def count_query(self, kind, count=1):
+        with self._lock:
+            self.queries[kind] += count
+
+    def add_tab(self, type, seconds=0, rows=0, size=0, cached=0, writeSeconds=0):
+        with self._lock:
+            tab = self.tabs.setdefault(
+                type,
+                {'seconds': 0, 'writeSeconds': 0, 'rows': 0, 'bytes': 0, 'cachedFolders': 0},
+            )
+            tab['seconds'] += seconds
+            tab['writeSeconds'] += writeSeconds
+            tab['rows'] += rows
+            tab['bytes'] += size
+            tab['cachedFolders'] += cached
+
+    def add_folder(self, folder, seconds, tracks=0):
+        with self._lock:
+            self.folders.append(
+                {
+                    'id': str(folder['_id']),
+                    'name': folder['name'],
+                    'seconds': round(seconds, 4),
+                    'tracks': tracks,
+                }
+            )
+
+    def state(self):
+        """The counters as plain values, sent back by the export worker processes"""
+        with self._lock:
+            return {
+                'tabs': {type: dict(tab) for type, tab in self.tabs.items()},
+                'queries': dict(self.queries),
+                'folders': list(self.folders),
+            }
+
+    def merge(self, state, folders=True):
+        """Add the counters of a worker's state, and its folders with `folders`"""
+        for type, tab in state['tabs'].items():
+            self.add_tab(
+                type,
+                seconds=tab['seconds'],
+                rows=tab['rows'],
+                size=tab['bytes'],
+                cached=tab['cachedFolders'],
+                writeSeconds=tab['writeSeconds'],
+            )
+        with self._lock:
+            self.queries.update(state['queries'])
+            if folders:
+                self.folders.extend(state['folders'])
+
+    def count_bytes(self, type, generator):
+        """Wrap a download generator, adding the time and bytes of the data to the tab"""
+
+        def downloadGenerator():
+            start = time.perf_counter()
+            size = 0
+            for data in generator():
+                size += len(data)
+                yield data
+            self.add_tab(type, size=size, writeSeconds=time.perf_counter() - start)
+
+        return downloadGenerator
+
+    def summary(self):
+        with self._lock:
+            return {
+                'seconds': round(time.perf_counter() - self.started, 4),
+                'folders': len(self.folders),
+                'tabs': {
+                    type: dict(
+                        tab,
+                        seconds=round(tab['seconds'], 4),
+                        writeSeconds=round(tab['writeSeconds'], 4),
+                    )
+                    for type, tab in self.tabs.items()
+                },
+                'queries': dict(self.queries),
+                'slowestFolders': sorted(self.folders, key=lambda folder: -folder['seconds'])[
+                    :SLOWEST_FOLDERS
+                ],
+            }
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}'
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the thread that starts the profiler and of the export's
+    prefetch threads with sys._current_frames, counting the most frequent stacks
+    and the lines the threads were executing.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self.lines = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+        self._prefix = None
+
+    def threads(self):
+        idents = {self._target}
+        for thread in threading.enumerate():
+            # the pool threads are named '<prefix>_<n>'
+            if thread.name.startswith(f'{self._prefix}_'):
+                idents.add(thread.ident)
+        return idents
+
+    def sample(self):
+        while not self._stop.wait(self.interval):
+            idents = self.threads()
+            for ident, frame in sys._current_frames().items():
+                if ident not in idents:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FUNCTIONS:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                self.samples += 1
+                self.lines[stack[0]] += 1
+                self.stacks[' <- '.join(stack[:8])] += 1
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._prefix = export_thread_prefix()
+        self._thread = threading.Thread(target=self.sample, name='UMD_profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.summary()
+
+    def summary(self):
+        return {
+            'interval': self.interval,
+            'samples': self.samples,
+            'lines': [
+                {'line': line, 'samples': count}
+                for line, count in self.lines.most_common(PROFILE_TOP)
+            ],
+            'stacks': [
+                {'stack': stack, 'samples': count}
+                for stack, count in self.stacks.most_common(PROFILE_TOP)
+            ],
+        }
+
+
+def export_report(name, metrics, profiler=None):
+    """Stop the profiler and log the metrics, returning both for the export manifest"""
+    report = {'metrics': metrics.summary()}
+    if profiler is not None:
+        report['profile'] = profiler.stop()
+    logger.info(f'UMD export {name} metrics: {json.dumps(report, default=str)}')
+    return report
+
+
+def profiled(generator, profile=False):
+    """
+    Download generator of generator(profiler), which is passed a running
+    SamplingProfiler with `profile` or None.  The profiler is stopped however the
+    download ends.
+    """
+
+    def downloadGenerator():
+        profiler = SamplingProfiler().start() if profile else None
+        try:
+            yield from generator(profiler)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+
+    return downloadGenerator
@@ -0,0 +1,101 @@
+import tempfile
+
+from UMD_utils.constants import EXPORT_CHUNK_ROWS, EXPORT_SPOOL_MB
+
+EXPORT_FORMATS = ['tab', 'parquet']
+
+
+def to_int(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return int(value)
+    raise ValueError(f'{value!r} is not an integer')
+
+
+def to_float(value):
+    if isinstance(value, (bool, int, float)):
+        return float(value)
+    if isinstance(value, str):
+        return float(value)
+    raise ValueError(f'{value!r} is not a number')
+
+
+def to_string(value):
+    # the csv module writes None as an empty field
+    if value is None:
+        return ''
+    return str(value)
+
+
+# Column types of the tab schemas and how row values are coerced to them.  Values
+# are never written as null: columns that mix ids with sentinels such as an
+# 'unknown' user id or an empty field are typed 'string', and a value a numeric
+# column can't represent raises a ValueError.
+COLUMN_CONVERTERS = {
+    'int64': to_int,
+    'float64': to_float,
+    'string': to_string,
+}
+
+
+def arrow_type(type):
+    import pyarrow as pa
+
+    if type == 'string':
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.type_for_alias(type)
+
+
+class ParquetTab:
+    """
+    Parquet file of a tab with the `header` columns of the given `types`.  Rows are
+    collected into columns and written as a record batch every EXPORT_CHUNK_ROWS
+    rows; string columns are dictionary encoded.  The file spills to disk past
+    EXPORT_SPOOL_MB.
+    """
+
+    def __init__(self, header, types):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.types = types
+        self.converters = [COLUMN_CONVERTERS[type] for type in types]
+        self.schema = pa.schema([(name, arrow_type(type)) for name, type in zip(header, types)])
+        self.buffer = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MB * 1024 * 1024)
+        self.writer = pq.ParquetWriter(self.buffer, self.schema, use_dictionary=True)
+        self.pending = [[] for _ in types]
+        self.rowCount = 0
+
+    def write_rows(self, rows):
+        for columns in rows:
+            for values, convert, value in zip(self.pending, self.converters, columns):
+                values.append(convert(value))
+            self.rowCount += 1
+            if self.rowCount >= EXPORT_CHUNK_ROWS:
+                self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+
+        if not self.rowCount:
+            return
+        arrays = []
+        for values, type in zip(self.pending, self.types):
+            if type == 'string':
+                arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, type=pa.type_for_alias(type)))
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.pending = [[] for _ in self.types]
+        self.rowCount = 0
+
+    def close(self):
+        """Finish the file and return its buffer"""
+        self.flush()
+        self.writer.close()
+        return self.buffer
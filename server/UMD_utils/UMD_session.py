@@ -0,0 +1,87 @@
+import time
+
+from girder import logger
+from girder.models.folder import Folder
+from girder_jobs.constants import JobStatus
+from girder_jobs.models.job import Job
+
+from UMD_tasks.constants import SessionMarker
+from UMD_tasks.utils import SESSION_VERSION, parse_session_name
+
+SESSION_JOB_TYPE = 'UMD_session_backfill'
+# Number of folders checked between job progress updates
+BACKFILL_BATCH_SIZE = 500
+SESSION_FIELD = f'meta.{SessionMarker}'
+# Dataset folders of the UMD and TA2 annotation, as found by the recursive exports
+DATASET_QUERY = {'$or': [{'meta.annotate': True}, {'meta.UMDAnnotation': 'TA2'}]}
+
+
+def folder_session(folder):
+    """
+    The session fields stored in the folder meta, or parsed from the folder name
+    when they are missing or the folder was renamed since.
+    """
+    session = folder.get('meta', {}).get(SessionMarker, None)
+    if (
+        session is None
+        or session.get('version', None) != SESSION_VERSION
+        or session.get('folder_name', None) != folder['name']
+    ):
+        session = parse_session_name(folder['name'])
+    return session
+
+
+def backfill_sessions(progress=None):
+    """
+    Store the parsed session of every dataset folder lacking an up to date one,
+    including the folders renamed since their session was stored.
+    """
+    updated = 0
+    total = Folder().collection.count_documents(DATASET_QUERY)
+    folders = Folder().find(DATASET_QUERY, fields=['name', SESSION_FIELD])
+    for done, folder in enumerate(folders, 1):
+        session = folder_session(folder)
+        if session is not folder.get('meta', {}).get(SessionMarker, None):
+            # $set so the folder's updated time is untouched
+            Folder().update({'_id': folder['_id']}, {'$set': {SESSION_FIELD: session}})
+            updated += 1
+        if progress is not None and (done % BACKFILL_BATCH_SIZE == 0 or done == total):
+            progress(done, total)
+    return updated
+
+
+def create_backfill_job(user):
+    job = Job().createLocalJob(
+        module='UMD_utils.UMD_session',
+        function='run_backfill',
+        title='Storing the session fields of the dataset folders',
+        type=SESSION_JOB_TYPE,
+        user=user,
+        asynchronous=True,
+    )
+    Job().scheduleJob(job)
+    return job
+
+
+def run_backfill(job):
+    job = Job().updateJob(job, status=JobStatus.RUNNING, log='Started session backfill\n')
+    start = time.monotonic()
+
+    def progress(done, total):
+        Job().updateJob(
+            job,
+            progressTotal=total,
+            progressCurrent=done,
+            progressMessage=f'{done} of {total} folders checked',
+        )
+
+    try:
+        updated = backfill_sessions(progress)
+        Job().updateJob(
+            job,
+            status=JobStatus.SUCCESS,
+            log=f'Stored the session of {updated} folders in {time.monotonic() - start:.1f}s\n',
+        )
+    except Exception as e:
+        logger.exception(f'UMD session backfill job {job["_id"]} failed')
+        Job().updateJob(job, status=JobStatus.ERROR, log=f'Error in the session backfill: {e}\n')
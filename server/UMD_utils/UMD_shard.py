@@ -0,0 +1,78 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+
+from girder.models import getDbConfig
+from girder.utility import config
+
+from UMD_utils.constants import EXPORT_SHARD_MIN_FOLDERS, EXPORT_WORKERS
+
+_poolLock = threading.Lock()
+_pool = None
+
+
+def use_shards(folderCount):
+    """Whether an export of folderCount folders is built by the worker processes"""
+    return EXPORT_WORKERS > 0 and folderCount >= EXPORT_SHARD_MIN_FOLDERS
+
+
+def init_worker(databaseUri):
+    # workers use the server's database whatever configuration they would load
+    config.getConfig().setdefault('database', {})['uri'] = databaseUri
+
+
+def shard_pool():
+    """
+    The export worker processes, started on first use and kept for later exports.
+    Workers are spawned rather than forked so they don't inherit the server's
+    threads and Mongo connections.
+    """
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=EXPORT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(getDbConfig().get('uri', None),),
+            )
+        return _pool
+
+
+def reset_pool(pool):
+    """Drop a broken pool so the next export starts new workers"""
+    global _pool
+    with _poolLock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def map_shards(function, shards, lookahead=None):
+    """
+    Yield function(*shard) for every shard in the original order, computed by the
+    worker processes with `lookahead` shards submitted ahead of the one yielded.
+    """
+    pool = shard_pool()
+    lookahead = EXPORT_WORKERS * 2 if lookahead is None else lookahead
+    shardIter = iter(shards)
+    pending = deque()
+    try:
+        for shard in shardIter:
+            pending.append(pool.submit(function, *shard))
+            if len(pending) >= lookahead:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for shard in shardIter:
+                pending.append(pool.submit(function, *shard))
+                break
+            yield result
+    except BrokenProcessPool:
+        reset_pool(pool)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,297 @@
+import datetime
+
+from bson.objectid import ObjectId
+from dive_server import crud_annotation
+from girder.models.folder import Folder
+
+from UMD_utils.UMD_attributes import ANNOTATION_EXISTS_KINDS, attributeKeyRegex
+from UMD_utils.constants import AnnotationSummaryMarker
+
+# Number of folders summarized by a single aggregation
+SUMMARY_BATCH_SIZE = 200
+# Bumped whenever the stored summary layout changes so old summaries are rebuilt
+SUMMARY_VERSION = 2
+# Kinds a user has completed once every track of the folder carries them
+COMPLETION_KINDS = ['Emotions', 'Valence', 'Norms']
+
+
+def empty_counts():
+    return {'trackCount': 0, 'tracks': {}, 'features': {}, 'featuredTracks': {}}
+
+
+def summary_pipeline(folderIds):
+    """
+    Aggregation producing the number of current tracks per folder and, for every
+    annotator attribute, how many tracks carry it on the track ('tracks') or on one
+    of its features ('features').  Track level keys are counted on every track, and
+    'featured' counts the ones on tracks with features, which the annotation exists
+    and completion checks are limited to.
+    """
+    return [
+        {
+            '$match': {
+                crud_annotation.DATASET: {'$in': folderIds},
+                crud_annotation.REVISION_DELETED: {'$exists': False},
+            }
+        },
+        {
+            '$project': {
+                crud_annotation.DATASET: 1,
+                'featured': {'$cond': [{'$eq': [{'$type': '$features'}, 'missing']}, 0, 1]},
+                'trackKeys': {
+                    '$map': {
+                        'input': {'$objectToArray': {'$ifNull': ['$attributes', {}]}},
+                        'as': 'attribute',
+                        'in': '$$attribute.k',
+                    }
+                },
+                'featureKeys': {
+                    '$reduce': {
+                        'input': {'$ifNull': ['$features', []]},
+                        'initialValue': [],
+                        'in': {
+                            '$setUnion': [
+                                '$$value',
+                                {
+                                    '$map': {
+                                        'input': {
+                                            '$objectToArray': {'$ifNull': ['$$this.attributes', {}]}
+                                        },
+                                        'as': 'attribute',
+                                        'in': '$$attribute.k',
+                                    }
+                                },
+                            ]
+                        },
+                    }
+                },
+            }
+        },
+        {
+            '$project': {
+                crud_annotation.DATASET: 1,
+                'keys': {
+                    '$concatArrays': [
+                        {
+                            '$map': {
+                                'input': '$trackKeys',
+                                'as': 'key',
+                                'in': {'k': '$$key', 'level': 'tracks', 'featured': '$featured'},
+                            }
+                        },
+                        {
+                            '$map': {
+                                'input': '$featureKeys',
+                                'as': 'key',
+                                'in': {'k': '$$key', 'level': 'features', 'featured': 1},
+                            }
+                        },
+                    ]
+                },
+            }
+        },
+        {
+            '$facet': {
+                'tracks': [
+                    {'$group': {'_id': f'${crud_annotation.DATASET}', 'count': {'$sum': 1}}},
+                ],
+                'keys': [
+                    {'$unwind': '$keys'},
+                    {
+                        '$project': {
+                            crud_annotation.DATASET: 1,
+                            'level': '$keys.level',
+                            'featured': '$keys.featured',
+                            'parsed': {
+                                '$regexFind': {
+                                    'input': '$keys.k',
+                                    'regex': attributeKeyRegex.pattern,
+                                }
+                            },
+                        }
+                    },
+                    {'$match': {'parsed': {'$ne': None}}},
+                    {
+                        '$group': {
+                            '_id': {
+                                'dataset': f'${crud_annotation.DATASET}',
+                                'level': '$level',
+                                'login': {'$arrayElemAt': ['$parsed.captures', 0]},
+                                'kind': {'$arrayElemAt': ['$parsed.captures', 1]},
+                            },
+                            'count': {'$sum': 1},
+                            'featured': {'$sum': '$featured'},
+                        }
+                    },
+                ],
+            }
+        },
+    ]
+
+
+def annotation_counts(folderIds):
+    """
+    Count the annotations of the folders server side, returning
+    {folderId: {'trackCount': n, 'tracks': {kind: {login: count}}, 'features': {...}}}
+    with the track level counts of the tracks with features in 'featuredTracks'.
+    """
+    ids = [ObjectId(str(folderId)) for folderId in folderIds]
+    summaries = {str(folderId): empty_counts() for folderId in ids}
+    collection = crud_annotation.TrackItem().collection
+    for start in range(0, len(ids), SUMMARY_BATCH_SIZE):
+        pipeline = summary_pipeline(ids[start : start + SUMMARY_BATCH_SIZE])
+        for result in collection.aggregate(pipeline):
+            for item in result['tracks']:
+                summaries[str(item['_id'])]['trackCount'] = item['count']
+            for item in result['keys']:
+                group = item['_id']
+                summary = summaries[str(group['dataset'])]
+                summary[group['level']].setdefault(group['kind'], {})[group['login']] = item[
+                    'count'
+                ]
+                if group['level'] == 'tracks' and item['featured']:
+                    featured = summary['featuredTracks'].setdefault(group['kind'], {})
+                    featured[group['login']] = item['featured']
+    return summaries
+
+
+def folder_revision(folder):
+    return crud_annotation.RevisionLogItem().latest(folder)
+
+
+def folder_revisions(folders):
+    """The latest annotation revision of every folder by id, with a single aggregation"""
+    ids = [folder['_id'] for folder in folders]
+    revisions = {str(folderId): 0 for folderId in ids}
+    collection = crud_annotation.RevisionLogItem().collection
+    pipeline = [
+        {'$match': {crud_annotation.DATASET: {'$in': ids}}},
+        {
+            '$group': {
+                '_id': f'${crud_annotation.DATASET}',
+                'revision': {'$max': f'${crud_annotation.REVISION}'},
+            }
+        },
+    ]
+    for result in collection.aggregate(pipeline):
+        revisions[str(result['_id'])] = result['revision']
+    return revisions
+
+
+def build_summary(counts, revision):
+    """
+    Compact summary of the annotations of a folder stored on the folder document.
+    Logins are only stored as values since they may contain '.'.  Whether the
+    folder is annotated and which annotators completed it only look at the tracks
+    with features, as the baseline exports did.
+    """
+    trackCounts = counts['tracks']
+    featuredCounts = counts['featuredTracks']
+    featureCounts = counts['features']
+    kinds = sorted(set(trackCounts.keys()) | set(featureCounts.keys()))
+    complete = {
+        kind: sorted(
+            login
+            for login, count in featuredCounts.get(kind, {}).items()
+            if count == counts['trackCount']
+        )
+        for kind in COMPLETION_KINDS
+    }
+    complete['ChangePointComplete'] = sorted(featuredCounts.get('ChangePointComplete', {}).keys())
+    return {
+        'version': SUMMARY_VERSION,
+        'revision': revision,
+        'updated': datetime.datetime.utcnow(),
+        'trackCount': counts['trackCount'],
+        'kinds': kinds,
+        'logins': {
+            kind: sorted(
+                set(trackCounts.get(kind, {}).keys()) | set(featureCounts.get(kind, {}).keys())
+            )
+            for kind in kinds
+        },
+        'counts': [
+            {'level': level, 'kind': kind, 'login': login, 'count': count}
+            for level in ['tracks', 'features']
+            for kind, logins in sorted(counts[level].items())
+            for login, count in sorted(logins.items())
+        ],
+        'annotated': {
+            annotationType: any(kind in existsKinds['tracks'] for kind in featuredCounts.keys())
+            or any(kind in existsKinds['features'] for kind in featureCounts.keys())
+            for annotationType, existsKinds in ANNOTATION_EXISTS_KINDS.items()
+        },
+        'complete': complete,
+    }
+
+
+def update_summaries(folders, revisions=None):
+    """Rebuild and store the annotation summary of every folder document."""
+    if revisions is None:
+        revisions = {str(folder['_id']): folder_revision(folder) for folder in folders}
+    counts = annotation_counts([folder['_id'] for folder in folders])
+    for folder in folders:
+        folderId = str(folder['_id'])
+        summary = build_summary(counts[folderId], revisions[folderId])
+        # $set so the folder's updated time and other concurrent changes are untouched
+        Folder().update({'_id': folder['_id']}, {'$set': {AnnotationSummaryMarker: summary}})
+        folder[AnnotationSummaryMarker] = summary
+    return len(folders)
+
+
+def update_summary(folder):
+    update_summaries([folder])
+    return folder[AnnotationSummaryMarker]
+
+
+def folder_summary(folder, revision=None):
+    """
+    The stored annotation summary of the folder, rebuilt first if annotations were
+    saved since it was built.
+    """
+    if revision is None:
+        revision = folder_revision(folder)
+    summary = folder.get(AnnotationSummaryMarker, None)
+    if stale_summary(summary, revision):
+        summary = update_summary(folder)
+    return summary
+
+
+def summary_annotations_exists(summary, annotationType='UMD'):
+    return summary['annotated'][annotationType]
+
+
+def summary_has_kinds(summary, kinds):
+    return any(kind in kinds for kind in summary['kinds'])
+
+
+def summary_logins(summary, kinds):
+    logins = set()
+    for kind in kinds:
+        logins.update(summary['logins'].get(kind, []))
+    return logins
+
+
+def stale_summary(summary, revision):
+    return (
+        summary is None
+        or summary.get('version', None) != SUMMARY_VERSION
+        or summary.get('revision', None) != revision
+    )
+
+
+def folder_summaries(folders):
+    """
+    Set the annotation summary on every folder document, looking up the revisions
+    of all of the folders at once and rebuilding the stale summaries together.
+    Returns the number of summaries rebuilt.
+    """
+    revisions = folder_revisions(folders)
+    stale = [
+        folder
+        for folder in folders
+        if stale_summary(folder.get(AnnotationSummaryMarker, None), revisions[str(folder['_id'])])
+    ]
+    for start in range(0, len(stale), SUMMARY_BATCH_SIZE):
+        update_summaries(stale[start : start + SUMMARY_BATCH_SIZE], revisions)
+    return len(stale)
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import threading
+import time
+
+from bson.objectid import ObjectId
+from girder.models.user import User
+
+from UMD_utils.constants import USER_MAP_TTL
+
+_indexLock = threading.Lock()
+_index = None
+_indexExpires = 0
+
+
+def assign_uids(users):
+    """
+    Map the login of every user to its export uid, the last 5 digits of the user's
+    id incremented until unique in the order the users are given.
+    """
+    index = {}
+    conflictMap = {}
+    for item in users:
+        base_uid = int(str(item["_id"]), 16)
+        # lets grab the last 5 digits
+        uid = int(str(base_uid)[-5:])
+        while uid in conflictMap.keys():  # ensure a unique ID
+            uid = uid + 1
+        conflictMap[uid] = True
+        index[item["login"]] = {
+            'id': str(item["_id"]),
+            'login': item['login'],
+            'uid': uid,
+            'girderId': str(item["_id"]),
+        }
+    return index
+
+
+def user_index():
+    """The login to uid index of every user, rebuilt after USER_MAP_TTL seconds"""
+    global _index, _indexExpires
+    with _indexLock:
+        if _index is None or time.monotonic() >= _indexExpires:
+            _index = assign_uids(User().find({}, fields=['login']))
+            _indexExpires = time.monotonic() + USER_MAP_TTL
+        return _index
+
+
+def invalidate_user_index(event=None):
+    global _index
+    with _indexLock:
+        _index = None
+
+
+class UserMap:
+    """
+    Export user map backed by the cached uid index.  `get` only returns the index
+    entry ('id', 'login', 'uid', 'girderId'); the rest of a user's fields are read
+    by `resolve` for the logins that end up in the export.
+    """
+
+    def __init__(self, index=None):
+        self._index = user_index() if index is None else index
+        self.referenced = set()
+        self.digest = hashlib.sha1(
+            json.dumps([[login, entry['uid']] for login, entry in self._index.items()]).encode()
+        ).hexdigest()
+
+    def __contains__(self, login):
+        return login in self._index
+
+    def __getitem__(self, login):
+        return self._index[login]
+
+    def get(self, login, default=None):
+        return self._index.get(login, default)
+
+    def keys(self):
+        return self._index.keys()
+
+    def reference(self, logins):
+        self.referenced.update(login for login in logins if login in self._index)
+
+    def resolve(self, logins=None):
+        """
+        Full user map of the logins, or of every user, with the exported fields
+        of each user in uid index order.
+        """
+        if logins is None:
+            logins = self._index.keys()
+        logins = set(logins)
+        ids = [ObjectId(self._index[login]['id']) for login in logins if login in self._index]
+        users = {
+            user['login']: user
+            for user in User().find(
+                {'_id': {'$in': ids}}, fields=['login', 'email', 'firstName', 'lastName']
+            )
+        }
+        userMap = {}
+        for login, entry in self._index.items():
+            if login not in logins or login not in users:
+                continue
+            user = users[login]
+            userMap[login] = dict(
+                entry, email=user['email'], first=user['firstName'], last=user['lastName']
+            )
+        return userMap
@@ -1,7 +1,32 @@
+import os
+
 FPSMarker = "fps"
 OriginalFPSMarker = "originalFps"
 OriginalFPSStringMarker = "originalFpsString"
 AnnotationFilterMarker = 'annotationFilter'
+AnnotationSummaryMarker = 'annotationSummary'
+
+# Export generators yield once this many rows or kilobytes have been buffered
+EXPORT_CHUNK_ROWS = int(os.environ.get('UMD_EXPORT_CHUNK_ROWS', 1000))
+EXPORT_CHUNK_KB = int(os.environ.get('UMD_EXPORT_CHUNK_KB', 256))
+# Per-tab buffers of the single pass export are moved to disk past this size
+EXPORT_SPOOL_MB = int(os.environ.get('UMD_EXPORT_SPOOL_MB', 16))
+# Number of folders (and their tracks) loaded ahead of the one being exported
+EXPORT_PREFETCH = int(os.environ.get('UMD_EXPORT_PREFETCH', 4))
+# Size of the in process cache of serialized per-folder export rows
+EXPORT_CACHE_MB = int(os.environ.get('UMD_EXPORT_CACHE_MB', 256))
+# Worker processes building the tabs of large exports, 0 builds them in process
+EXPORT_WORKERS = int(os.environ.get('UMD_EXPORT_WORKERS', 0))
+# Folders sent to a worker process at a time
+EXPORT_SHARD_FOLDERS = int(os.environ.get('UMD_EXPORT_SHARD_FOLDERS', 25))
+# Exports of fewer folders are built in process
+EXPORT_SHARD_MIN_FOLDERS = int(os.environ.get('UMD_EXPORT_SHARD_MIN_FOLDERS', 200))
+# Threads running the export jobs, other export jobs are queued
+EXPORT_JOB_WORKERS = int(os.environ.get('UMD_EXPORT_JOB_WORKERS', 2))
+# Seconds the login to export uid index is reused before the users are read again
+USER_MAP_TTL = int(os.environ.get('UMD_USER_MAP_TTL', 300))
+# Seconds the dataset folders found under a root folder are reused, 0 disables the cache
+FOLDER_CACHE_TTL = int(os.environ.get('UMD_FOLDER_CACHE_TTL', 600))
 
 
 TA2_CONFIG = 'TA2_config'
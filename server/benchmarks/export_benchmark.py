@@ -0,0 +1,447 @@
+"""
+Export benchmark on a synthetic corpus of N folders x M segments x K annotators.
+
+Every export_*_tab, convert_to_zips and convert_to_zips_TA2 is run against a
+local Mongo database, which is dropped afterwards, or with --in-memory against a
+throwaway mongod started by pymongo_inmemory.  For each export the rows per
+second, time to first byte and peak RSS are reported.
+
+    python -m benchmarks.export_benchmark --folders 200 --segments 100 --annotators 5
+    python -m benchmarks.export_benchmark --in-memory --save-baseline baseline.json
+    python -m benchmarks.export_benchmark --in-memory --baseline baseline.json
+
+With --baseline the run fails when an export is slower than the stored rows per
+second (or time to first byte) by more than --tolerance.
+"""
+
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+
+import click
+
+DEFAULT_URI = 'mongodb://localhost:27017/umd_export_benchmark'
+# Seconds between samples of the resident set size
+RSS_INTERVAL = 0.01
+
+EMOTIONS = ['No emotions', 'joy_anger', 'sadness', 'fear_surprise', 'trust']
+NORM_VALUES = ['adhere', 'violate', 'adhere_violate', 'noann', 'EMPTY_NA']
+NORM_NAMES = ['Apology', 'Criticism', 'Greeting', 'Request', 'Thanks']
+TA2_STATUSES = ['adhered', 'violated']
+
+# (name, export function, takes a filterMap) of the single tab exports of the UMD folders
+TAB_EXPORTS = [
+    ('segment', 'export_segment_tab', False),
+    ('valence', 'export_valence_tab', True),
+    ('emotions', 'export_emotions_tab', True),
+    ('norms', 'export_norms_tab', True),
+    ('changepoint', 'export_changepoint_tab', True),
+    ('remediation', 'export_remediation_tab', False),
+    ('session_info', 'export_session_info_tab', False),
+    ('file_info', 'export_file_info_tab', False),
+    ('system_input', 'export_system_input', False),
+    ('versions_per_file', 'export_versions_per_file', False),
+]
+
+
+def current_rss():
+    """Resident set size of the process in bytes"""
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class PeakRSS:
+    """Samples the resident set size on a thread while the block runs"""
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._sampled = os.path.exists('/proc/self/statm')
+
+    def sample(self):
+        while not self._stop.wait(RSS_INTERVAL):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        if self._sampled:
+            self.peak = current_rss()
+            self._thread = threading.Thread(target=self.sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        if self._sampled:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, current_rss())
+        else:
+            # ru_maxrss is the peak of the whole process, in kilobytes on Linux
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def session_name(index, ta2=False):
+    language = 'LC1' if index % 2 else 'LC2'
+    condition = 'OP2-SRI' if ta2 else 'CLNG'
+    return (
+        f'Video {language}_{condition}_S{index:05}_FLE{index % 7}_SME{index % 5}'
+        f'_2023{1 + index % 12:02}{1 + index % 28:02}_FLE-TIGHT.mp4'
+    )
+
+
+def segment_attributes(rng, logins, segment, segmentCount):
+    attributes = {}
+    for login in logins:
+        attributes[f'{login}_Valence'] = rng.randint(1, 1000)
+        attributes[f'{login}_Arousal'] = rng.randint(1, 1000)
+        attributes[f'{login}_Emotions'] = rng.choice(EMOTIONS)
+        attributes[f'{login}_MultiSpeaker'] = rng.choice(['yes', 'no'])
+        attributes[f'{login}_Norms'] = {name: rng.choice(NORM_VALUES) for name in NORM_NAMES}
+        if segment == segmentCount - 1:
+            attributes[f'{login}_ChangePointComplete'] = True
+    return attributes
+
+
+def changepoint_attributes(rng, logins):
+    attributes = {}
+    for login in logins:
+        if rng.random() < 0.3:
+            attributes[f'{login}_ImpactV2.0'] = rng.randint(1, 5000)
+            attributes[f'{login}_Comment'] = 'changepoint'
+        if rng.random() < 0.1:
+            attributes[f'{login}_RemediationComment'] = 'remediation'
+    return attributes
+
+
+def ta2_attributes(rng, logins):
+    attributes = {
+        'speaker': rng.choice(['FLE', 'SME']),
+        'norms': [
+            {'norm': name, 'status': rng.choice(TA2_STATUSES), 'remediation': rng.randint(0, 1)}
+            for name in rng.sample(NORM_NAMES, 2)
+        ],
+        'alerts': [{'delayed': rng.random() < 0.5}],
+        'rephrase': [],
+    }
+    for login in logins:
+        attributes[f'{login}_ASRQuality'] = rng.randint(1, 5)
+        attributes[f'{login}_MTQuality'] = rng.randint(1, 5)
+        attributes[f'{login}_AlertsQuality'] = rng.randint(1, 5)
+        attributes[f'{login}_RephrasingQuality'] = rng.randint(1, 5)
+        attributes[f'{login}_DelayedRemediation'] = rng.random() < 0.5
+        attributes[f'{login}_TA2Norms'] = {
+            name: {'status': rng.choice(TA2_STATUSES), 'remediation': rng.randint(0, 1)}
+            for name in rng.sample(NORM_NAMES, 2)
+        }
+    return attributes
+
+
+def folder_tracks(rng, logins, segmentCount, fps, ta2=False):
+    """Segments of 15 seconds each, with annotations of every annotator"""
+    tracks = []
+    length = 15 * fps
+    for segment in range(segmentCount):
+        begin = segment * length
+        end = begin + length - 1
+        features = [
+            {'frame': begin, 'bounds': [0, 0, 1280, 720], 'keyframe': True},
+            {'frame': end, 'bounds': [0, 0, 1280, 720], 'keyframe': True},
+        ]
+        if ta2:
+            attributes = ta2_attributes(rng, logins)
+        else:
+            attributes = segment_attributes(rng, logins, segment, segmentCount)
+            features[0]['attributes'] = changepoint_attributes(rng, logins)
+        tracks.append(
+            {
+                'id': segment,
+                'begin': begin,
+                'end': end,
+                'confidencePairs': [['segment', 1.0]],
+                'attributes': attributes,
+                'features': features,
+                'meta': {},
+            }
+        )
+    return tracks
+
+
+def seed_corpus(folderCount, segmentCount, annotatorCount, ta2Count, seed):
+    from dive_server import crud_annotation
+    from girder.models.collection import Collection
+    from girder.models.folder import Folder
+    from girder.models.setting import Setting
+    from girder.models.user import User
+
+    # registers the validator of the TA2 configuration setting
+    import UMD_server.UMD_configuration.views  # noqa: F401
+    from UMD_utils.UMD_summary import update_summaries
+    from UMD_utils.constants import BASENORMMAP, TA2_CONFIG
+
+    rng = random.Random(seed)
+    admin = User().createUser(
+        'benchmark', 'benchmark-password', 'Bench', 'Mark', 'benchmark@example.com', admin=True
+    )
+    annotators = [
+        User().createUser(
+            f'annotator{index}', 'benchmark-password', 'Anno', 'Tator', f'a{index}@example.com'
+        )
+        for index in range(annotatorCount)
+    ]
+    logins = [annotator['login'] for annotator in annotators]
+    Setting().set(TA2_CONFIG, {'normMap': BASENORMMAP})
+    collection = Collection().createCollection('Export Benchmark', admin)
+    root = Folder().createFolder(collection, 'Sessions', parentType='collection', creator=admin)
+    folders = []
+    ta2Folders = []
+    for index in range(folderCount + ta2Count):
+        ta2 = index >= folderCount
+        fps = 30
+        folder = Folder().createFolder(root, session_name(index, ta2), creator=admin)
+        meta = {'type': 'video', 'fps': fps, 'ffprobe_info': {'duration': str(segmentCount * 15)}}
+        if ta2:
+            meta['UMDAnnotation'] = 'TA2'
+        else:
+            meta['annotate'] = True
+        folder = Folder().setMetadata(folder, meta)
+        crud_annotation.save_annotations(
+            folder,
+            admin,
+            upsert_tracks=folder_tracks(rng, logins, segmentCount, fps, ta2),
+            delete_tracks=[],
+            upsert_groups=[],
+            delete_groups=[],
+        )
+        (ta2Folders if ta2 else folders).append(folder)
+    # summaries are kept up to date on annotation saves, so they are built up front
+    update_summaries(folders + ta2Folders)
+    return {
+        'user': admin,
+        'folderIds': [str(folder['_id']) for folder in folders],
+        'ta2FolderIds': [str(folder['_id']) for folder in ta2Folders],
+    }
+
+
+def measure(name, stream, rows=None):
+    """
+    Consume the chunks of the stream, returning the elapsed seconds, time to the
+    first non empty chunk, bytes, rows and peak RSS of the export.
+    """
+    textRows = 0
+    size = 0
+    ttfb = None
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        for chunk in stream():
+            if ttfb is None and chunk:
+                ttfb = time.perf_counter() - start
+            size += len(chunk)
+            if rows is None and isinstance(chunk, str):
+                textRows += chunk.count('\n')
+        elapsed = time.perf_counter() - start
+    if rows is None:
+        rows = max(textRows - 1, 0)
+    return {
+        'name': name,
+        'seconds': elapsed,
+        'ttfb': ttfb if ttfb is not None else elapsed,
+        'bytes': size,
+        'rows': rows,
+        'rowsPerSecond': rows / elapsed if elapsed else 0,
+        'peakRssMB': rss.peak / (1024 * 1024),
+    }
+
+
+def run_benchmarks(corpus, repeat, formats, warmCache):
+    from UMD_utils import UMD_export
+    from UMD_utils.UMD_cache import export_fragment_cache
+    from UMD_utils.UMD_users import UserMap
+
+    user = corpus['user']
+    folderIds = corpus['folderIds']
+    ta2FolderIds = corpus['ta2FolderIds']
+    benchmarks = []
+    for name, function, filtered in TAB_EXPORTS:
+        export = getattr(UMD_export, function)
+
+        def stream(export=export, filtered=filtered):
+            if filtered:
+                return export(folderIds, UserMap(), user, None)
+            return export(folderIds, UserMap(), user)
+
+        benchmarks.append((f'tab:{name}', stream, None))
+    benchmarks.append(
+        (
+            'tab:TA2Annotation',
+            lambda: UMD_export.export_ta2_annotation(ta2FolderIds, UserMap(), user),
+            None,
+        )
+    )
+
+    results = {}
+    for name, stream, rows in benchmarks:
+        results[name] = repeat_benchmark(
+            name, stream, rows, repeat, warmCache, export_fragment_cache
+        )
+    umdRows = sum(results[f'tab:{type}']['rows'] for type, _ in UMD_export.UMD_ZIP_TABS)
+    ta2Rows = results['tab:TA2Annotation']['rows']
+    for format in formats:
+        zips = [
+            (
+                f'zip:UMD:{format}',
+                lambda format=format: UMD_export.convert_to_zips(
+                    folderIds, UserMap(), user, None, format=format
+                )(),
+                umdRows,
+            ),
+            (
+                f'zip:TA2:{format}',
+                lambda format=format: UMD_export.convert_to_zips_TA2(
+                    ta2FolderIds, UserMap(), user, format=format
+                )(),
+                ta2Rows,
+            ),
+        ]
+        for name, stream, rows in zips:
+            results[name] = repeat_benchmark(
+                name, stream, rows, repeat, warmCache, export_fragment_cache
+            )
+    return results
+
+
+def repeat_benchmark(name, stream, rows, repeat, warmCache, cache):
+    """Median of the repeated runs of the export"""
+    runs = []
+    for _ in range(repeat):
+        if not warmCache:
+            cache.clear()
+        runs.append(measure(name, stream, rows))
+    result = dict(runs[0])
+    for key in ['seconds', 'ttfb', 'rowsPerSecond']:
+        result[key] = statistics.median(run[key] for run in runs)
+    result['peakRssMB'] = max(run['peakRssMB'] for run in runs)
+    return result
+
+
+def compare_baseline(results, baseline, tolerance):
+    """Exports slower than the baseline by more than the tolerance"""
+    failures = []
+    for name, result in results.items():
+        base = baseline.get(name, None)
+        if base is None:
+            continue
+        if base['rowsPerSecond'] and result['rowsPerSecond'] < base['rowsPerSecond'] * (
+            1 - tolerance
+        ):
+            failures.append(
+                f'{name}: {result["rowsPerSecond"]:.0f} rows/s, '
+                f'baseline {base["rowsPerSecond"]:.0f} rows/s'
+            )
+        if result['ttfb'] > base['ttfb'] * (1 + tolerance) and result['ttfb'] - base['ttfb'] > 0.05:
+            failures.append(
+                f'{name}: {result["ttfb"] * 1000:.0f} ms to first byte, '
+                f'baseline {base["ttfb"] * 1000:.0f} ms'
+            )
+    return failures
+
+
+def print_report(results):
+    click.echo(
+        f'{"export":<26}{"rows":>10}{"rows/s":>12}{"seconds":>10}'
+        f'{"ttfb ms":>10}{"MB":>10}{"peak RSS MB":>13}'
+    )
+    for name, result in results.items():
+        click.echo(
+            f'{name:<26}{result["rows"]:>10}{result["rowsPerSecond"]:>12.0f}'
+            f'{result["seconds"]:>10.3f}{result["ttfb"] * 1000:>10.1f}'
+            f'{result["bytes"] / (1024 * 1024):>10.2f}{result["peakRssMB"]:>13.1f}'
+        )
+
+
+def drop_database():
+    from girder.models import getDbConnection
+
+    client = getDbConnection()
+    client.drop_database(client.get_default_database().name)
+
+
+def benchmark(options):
+    from girder.models import getDbConnection
+
+    database = getDbConnection().get_default_database()
+    if database.list_collection_names():
+        raise click.ClickException(
+            f'Database {database.name} is not empty, use a dedicated benchmark database'
+        )
+    try:
+        start = time.perf_counter()
+        corpus = seed_corpus(
+            options['folders'],
+            options['segments'],
+            options['annotators'],
+            options['ta2_folders'],
+            options['seed'],
+        )
+        click.echo(
+            f'Seeded {options["folders"]} + {options["ta2_folders"]} TA2 folders x '
+            f'{options["segments"]} segments x {options["annotators"]} annotators '
+            f'in {time.perf_counter() - start:.1f}s'
+        )
+        return run_benchmarks(corpus, options['repeat'], options['format'], options['warm_cache'])
+    finally:
+        if not options['keep']:
+            drop_database()
+
+
+@click.command(name='export_benchmark', help='Benchmark the exports on a synthetic corpus')
+@click.option('--folders', default=50, show_default=True, help='UMD annotation folders')
+@click.option('--ta2-folders', default=10, show_default=True, help='TA2 annotation folders')
+@click.option('--segments', default=60, show_default=True, help='Segments per folder')
+@click.option('--annotators', default=4, show_default=True, help='Annotators of every segment')
+@click.option('--seed', default=1, show_default=True)
+@click.option('--repeat', default=3, show_default=True, help='Runs of every export')
+@click.option(
+    '--format',
+    multiple=True,
+    default=['tab'],
+    show_default=True,
+    type=click.Choice(['tab', 'parquet']),
+    help='Formats of the zip exports',
+)
+@click.option('--warm-cache', is_flag=True, help='Keep the fragment cache between runs')
+@click.option('--mongo-uri', default=DEFAULT_URI, show_default=True)
+@click.option('--in-memory', is_flag=True, help='Run against a throwaway mongod')
+@click.option('--keep', is_flag=True, help='Keep the benchmark database')
+@click.option('--baseline', type=click.Path(exists=True), help='Fail when slower than this')
+@click.option('--tolerance', default=0.2, show_default=True, help='Allowed slowdown')
+@click.option('--save-baseline', type=click.Path(), help='Store the results as a baseline')
+def main(**options):
+    if options['in_memory']:
+        from pymongo_inmemory import Mongod
+
+        with Mongod() as mongod:
+            uri = mongod.connection_string.rstrip('/')
+            os.environ['GIRDER_MONGO_URI'] = f'{uri}/umd_export_benchmark'
+            results = benchmark(options)
+    else:
+        os.environ['GIRDER_MONGO_URI'] = options['mongo_uri']
+        results = benchmark(options)
+    print_report(results)
+    if options['save_baseline']:
+        with open(options['save_baseline'], 'w') as baselineFile:
+            json.dump(results, baselineFile, indent=2)
+    if options['baseline']:
+        with open(options['baseline']) as baselineFile:
+            failures = compare_baseline(results, json.load(baselineFile), options['tolerance'])
+        for failure in failures:
+            click.echo(f'SLOWER {failure}', err=True)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+# (folders, segments, annotators, TA2 folders) of the synthetic test corpus
+CORPUS_SIZE = (6, 8, 3, 3)
+# Seeds of the corpora every export is compared on
+CORPUS_SEEDS = [1, 2]
+
+
+@pytest.fixture(scope='session')
+def database():
+    """Girder's database on a throwaway mongod"""
+    from pymongo_inmemory import Mongod
+
+    with Mongod() as mongod:
+        uri = f'{mongod.connection_string.rstrip("/")}/umd_test'
+        os.environ['GIRDER_MONGO_URI'] = uri
+        from girder.models import getDbConnection
+        from girder.utility import config
+
+        config.getConfig().setdefault('database', {})['uri'] = uri
+        yield getDbConnection()
+
+
+def reset_database(client):
+    from UMD_utils.UMD_cache import export_fragment_cache
+    from UMD_utils.UMD_folders import discovery_cache
+    from UMD_utils.UMD_users import invalidate_user_index
+
+    client.drop_database(client.get_default_database().name)
+    export_fragment_cache.clear()
+    discovery_cache.clear()
+    invalidate_user_index()
+
+
+@pytest.fixture(scope='session', params=CORPUS_SEEDS)
+def corpus(request, database):
+    """The benchmark corpus of the seed, with the annotation summaries built"""
+    from benchmarks.export_benchmark import seed_corpus
+
+    reset_database(database)
+    yield seed_corpus(*CORPUS_SIZE, request.param)
+    reset_database(database)
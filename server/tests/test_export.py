@@ -0,0 +1,360 @@
+"""
+The exports are compared byte for byte with the tab writers they replaced, kept
+in baseline_export.py, on synthetic corpora.
+"""
+
+import io
+import json
+import zipfile
+
+import baseline_export
+import pytest
+
+# (tab export function, zip path of the tab, takes a filterMap)
+UMD_TABS = [
+    ('export_segment_tab', 'docs/segments.tab', False),
+    ('export_valence_tab', 'data/valence_arousal.tab', True),
+    ('export_emotions_tab', 'data/emotions.tab', True),
+    ('export_norms_tab', 'data/norms.tab', True),
+    ('export_changepoint_tab', 'data/changepoint.tab', True),
+    ('export_remediation_tab', 'data/remediation.tab', False),
+    ('export_session_info_tab', 'docs/session_info.tab', False),
+    ('export_file_info_tab', 'docs/file_info.tab', False),
+    ('export_system_input', 'index_files/system_input.index.tab', False),
+    ('export_versions_per_file', 'docs/versions_per_file.tab', False),
+]
+TAB_PATHS = {name: path for name, path, _ in UMD_TABS}
+FILTER_TASKS = ['VAE', 'Social Norms', 'Changepoint']
+# Tabs written as parquet files
+PARQUET_TABS = ['valence', 'emotions', 'norms', 'changepoint', 'remediation']
+
+
+@pytest.fixture(autouse=True)
+def baseline_norm_map(monkeypatch):
+    # the baseline TA2 export writes the configured norm ids into the shared map
+    monkeypatch.setattr(baseline_export, 'normMap', dict(baseline_export.normMap))
+
+
+@pytest.fixture
+def in_process_shards(monkeypatch):
+    """Shard every export, building the shards in process"""
+    from UMD_utils import UMD_export
+
+    def map_shards(function, shards, lookahead=None):
+        for shard in shards:
+            yield function(*shard)
+
+    monkeypatch.setattr(UMD_export, 'use_shards', lambda folderCount: True)
+    monkeypatch.setattr(UMD_export, 'EXPORT_SHARD_FOLDERS', 2)
+    monkeypatch.setattr(UMD_export, 'map_shards', map_shards)
+
+
+def baseline_user_map():
+    """The user map the baseline exports were given"""
+    from girder.models.user import User
+
+    userMap = {}
+    uids = set()
+    for user in User().find():
+        uid = int(str(int(str(user['_id']), 16))[-5:])
+        while uid in uids:
+            uid += 1
+        uids.add(uid)
+        userMap[user['login']] = {'id': str(user['_id']), 'uid': uid}
+    return userMap
+
+
+def join(chunks):
+    return ''.join(chunks)
+
+
+def baseline_tab(name, folderIds, user, filtered, filterMap=None):
+    args = (filterMap,) if filtered else ()
+    return join(getattr(baseline_export, name)(folderIds, baseline_user_map(), user, *args))
+
+
+def export_tab(name, folderIds, user, filtered, filterMap=None):
+    from UMD_utils import UMD_export
+    from UMD_utils.UMD_users import UserMap
+
+    args = (filterMap,) if filtered else ()
+    return join(getattr(UMD_export, name)(folderIds, UserMap(), user, *args))
+
+
+def unzip(stream):
+    data = b''.join(chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in stream())
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        return {name.lstrip('./'): z.read(name) for name in z.namelist()}
+
+
+def filter_maps(corpus):
+    """
+    The baseline and compiled filter maps letting every other annotator through
+    for the tasks of every other folder.
+    """
+    from girder.models.user import User
+
+    girderIds = sorted(str(user['_id']) for user in User().find())[::2]
+    folderIds = corpus['folderIds'][::2]
+    baseline = {
+        'videos': {
+            task: {folderId: {'UserGirderIds': girderIds} for folderId in folderIds}
+            for task in FILTER_TASKS
+        }
+    }
+    compiled = {
+        'videos': {
+            task: {folderId: frozenset(girderIds) for folderId in folderIds}
+            for task in FILTER_TASKS
+        }
+    }
+    return baseline, compiled
+
+
+@pytest.mark.parametrize('name,path,filtered', UMD_TABS)
+def test_tab_matches_baseline(corpus, name, path, filtered):
+    expected = baseline_tab(name, corpus['folderIds'], corpus['user'], filtered)
+    assert export_tab(name, corpus['folderIds'], corpus['user'], filtered) == expected
+
+
+@pytest.mark.parametrize('name,path,filtered', [tab for tab in UMD_TABS if tab[2]])
+def test_filtered_tab_matches_baseline(corpus, name, path, filtered):
+    baselineFilter, compiledFilter = filter_maps(corpus)
+    expected = baseline_tab(name, corpus['folderIds'], corpus['user'], True, baselineFilter)
+    assert export_tab(name, corpus['folderIds'], corpus['user'], True, compiledFilter) == expected
+
+
+def test_ta2_matches_baseline(corpus):
+    expected = baseline_tab('export_ta2_annotation', corpus['ta2FolderIds'], corpus['user'], False)
+    actual = export_tab('export_ta2_annotation', corpus['ta2FolderIds'], corpus['user'], False)
+    assert actual == expected
+
+
+def zip_tabs(corpus):
+    from UMD_utils import UMD_export
+    from UMD_utils.UMD_users import UserMap
+
+    files = unzip(UMD_export.convert_to_zips(corpus['folderIds'], UserMap(), corpus['user'], None))
+    return {path: files[path].decode() for _, path, _ in UMD_TABS}, files
+
+
+def test_zip_tabs_match_baseline(corpus):
+    tabs, files = zip_tabs(corpus)
+    for name, path, filtered in UMD_TABS:
+        assert tabs[path] == baseline_tab(name, corpus['folderIds'], corpus['user'], filtered)
+    manifest = json.loads(files['manifest.json'])
+    assert list(manifest['folders']) == corpus['folderIds']
+
+
+def test_second_zip_is_built_from_the_cached_fragments(corpus):
+    from UMD_utils.UMD_cache import export_fragment_cache
+
+    def cached_folders(files):
+        tabs = json.loads(files['manifest.json'])['metrics']['tabs']
+        return {type: tab['cachedFolders'] for type, tab in tabs.items()}
+
+    export_fragment_cache.clear()
+    first, firstFiles = zip_tabs(corpus)
+    tabs, files = zip_tabs(corpus)
+    assert tabs == first
+    assert not any(cached_folders(firstFiles).values())
+    # folders without rows of a tab are written without the cache
+    cached = cached_folders(files)
+    assert cached['segment'] == len(corpus['folderIds'])
+    assert all(cached[type] for type in ['valence', 'emotions', 'norms', 'changepoint'])
+
+
+def test_sharded_zip_tabs_match_baseline(corpus, in_process_shards):
+    tabs, _ = zip_tabs(corpus)
+    for name, path, filtered in UMD_TABS:
+        assert tabs[path] == baseline_tab(name, corpus['folderIds'], corpus['user'], filtered)
+
+
+def test_sharded_ta2_matches_baseline(corpus, in_process_shards):
+    from UMD_utils import UMD_export
+    from UMD_utils.UMD_users import UserMap
+
+    files = unzip(UMD_export.convert_to_zips_TA2(corpus['ta2FolderIds'], UserMap(), corpus['user']))
+    expected = baseline_tab('export_ta2_annotation', corpus['ta2FolderIds'], corpus['user'], False)
+    assert files['TA2.tab'].decode() == expected
+
+
+def test_summaries_follow_annotation_saves(corpus):
+    from dive_server import crud_annotation
+    from girder.models.folder import Folder
+
+    from UMD_utils.UMD_summary import folder_summary
+    from UMD_utils.constants import AnnotationSummaryMarker
+
+    folder = Folder().load(corpus['folderIds'][0], force=True)
+    summary = folder_summary(folder)
+    track = crud_annotation.TrackItem().list(folder).sort('id', 1).limit(1)[0]
+    track['attributes']['summarytest_Valence'] = 500
+    track['attributes']['summarytest_Arousal'] = 500
+    crud_annotation.save_annotations(
+        folder,
+        corpus['user'],
+        upsert_tracks=[track],
+        delete_tracks=[],
+        upsert_groups=[],
+        delete_groups=[],
+    )
+    folder = Folder().load(folder['_id'], force=True)
+    updated = folder_summary(folder)
+    assert updated['revision'] > summary['revision']
+    assert 'summarytest' in updated['logins']['Valence']
+    stored = Folder().load(folder['_id'], force=True)[AnnotationSummaryMarker]
+    assert stored['revision'] == updated['revision']
+
+
+def test_delta_lists_changed_folders(corpus):
+    from dive_server import crud_annotation
+    from girder.models.folder import Folder
+
+    from UMD_utils import UMD_export
+
+    _, files = zip_tabs(corpus)
+    baseManifest = json.loads(files['manifest.json'])
+    delta = UMD_export.delta_folders(corpus['folderIds'], corpus['user'], baseManifest)
+    assert delta['folders'] == []
+    assert sorted(delta['unchanged']) == sorted(corpus['folderIds'])
+
+    folder = Folder().load(corpus['folderIds'][1], force=True)
+    track = crud_annotation.TrackItem().list(folder).sort('id', -1).limit(1)[0]
+    crud_annotation.save_annotations(
+        folder,
+        corpus['user'],
+        upsert_tracks=[],
+        delete_tracks=[track['id']],
+        upsert_groups=[],
+        delete_groups=[],
+    )
+    delta = UMD_export.delta_folders(corpus['folderIds'], corpus['user'], baseManifest)
+    assert delta['folders'] == [corpus['folderIds'][1]]
+    assert [row[2] for row in delta['tombstones']] == ['segment']
+
+
+def test_delta_follows_the_filter_contents(corpus):
+    from UMD_utils import UMD_export
+    from UMD_utils.UMD_filter import filter_file_versions
+
+    filterFile = {'_id': 'filter', 'sha512': 'first', 'created': '2024-01-01', 'size': 10}
+    _, files = zip_tabs(corpus)
+    filterVersions = filter_file_versions([filterFile])
+    baseManifest = json.loads(files['manifest.json'])
+    baseManifest = json.loads(json.dumps(dict(baseManifest, filter=filterVersions)))
+    delta = UMD_export.delta_folders(
+        corpus['folderIds'], corpus['user'], baseManifest, filterVersions
+    )
+    assert delta['folders'] == []
+    # the filter file was replaced in place, keeping its id
+    filterVersions = filter_file_versions([dict(filterFile, sha512='second')])
+    delta = UMD_export.delta_folders(
+        corpus['folderIds'], corpus['user'], baseManifest, filterVersions
+    )
+    assert delta['folders'] == corpus['folderIds']
+
+
+def test_featureless_tracks_match_baseline(corpus):
+    from dive_server import crud_annotation
+    from girder.models.folder import Folder
+
+    folder = Folder().load(corpus['folderIds'][2], force=True)
+    track = crud_annotation.TrackItem().list(folder).sort('id', 1).limit(1)[0]
+    crud_annotation.save_annotations(
+        folder,
+        corpus['user'],
+        upsert_tracks=[track],
+        delete_tracks=[],
+        upsert_groups=[],
+        delete_groups=[],
+    )
+    # older annotations were saved without features
+    crud_annotation.TrackItem().collection.update_many(
+        {
+            crud_annotation.DATASET: folder['_id'],
+            crud_annotation.REVISION_DELETED: {'$exists': False},
+        },
+        {'$unset': {'features': ''}},
+    )
+    for name, _path, filtered in UMD_TABS:
+        expected = baseline_tab(name, corpus['folderIds'], corpus['user'], filtered)
+        assert export_tab(name, corpus['folderIds'], corpus['user'], filtered) == expected
+
+
+def assert_parquet_matches_tab(parquet, tab):
+    """Every parquet cell holds the value of the tab cell"""
+    import csv
+
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(io.BytesIO(parquet))
+    rows = list(csv.reader(io.StringIO(tab.decode()), delimiter='\t', quotechar='"'))
+    assert table.column_names == rows[0]
+    assert table.num_rows == len(rows) - 1
+    for row, cells in zip(table.to_pylist(), rows[1:]):
+        for value, cell in zip(row.values(), cells):
+            assert value is not None
+            if isinstance(value, str):
+                assert value == cell
+            else:
+                assert value == type(value)(cell)
+
+
+def test_parquet_keeps_tab_values(corpus):
+    from dive_server import crud_annotation
+    from girder.models.folder import Folder
+
+    from UMD_utils import UMD_export
+    from UMD_utils.UMD_users import UserMap
+
+    # an annotator without an account has the 'unknown' user id
+    folder = Folder().load(corpus['folderIds'][3], force=True)
+    track = crud_annotation.TrackItem().list(folder).sort('id', 1).limit(1)[0]
+    track['attributes']['parquettest_Valence'] = 250
+    track['attributes']['parquettest_Arousal'] = 750
+    track['attributes']['parquettest_Emotions'] = 'No emotions'
+    track['attributes']['parquettest_MultiSpeaker'] = 'no'
+    track['attributes']['parquettest_Norms'] = {'No Norm': 'noann', 'Apology': 'adhere'}
+    crud_annotation.save_annotations(
+        folder,
+        corpus['user'],
+        upsert_tracks=[track],
+        delete_tracks=[],
+        upsert_groups=[],
+        delete_groups=[],
+    )
+    tabs = unzip(UMD_export.convert_to_zips(corpus['folderIds'], UserMap(), corpus['user'], None))
+    parquets = unzip(
+        UMD_export.convert_to_zips(
+            corpus['folderIds'], UserMap(), corpus['user'], None, format='parquet'
+        )
+    )
+    for type in PARQUET_TABS:
+        path = TAB_PATHS[f'export_{type}_tab']
+        assert_parquet_matches_tab(parquets[UMD_export.tab_path(type, path, 'parquet')], tabs[path])
+    assert b'unknown' in tabs['data/norms.tab']
+    assert b'\tnone\t' in tabs['data/norms.tab']
+
+    tabs = unzip(UMD_export.convert_to_zips_TA2(corpus['ta2FolderIds'], UserMap(), corpus['user']))
+    parquets = unzip(
+        UMD_export.convert_to_zips_TA2(
+            corpus['ta2FolderIds'], UserMap(), corpus['user'], format='parquet'
+        )
+    )
+    assert_parquet_matches_tab(parquets['TA2.parquet'], tabs['TA2.tab'])
+
+
+def test_shards_are_cached_by_the_server(corpus, in_process_shards):
+    from UMD_utils import UMD_export
+    from UMD_utils.UMD_cache import export_fragment_cache
+    from UMD_utils.UMD_users import UserMap
+
+    export_fragment_cache.clear()
+    _, _, _, entries = UMD_export.export_shard(
+        corpus['folderIds'], UserMap(), corpus['user'], ['valence'], None, []
+    )
+    assert len(entries) == len(corpus['folderIds'])
+    assert export_fragment_cache.size == 0
+    zip_tabs(corpus)
+    assert export_fragment_cache.size > 0